@@ -0,0 +1,67 @@
+# Стоимость маршрутизации callback-запросов в зависимости от числа обработчиков:
+# цепочка фильтров startswith в aiogram против одного обработчика с CallbackRouter
+# Запуск: python benchmarks/bench_callbacks.py
+import asyncio
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, types
+
+from callbacks import CallbackRouter
+
+UPDATES = 3000
+
+async def noop(*args):
+    pass
+
+def filters_dispatcher(handler_count):
+    dp = Dispatcher()
+    for i in range(handler_count):
+        prefix = f"op{i}_"
+        dp.callback_query(lambda callback, prefix=prefix: callback.data.startswith(prefix))(noop)
+    return dp, f"op{handler_count - 1}_42"
+
+def router_dispatcher(handler_count):
+    dp = Dispatcher()
+    router = CallbackRouter()
+    for i in range(handler_count):
+        router.route(f"o{i}", int)(noop)
+
+    @dp.callback_query()
+    async def route_callback(callback: types.CallbackQuery):
+        await router.dispatch(callback)
+
+    return dp, router.pack(f"o{handler_count - 1}", 42)
+
+def make_update(update_id, data):
+    user = types.User(id=1, is_bot=False, first_name="U")
+    message = types.Message(message_id=1, date=datetime.datetime.now(),
+                            chat=types.Chat(id=1, type="private"), text="x")
+    callback = types.CallbackQuery(id=str(update_id), from_user=user, chat_instance="ci",
+                                   data=data, message=message)
+    return types.Update(update_id=update_id, callback_query=callback)
+
+async def measure(bot, dp, data):
+    updates = [make_update(i, data) for i in range(UPDATES)]
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / UPDATES
+
+async def main():
+    import logging
+    logging.disable(logging.INFO)
+    bot = Bot(token="123456:BENCHMARK")
+    print(f"{'обработчиков':>12} {'фильтры, мкс':>14} {'роутер, мкс':>13}")
+    for handler_count in (5, 20, 50, 100, 200):
+        filters_time = await measure(bot, *filters_dispatcher(handler_count))
+        router_time = await measure(bot, *router_dispatcher(handler_count))
+        print(f"{handler_count:>12} {filters_time * 1e6:>14.1f} {router_time * 1e6:>13.1f}")
+    await bot.session.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+# Сравнение скомпилированного каталога и корзины Cart с перебором словаря menu_items
+# Запуск: python benchmarks/bench_catalog.py [число товаров]
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import Cart, MenuCatalog
+
+def build_menu(total_items, items_per_category=100):
+    menu = {}
+    for i in range(total_items):
+        category = f"Категория {i // items_per_category}"
+        menu.setdefault(category, {})[f"Товар {i}"] = {
+            "price": 100 + i % 900, "description": "Описание", "photo": f"images/{i}.jpg"
+        }
+    return menu
+
+# Прежние реализации из bot.py
+def scan_total_price(menu_items, cart):
+    return sum(menu_items[cat][item]["price"] for cat in menu_items for item in cart if item in menu_items[cat])
+
+def scan_category(menu_items, item_name):
+    return next((cat for cat, items in menu_items.items() if item_name in items), None)
+
+def scan_items_page(menu_items, category, page, per_page):
+    items = list(menu_items[category].items())
+    return items[page * per_page:min((page + 1) * per_page, len(items))]
+
+def report(name, old_stmt, new_stmt, number):
+    old = min(timeit.repeat(old_stmt, number=number, repeat=5)) / number
+    new = min(timeit.repeat(new_stmt, number=number, repeat=5)) / number
+    print(f"{name:<22} dict: {old * 1e6:10.2f} мкс   catalog: {new * 1e6:8.3f} мкс   x{old / new:,.0f}")
+
+def main():
+    total_items = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    menu = build_menu(total_items)
+    catalog = MenuCatalog.from_dict(menu)
+    random.seed(1)
+    names = [item.name for item in catalog.items]
+    cart_names = random.choices(names, k=10)
+    cart = Cart()
+    for name in cart_names:
+        cart.add(catalog.find(name))
+    item = catalog.find(cart_names[0])
+    item_name = names[-1]
+    category = catalog.categories[-1]
+
+    def add_and_remove():
+        cart.add(item)
+        cart.add(item, -1)
+        return cart.total
+
+    print(f"Товаров: {total_items}, категорий: {len(catalog.categories)}, корзина: {len(cart_names)} позиций")
+    # Раньше сумма списка названий считалась заново после каждого изменения,
+    # теперь Cart.add поправляет её на месте, а полный пересчёт по ID - Cart.recalculate
+    report("изменение корзины", lambda: scan_total_price(menu, cart_names), add_and_remove, 20)
+    report("пересчёт корзины", lambda: scan_total_price(menu, cart_names), lambda: cart.recalculate(catalog), 20)
+    report("категория товара", lambda: scan_category(menu, item_name), lambda: catalog.find(item_name).category, 200)
+    report("страница товаров", lambda: scan_items_page(menu, category, 5, 3),
+           lambda: catalog.items_page(category, 5, 3), 2000)
+    build = min(timeit.repeat(lambda: MenuCatalog.from_dict(menu), number=1, repeat=3))
+    print(f"Сборка каталога: {build * 1e3:.1f} мс")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Отчёты по истории заказов: пакетная загрузка синтетических заказов
+# в OrderHistory, время /report за 7, 30 дней и за всё время по сравнению
+# с группировкой pandas и простым проходом по заказам, проверка совпадения
+# результатов и перезагрузка колонок с диска.
+# Запуск: python benchmarks/bench_history.py [--orders 1000000] [--days 365]
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from history import OrderHistory, SECONDS_PER_DAY
+
+UTC_OFFSET = 3
+ITEMS = 40
+SKU_BASE = 100000000
+
+
+def synthetic_orders(count, days, now):
+    rng = np.random.default_rng(1)
+    timestamps = np.sort(rng.integers(now - days * SECONDS_PER_DAY, now, count))
+    line_counts = rng.integers(1, 5, count)
+    order_index = np.repeat(np.arange(count), line_counts)
+    prices = rng.integers(100, 900, ITEMS).astype(np.float64)
+    # Популярность товаров неравномерная, как в настоящем меню
+    item_ids = rng.choice(ITEMS, len(order_index), p=np.arange(ITEMS, 0, -1) / (ITEMS * (ITEMS + 1) / 2))
+    quantities = rng.integers(1, 4, len(order_index))
+    line_totals = quantities * prices[item_ids]
+    orders = {
+        "ts": timestamps,
+        "total": np.bincount(order_index, weights=line_totals, minlength=count),
+        "items": np.bincount(order_index, weights=quantities, minlength=count),
+    }
+    # ID товаров - разреженные артикулы, как в меню из учётной системы
+    lines = {"order": order_index, "item_id": SKU_BASE + item_ids * 7919, "quantity": quantities,
+             "price": prices[item_ids]}
+    return orders, lines
+
+
+def timed(function, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def report_pandas(orders, lines, days, now):
+    import pandas as pd
+
+    offset = UTC_OFFSET * 3600
+    frame = pd.DataFrame(orders)
+    frame["day"] = (frame["ts"] + offset) // SECONDS_PER_DAY
+    today = (now + offset) // SECONDS_PER_DAY
+    period = frame[frame["day"] > today - days] if days else frame
+    line_frame = pd.DataFrame(lines)
+    line_frame = line_frame[line_frame["order"].isin(period.index)]
+    line_frame["revenue"] = line_frame["quantity"] * line_frame["price"]
+    by_item = line_frame.groupby("item_id")[["quantity", "revenue"]].sum().sort_values("quantity", ascending=False)
+    hourly = ((period["ts"] + offset) % SECONDS_PER_DAY // 3600).value_counts().reindex(range(24), fill_value=0)
+    return {
+        "revenue": float(period["total"].sum()),
+        "orders": len(period),
+        "top_items": [(int(item), int(row.quantity)) for item, row in by_item.head(5).iterrows()],
+        "hourly": hourly.tolist(),
+    }
+
+
+def report_scan(orders, lines, days, now):
+    offset = UTC_OFFSET * 3600
+    today = (now + offset) // SECONDS_PER_DAY
+    revenue, count, hourly, by_item = 0.0, 0, [0] * 24, Counter()
+    included = set()
+    for index, (ts, total) in enumerate(zip(orders["ts"].tolist(), orders["total"].tolist())):
+        if days and (ts + offset) // SECONDS_PER_DAY <= today - days:
+            continue
+        revenue += total
+        count += 1
+        hourly[(ts + offset) % SECONDS_PER_DAY // 3600] += 1
+        included.add(index)
+    for order, item, quantity in zip(lines["order"].tolist(), lines["item_id"].tolist(), lines["quantity"].tolist()):
+        if order in included:
+            by_item[item] += quantity
+    return {"revenue": revenue, "orders": count, "top_items": by_item.most_common(5), "hourly": hourly}
+
+
+def main(args):
+    now = int(time.time())
+    orders, lines = synthetic_orders(args.orders, args.days, now)
+    path = tempfile.mkdtemp(prefix="history-bench-")
+    history = OrderHistory(path, UTC_OFFSET).load()
+
+    started = time.perf_counter()
+    history.extend(orders, lines)
+    print(f"Заказов: {args.orders}, строк: {len(lines['order'])}, загрузка: {time.perf_counter() - started:.2f} с")
+    started = time.perf_counter()
+    asyncio.run(history.close())
+    print(f"Запись колонок на диск: {time.perf_counter() - started:.2f} с")
+
+    print(f"\n{'период':<12}{'OrderHistory, мс':>18}{'pandas, мс':>14}{'проход, мс':>14}")
+    for days in (7, 30, None):
+        result, history_time = timed(lambda: history.report(days, now=now))
+        expected, pandas_time = timed(lambda: report_pandas(orders, lines, days, now), repeat=1)
+        scanned, scan_time = timed(lambda: report_scan(orders, lines, days, now), repeat=1)
+        for other in (expected, scanned):
+            assert result["orders"] == other["orders"], "не совпадает число заказов"
+            assert abs(result["revenue"] - other["revenue"]) < 1e-6 * max(other["revenue"], 1), "не совпадает выручка"
+            assert [item for item, _, _ in result["top_items"]] == [item for item, _ in other["top_items"]], \
+                "не совпадают популярные блюда"
+            assert result["hourly"] == list(other["hourly"]), "не совпадает нагрузка по часам"
+        print(f"{days or 'всё время'!s:<12}{history_time * 1e3:>18.2f}{pandas_time * 1e3:>14.1f}{scan_time * 1e3:>14.1f}")
+
+    started = time.perf_counter()
+    reloaded = OrderHistory(path, UTC_OFFSET).load()
+    print(f"\nПерезагрузка с диска: {time.perf_counter() - started:.2f} с")
+    assert reloaded.report(30, now=now) == history.report(30, now=now), "история после перезагрузки отличается"
+    print("Отчёты совпадают с pandas и простым проходом")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк отчётов по истории заказов")
+    parser.add_argument("--orders", type=int, default=1000000, help="сколько синтетических заказов")
+    parser.add_argument("--days", type=int, default=365, help="за сколько дней распределить заказы")
+    main(parser.parse_args())
@@ -0,0 +1,115 @@
+# Подготовка фото меню: сжатие синтетических "фото с телефона" в варианты
+# card и preview одним потоком и пулом потоков, повторный запуск без
+# изменений (проверка подписи файла) и после изменения времени модификации
+# (проверка хэша содержимого). Для каждой категории - сколько байт экономят
+# варианты и оценка времени показа всех фото категории: отдельный send_photo
+# с исходным файлом на каждое блюдо против альбомов из preview-вариантов
+# (send_media_group, до 10 фото в запросе) при заданных задержке и скорости канала.
+# Запуск: python benchmarks/bench_images.py [--categories 4] [--items 8] [--workers 4]
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from images import ImagePipeline
+
+MEDIA_GROUP_LIMIT = 10
+
+
+# Плавный фон, несколько фигур и немного шума - похоже на фото блюда по
+# сжимаемости, в отличие от чистого шума или однотонной картинки
+def synthetic_photo(path, size, rng):
+    width, height = size
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    tint = Image.new("RGB", size, tuple(rng.randrange(60, 200) for _ in range(3)))
+    image = Image.blend(image, tint, 0.6)
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randrange(width // 20, width // 5)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(3))
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    Image.blend(image, noise, 0.12).save(path, "JPEG", quality=95)
+
+
+def build_timed(pipeline, photos):
+    started = time.perf_counter()
+    result = pipeline.build(photos)
+    return result, time.perf_counter() - started
+
+
+def main(args):
+    rng = random.Random(1)
+    work_dir = tempfile.mkdtemp(prefix="images-bench-")
+    categories = {}
+    for category in range(args.categories):
+        photos = []
+        for item in range(args.items):
+            path = os.path.join(work_dir, f"c{category}_i{item}.jpg")
+            synthetic_photo(path, (args.width, args.height), rng)
+            photos.append(path)
+        categories[f"Категория {category + 1}"] = photos
+    all_photos = [path for photos in categories.values() for path in photos]
+    source_bytes = sum(os.path.getsize(path) for path in all_photos)
+    print(f"Фото: {len(all_photos)} по {args.width}x{args.height}, всего {source_bytes / 2**20:.1f} МБ, "
+          f"ядер: {os.cpu_count()}")
+
+    print(f"\n{'запуск':<34}{'сжато':>8}{'пропущено':>12}{'время, с':>11}")
+    for workers in sorted({1, args.workers}):
+        output = os.path.join(work_dir, f"cache-{workers}")
+        result, seconds = build_timed(ImagePipeline(output, workers=workers).load(), all_photos)
+        print(f"{f'первый запуск, потоков: {workers}':<34}{result['encoded']:>8}{result['skipped']:>12}{seconds:>11.2f}")
+        assert result["encoded"] == len(all_photos) and not result["failed"], result
+
+    # Новый объект читает манифест с диска, как бот после перезапуска
+    pipeline = ImagePipeline(output, workers=args.workers).load()
+    result, seconds = build_timed(pipeline, all_photos)
+    print(f"{'повтор без изменений':<34}{result['encoded']:>8}{result['skipped']:>12}{seconds:>11.3f}")
+    assert result["skipped"] == len(all_photos), result
+    for path in all_photos:
+        os.utime(path)
+    result, seconds = build_timed(pipeline, all_photos)
+    print(f"{'изменено время файлов':<34}{result['encoded']:>8}{result['skipped']:>12}{seconds:>11.3f}")
+    assert result["skipped"] == len(all_photos), result
+
+    # Время загрузки: задержка запроса плюс передача файла по каналу
+    def upload_seconds(requests, total_bytes):
+        return requests * args.rtt_ms / 1000 + total_bytes * 8 / (args.uplink_mbit * 1e6)
+
+    print(f"\nОценка при задержке {args.rtt_ms} мс и канале {args.uplink_mbit} Мбит/с:")
+    print(f"{'категория':<14}{'исходники, КБ':>15}{'card, КБ':>10}{'preview, КБ':>13}"
+          f"{'экономия':>10}{'было, с':>9}{'стало, с':>10}")
+    for name, photos in categories.items():
+        original = sum(os.path.getsize(path) for path in photos)
+        card = sum(os.path.getsize(pipeline.variant(path, "card")) for path in photos)
+        preview = sum(os.path.getsize(pipeline.variant(path, "preview")) for path in photos)
+        before = upload_seconds(len(photos), original)
+        after = upload_seconds(math.ceil(len(photos) / MEDIA_GROUP_LIMIT), preview)
+        print(f"{name:<14}{original / 1024:>15.0f}{card / 1024:>10.0f}{preview / 1024:>13.0f}"
+              f"{1 - preview / original:>10.0%}{before:>9.2f}{after:>10.2f}")
+        assert card < original and preview < card
+
+    shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк подготовки фото меню")
+    parser.add_argument("--categories", type=int, default=4, help="сколько категорий")
+    parser.add_argument("--items", type=int, default=8, help="сколько блюд в категории")
+    parser.add_argument("--width", type=int, default=3000, help="ширина исходного фото")
+    parser.add_argument("--height", type=int, default=2000, help="высота исходного фото")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="потоков сжатия")
+    parser.add_argument("--rtt-ms", type=float, default=150, help="задержка запроса к Bot API, мс")
+    parser.add_argument("--uplink-mbit", type=float, default=20, help="скорость канала до Bot API, Мбит/с")
+    main(parser.parse_args())
@@ -0,0 +1,62 @@
+# Время запуска бота: разбор python -X importtime для "import bot".
+# Показывает общее время импорта, самые тяжёлые пакеты верхнего уровня
+# и проверяет, что gspread и oauth2client не загружаются при старте
+# (модуль sheets импортируется в фоне уже после запуска опроса).
+# Запуск: python benchmarks/bench_import.py [--runs 5] [--top 15]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ("gspread", "oauth2client", "sheets")
+
+
+def import_times(module):
+    env = dict(os.environ, TOKEN=os.environ.get("TOKEN") or "123456:IMPORT-BENCH", PYTHONPATH=ROOT,
+               MENU_PATH=os.path.join(ROOT, "menu.json"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=tempfile.mkdtemp(prefix="import-bench-"), env=env,
+        capture_output=True, text=True, check=True,
+    )
+    # Строки вида "import time:  self [us] | cumulative | imported package"
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return times
+
+
+def main(args):
+    runs = [import_times("bot") for _ in range(args.runs)]
+    totals = [next(cumulative for name, _, _, cumulative in times if name == "bot") for times in runs]
+    print(f"import bot: медиана {statistics.median(totals) / 1e3:.1f} мс, "
+          f"мин {min(totals) / 1e3:.1f} мс (запусков: {args.runs})")
+
+    # Разбивка по последнему запуску: прямые зависимости bot и пакеты верхнего уровня
+    times = runs[-1]
+    top_level = [(name, cumulative) for name, depth, _, cumulative in times if depth <= 1]
+    top_level.sort(key=lambda entry: entry[1], reverse=True)
+    print(f"\n{'модуль':<40}{'мс':>10}")
+    for name, cumulative in top_level[:args.top]:
+        print(f"{name:<40}{cumulative / 1e3:>10.1f}")
+
+    loaded = sorted({name.split(".")[0] for name, _, _, _ in times} & set(LAZY_MODULES))
+    if loaded:
+        print(f"\nПри старте загружены ленивые модули: {', '.join(loaded)}")
+        sys.exit(1)
+    lazy = next(cumulative for name, _, _, cumulative in import_times("sheets") if name == "sheets")
+    print(f"\nОтложено до фоновой загрузки: {lazy / 1e3:.1f} мс (sheets с gspread и oauth2client)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Разбор времени импорта бота")
+    parser.add_argument("--runs", type=int, default=5, help="сколько раз запускать импорт")
+    parser.add_argument("--top", type=int, default=15, help="сколько самых тяжёлых модулей показать")
+    main(parser.parse_args())
@@ -0,0 +1,98 @@
+# Поиск по меню: время построения индекса и ответа на запрос для синтетического
+# меню из нескольких тысяч товаров - без кэша, из LRU-кэша и простым перебором
+# всех товаров по подстроке для сравнения.
+# Запуск: python benchmarks/bench_search.py [--items 5000] [--queries 2000]
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from functools import lru_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from catalog import MenuCatalog
+from search import MenuSearchIndex, normalize
+
+DISHES = ["пицца", "бургер", "ролл", "суши", "салат", "суп", "паста", "шаурма", "лапша", "пирог",
+          "стейк", "вок", "сэндвич", "блин", "десерт", "торт", "напиток", "лимонад", "кофе", "чай"]
+WORDS = ["маргарита", "пепперони", "цезарь", "греческий", "филадельфия", "калифорния", "терияки",
+         "карбонара", "болоньезе", "острый", "сырный", "куриный", "говяжий", "лосось", "тунец",
+         "креветки", "грибной", "овощной", "шоколадный", "ванильный", "клубничный", "домашний",
+         "фирменный", "большой", "детский", "двойной", "классический", "веганский", "копчёный", "томатный"]
+
+
+def synthetic_catalog(size, rng):
+    categories = []
+    for category_id, dish in enumerate(DISHES):
+        items = []
+        for item_id in range(category_id, size, len(DISHES)):
+            name = f"{dish.capitalize()} {' '.join(rng.sample(WORDS, 2))} №{item_id}"
+            description = " ".join(rng.sample(WORDS, 6))
+            items.append({"id": item_id, "name": name, "price": rng.randrange(100, 1000), "description": description})
+        categories.append({"id": category_id, "name": dish.capitalize(), "items": items})
+    return MenuCatalog(categories)
+
+
+def typo(word, rng):
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:] if rng.random() < 0.5 else word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def synthetic_queries(count, rng):
+    kinds = {
+        "начало слова": lambda: rng.choice(DISHES + WORDS)[:rng.randint(2, 5)],
+        "два слова": lambda: f"{rng.choice(DISHES)} {rng.choice(WORDS)}",
+        "опечатка": lambda: typo(rng.choice(WORDS), rng),
+    }
+    return {kind: [make() for _ in range(count)] for kind, make in kinds.items()}
+
+
+def scan(catalog, query):
+    query_words = normalize(query).split()
+    return [item.id for item in catalog.items
+            if all(word in normalize(item.name + " " + item.description) for word in query_words)]
+
+
+def latencies(function, queries):
+    times = []
+    for query in queries:
+        started = time.perf_counter()
+        function(query)
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return statistics.median(times) * 1e3, times[int(len(times) * 0.99)] * 1e3
+
+
+def main(args):
+    rng = random.Random(1)
+    catalog = synthetic_catalog(args.items, rng)
+    started = time.perf_counter()
+    index = MenuSearchIndex(catalog)
+    print(f"Товаров: {len(index)}, слов в индексе: {len(index.vocabulary)}, "
+          f"построение индекса: {(time.perf_counter() - started) * 1e3:.1f} мс")
+
+    cached = lru_cache(maxsize=2048)(index.search)
+    print(f"\n{'запрос':<16}{'индекс p50/p99, мс':>22}{'кэш p50/p99, мс':>20}{'перебор p50, мс':>18}")
+    for kind, queries in synthetic_queries(args.queries, rng).items():
+        index_p50, index_p99 = latencies(index.search, queries)
+        for query in queries:
+            cached(query)
+        cached_p50, cached_p99 = latencies(cached, queries)
+        scan_p50, _ = latencies(lambda query: scan(catalog, query), queries[:50])
+        print(f"{kind:<16}{index_p50:>11.3f}/{index_p99:.3f}{cached_p50:>12.4f}/{cached_p99:.4f}{scan_p50:>18.2f}")
+        # По точным словам индекс находит всё, что находит перебор
+        if kind == "два слова":
+            for query in queries[:50]:
+                assert set(scan(catalog, query)) <= set(index.search(query)), query
+
+    assert index.search(typo("филадельфия", rng)), "не найдено слово с опечаткой"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска по меню")
+    parser.add_argument("--items", type=int, default=5000, help="сколько товаров в меню")
+    parser.add_argument("--queries", type=int, default=2000, help="сколько запросов каждого вида")
+    main(parser.parse_args())
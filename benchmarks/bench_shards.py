@@ -0,0 +1,234 @@
+# Пропускная способность многопроцессного режима: бот запускается как отдельный
+# процесс (python bot.py, webhook) с BOT_WORKERS рабочими процессами против
+# локальной заглушки Bot API. Синтетические клиенты присылают webhook-обновления
+# полного оформления заказа (меню -> категория -> блюдо -> корзина -> данные ->
+# подтверждение), затем администратор подтверждает каждый заказ дважды -
+# обычной и срочной кнопкой из уведомления администратору. Проверяется, что каждый
+# заказ подтверждён ровно один раз и в общей базе не осталось неподтверждённых заказов.
+# Запуск: python benchmarks/bench_shards.py [--workers 1 2 4] [--users 300] [--concurrency 40]
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("MENU_PATH", os.path.join(ROOT, "menu.json"))
+os.environ.setdefault("TOKEN", "123456:SHARDS-BENCH")
+os.chdir(tempfile.mkdtemp(prefix="shards-bench-"))
+
+import logging
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+import bot as bot_module
+from orders import ORDER_PENDING
+
+STEPS_PER_ORDER = 10
+WEBHOOK_SECRET = "bench-secret"
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.message_ids = itertools.count(1)
+        self.requests = 0
+        self.new_orders = 0
+        self.confirmed = 0
+        self.rejected = 0
+        # Телефон из уведомления администратору -> callback_data его кнопок
+        self.admin_buttons = {}
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.requests += 1
+        fields = await request.post()
+        text = fields.get("text") or fields.get("caption") or ""
+        if method == "answerCallbackQuery":
+            if "подтверждён и отправлен" in text:
+                self.confirmed += 1
+            elif "не найден" in text:
+                self.rejected += 1
+        if not method.startswith(("send", "edit")):
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(fields.get("chat_id", 0))
+        if chat_id == bot_module.ADMIN_ID and "Новый заказ" in text:
+            self.new_orders += 1
+            buttons = {button["text"]: button["callback_data"]
+                       for row in json.loads(fields["reply_markup"])["inline_keyboard"] for button in row}
+            phone = re.search(r"Телефон: (\S+)", text).group(1)
+            self.admin_buttons[phone] = buttons
+        result = {"message_id": next(self.message_ids), "date": int(time.time()),
+                  "chat": {"id": chat_id, "type": "private"}}
+        if method == "sendPhoto":
+            result["photo"] = [{"file_id": f"photo-{result['message_id']}", "file_unique_id": "u",
+                                "width": 1, "height": 1}]
+        else:
+            result["text"] = text
+        return web.json_response({"ok": True, "result": result})
+
+
+class Clients:
+    def __init__(self, url, concurrency):
+        self.url = url
+        self.headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+        self.update_ids = itertools.count(1)
+        self.connections = asyncio.Semaphore(concurrency)
+        self.session = None
+
+    def user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": "Клиент", "username": f"user{user_id}"}
+
+    async def post(self, update):
+        async with self.connections:
+            async with self.session.post(self.url, json=update, headers=self.headers) as response:
+                assert response.status == 200, f"webhook ответил {response.status}"
+
+    async def message(self, user_id, text):
+        update_id = next(self.update_ids)
+        await self.post({"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id), "text": text}})
+
+    async def callback(self, user_id, data, message_id=None):
+        update_id = next(self.update_ids)
+        await self.post({"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": self.user(user_id), "chat_instance": "bench", "data": data,
+            "message": {"message_id": message_id or update_id, "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"}, "text": "bench"}}})
+
+    # Обновления одного клиента отправляются по очереди, как их присылает Telegram
+    async def place_order(self, user_id, item):
+        cb = bot_module.cb
+        await self.message(user_id, "🍔 Меню")
+        await self.callback(user_id, cb("c", bot_module.menu_catalog.category_ids[item.category]))
+        await self.callback(user_id, cb("i", item.id))
+        await self.callback(user_id, cb("a", item.id))
+        await self.message(user_id, "🛒 Корзина")
+        await self.callback(user_id, cb("co"))
+        await self.message(user_id, "Клиент")
+        await self.message(user_id, phone_of(user_id))
+        await self.message(user_id, "ул. Тестовая, 1")
+        await self.callback(user_id, cb("ok"))
+
+    async def confirm(self, buttons, message_id):
+        await self.callback(bot_module.ADMIN_ID, buttons["✅ Подтвердить заказ"], message_id)
+        await self.callback(bot_module.ADMIN_ID, buttons["🚨 Срочно на кухню"], message_id + 1)
+
+
+def phone_of(user_id):
+    return f"+7999{user_id:07d}"
+
+
+async def wait_until(condition, timeout, what):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"не дождались: {what}")
+        await asyncio.sleep(0.01)
+
+
+async def run(workers, args, api, api_url, port):
+    work_dir = tempfile.mkdtemp(prefix=f"shards-{workers}-")
+    for item in bot_module.menu_catalog.items:
+        if item.photo:
+            os.makedirs(os.path.join(work_dir, os.path.dirname(item.photo)), exist_ok=True)
+            with open(os.path.join(work_dir, item.photo), "wb") as f:
+                f.write(b"\xff\xd8\xff\xd9")
+    env = dict(
+        os.environ, BOT_MODE="webhook", WEBHOOK_URL=f"http://127.0.0.1:{port}", WEBHOOK_HOST="127.0.0.1",
+        WEBHOOK_PORT=str(port), WEBHOOK_SECRET=WEBHOOK_SECRET, BOT_WORKERS=str(workers), SHARD_BASE_PORT=str(port + 1),
+        BOT_API_URL=api_url, SEND_GLOBAL_RATE="1000000", SEND_CHAT_RATE="1000000", SEND_CHAT_BURST="1000000",
+        KITCHEN_BATCH_WINDOW="0", SHEETS_WARMUP_DELAY="3600", MENU_RELOAD_INTERVAL="3600",
+    )
+    log = open(os.path.join(work_dir, "bot.log"), "w")
+    process = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "bot.py"),
+                                                   env=env, cwd=work_dir, stdout=log, stderr=log)
+    clients = Clients(f"http://127.0.0.1:{port}/webhook", args.concurrency)
+    clients.session = ClientSession()
+    try:
+        # Главный процесс готов, когда отвечает /metrics; прогревочный заказ
+        # проходит через все рабочие процессы после их запуска
+        async def front_ready():
+            try:
+                async with clients.session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                    return response.status == 200
+            except OSError:
+                return False
+        deadline = time.monotonic() + 30
+        while not await front_ready():
+            assert time.monotonic() < deadline, f"бот не запустился, см. {log.name}"
+            await asyncio.sleep(0.1)
+        api.__init__()
+        warmup_users = range(1, workers + 1)
+        await asyncio.gather(*(clients.place_order(user_id, bot_module.menu_catalog.items[0])
+                               for user_id in warmup_users))
+        await wait_until(lambda: api.new_orders == workers, 60, "прогревочных заказов")
+        await asyncio.gather(*(clients.confirm(api.admin_buttons[phone_of(user_id)], 1) for user_id in warmup_users))
+        await wait_until(lambda: api.confirmed + api.rejected == 2 * workers, 30, "подтверждения прогрева")
+
+        api.__init__()
+        rng = random.Random(workers)
+        user_ids = range(1000, 1000 + args.users)
+        started = time.perf_counter()
+        await asyncio.gather(*(clients.place_order(user_id, rng.choice(bot_module.menu_catalog.items))
+                               for user_id in user_ids))
+        await wait_until(lambda: api.new_orders == args.users, 120, "уведомлений о заказах")
+        order_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await asyncio.gather(*(clients.confirm(api.admin_buttons[phone_of(user_id)], 1000) for user_id in user_ids))
+        await wait_until(lambda: api.confirmed + api.rejected == 2 * args.users, 60, "подтверждений")
+        confirm_time = time.perf_counter() - started
+    finally:
+        await clients.session.close()
+        process.send_signal(2)
+        await asyncio.wait_for(process.wait(), 60)
+        log.close()
+
+    assert api.confirmed == args.users, f"подтверждено {api.confirmed} заказов из {args.users}"
+    assert api.rejected == args.users, f"отклонено повторных подтверждений: {api.rejected} из {args.users}"
+    if workers > 1:
+        with sqlite3.connect(os.path.join(work_dir, "orders.db")) as conn:
+            left = conn.execute("SELECT COUNT(*) FROM orders WHERE status = ?", (ORDER_PENDING,)).fetchone()[0]
+        assert left == 0, f"в базе осталось неподтверждённых заказов: {left}"
+    with sqlite3.connect(os.path.join(work_dir, "sheets_outbox.db")) as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+    assert rows == args.users + workers, f"строк для Google Sheets: {rows}"
+    return args.users * STEPS_PER_ORDER / order_time, args.users / order_time, 2 * args.users / confirm_time
+
+
+async def main(args):
+    logging.disable(logging.INFO)
+    api = FakeBotAPI()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    server = TestServer(app)
+    await server.start_server()
+    api_url = str(server.make_url("")).rstrip("/")
+
+    print(f"Клиентов: {args.users}, соединений: {args.concurrency}, ядер: {os.cpu_count()}")
+    print(f"{'процессов':<12}{'обновлений/с':>14}{'заказов/с':>12}{'подтверждений/с':>18}")
+    for index, workers in enumerate(args.workers):
+        port = args.port + index * 20
+        updates_rate, orders_rate, confirm_rate = await run(workers, args, api, api_url, port)
+        print(f"{workers:<12}{updates_rate:>14.1f}{orders_rate:>12.1f}{confirm_rate:>18.1f}")
+    print("Каждый заказ подтверждён ровно один раз")
+    await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк многопроцессного режима бота")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="сколько рабочих процессов")
+    parser.add_argument("--users", type=int, default=300, help="число синтетических клиентов")
+    parser.add_argument("--concurrency", type=int, default=40, help="одновременных webhook-запросов")
+    parser.add_argument("--port", type=int, default=18080, help="порт webhook главного процесса")
+    asyncio.run(main(parser.parse_args()))
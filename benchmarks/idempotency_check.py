@@ -0,0 +1,141 @@
+# Проверка идемпотентности: параллельные повторы нажатий "Да, всё верно"
+# и "Подтвердить заказ" (двойной клик, повторная доставка того же callback-запроса,
+# нажатие обычного и срочного подтверждения одновременно) должны дать ровно одно
+# уведомление администратору, один тикет на кухню и одну запись в Google Sheets.
+# Второй прогон выполняется без кэша повторов - только на замках заказов.
+# Запуск: python benchmarks/idempotency_check.py
+import asyncio
+import datetime
+import itertools
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("MENU_PATH", os.path.join(ROOT, "menu.json"))
+os.environ.setdefault("TOKEN", "123456:IDEMPOTENCY-CHECK")
+os.environ["SEND_GLOBAL_RATE"] = "1000000"
+os.environ["SEND_CHAT_RATE"] = "1000000"
+os.environ["SEND_CHAT_BURST"] = "1000000"
+os.environ["KITCHEN_BATCH_WINDOW"] = "0"
+os.chdir(tempfile.mkdtemp(prefix="idempotency-check-"))
+
+import logging
+
+from aiogram import types
+from aiogram.client.session.base import BaseSession
+
+import bot as bot_module
+from orders import ORDER_CONFIRMED
+
+DUPLICATES = 20
+# Задержка ответа Bot API, чтобы обработчики повторов успевали перемешаться
+API_DELAY = 0.005
+
+
+class FakeSession(BaseSession):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    async def make_request(self, bot, method, timeout=None):
+        await asyncio.sleep(API_DELAY)
+        chat_id = getattr(method, "chat_id", None)
+        text = getattr(method, "text", None)
+        if chat_id is not None and text is not None:
+            self.sent.append((chat_id, text))
+        if type(method).__name__.startswith("Send"):
+            return types.Message(message_id=1, date=datetime.datetime.now(),
+                                 chat=types.Chat(id=chat_id, type="private"), text=text or "")
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+
+update_ids = itertools.count(1)
+
+
+def user(user_id):
+    return types.User(id=user_id, is_bot=False, first_name="Клиент", username=f"user{user_id}")
+
+
+async def message(user_id, text):
+    update_id = next(update_ids)
+    await bot_module.dp.feed_update(bot_module.bot, types.Update(update_id=update_id, message=types.Message(
+        message_id=update_id, date=datetime.datetime.now(), chat=types.Chat(id=user_id, type="private"),
+        from_user=user(user_id), text=text)))
+
+
+def callback_update(user_id, data, message_id, callback_id=None):
+    update_id = next(update_ids)
+    return types.Update(update_id=update_id, callback_query=types.CallbackQuery(
+        id=callback_id or str(update_id), from_user=user(user_id), chat_instance="check", data=data,
+        message=types.Message(message_id=message_id, date=datetime.datetime.now(),
+                              chat=types.Chat(id=user_id, type="private"), text="check")))
+
+
+async def press_in_parallel(updates):
+    await asyncio.gather(*(bot_module.dp.feed_update(bot_module.bot, update) for update in updates))
+    await bot_module.send_queue.drain()
+
+
+async def check_order(session, user_id, phone):
+    item = bot_module.menu_catalog.items[0]
+    await bot_module.dp.feed_update(bot_module.bot, callback_update(user_id, bot_module.cb("a", item.id), 1))
+    await bot_module.dp.feed_update(bot_module.bot, callback_update(user_id, bot_module.cb("co"), 2))
+    await message(user_id, "Клиент")
+    await message(user_id, phone)
+    await message(user_id, "ул. Проверочная, 1")
+
+    # Двойные нажатия одной кнопки и повторная доставка одного callback-запроса
+    confirm = [callback_update(user_id, bot_module.cb("ok"), 3) for _ in range(DUPLICATES)]
+    confirm += [callback_update(user_id, bot_module.cb("ok"), 3, callback_id="same") for _ in range(3)]
+    await press_in_parallel(confirm)
+    admin_messages = [text for chat_id, text in session.sent
+                      if chat_id == bot_module.ADMIN_ID and "Новый заказ" in text and phone in text]
+
+    # Администратор жмёт "Подтвердить" несколько раз и "Срочно" в другом сообщении
+    admin_id = bot_module.ADMIN_ID
+    order_id = bot_module.order_store.user_orders(user_id, 0, 1)[0]["id"]
+    approve = [callback_update(admin_id, bot_module.cb("ac", order_id), 10) for _ in range(DUPLICATES)]
+    approve += [callback_update(admin_id, bot_module.cb("au", order_id), 11) for _ in range(DUPLICATES)]
+    await press_in_parallel(approve)
+    kitchen_tickets = [text for chat_id, text in session.sent
+                       if chat_id == bot_module.KITCHEN_ID and "на кухню" in text and phone in text]
+    sheet_rows = [row for _, row in bot_module.sheets_outbox.peek(1000) if row[1] == phone]
+
+    print(f"Повторов: {len(confirm)} + {len(approve)}; уведомлений администратору: {len(admin_messages)}, "
+          f"тикетов на кухню: {len(kitchen_tickets)}, записей в Google Sheets: {len(sheet_rows)}")
+    assert len(admin_messages) == 1, "заказ оформлен несколько раз"
+    assert len(kitchen_tickets) == 1, "несколько тикетов на кухню"
+    assert len(sheet_rows) == 1, "несколько записей в Google Sheets"
+    assert bot_module.order_store.count_user_orders(user_id) == 1, "заказ оформлен несколько раз"
+    assert bot_module.order_store.get(order_id)["status"] == ORDER_CONFIRMED, "заказ не подтверждён"
+
+
+async def main():
+    logging.disable(logging.INFO)
+    session = FakeSession()
+    session.middleware = bot_module.bot.session.middleware
+    bot_module.bot.session = session
+
+    print("С кэшем повторов и замками заказов:")
+    await check_order(session, 101, "+79990000101")
+
+    print("Только замки заказов (кэш повторов отключён):")
+    bot_module.callback_router.dedup = None
+    await check_order(session, 102, "+79990000102")
+
+    assert not len(bot_module.order_locks), "замки заказов не освобождены"
+    print("Все повторы обработаны ровно один раз")
+    await bot_module.storage.close()
+    await bot_module.order_store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,274 @@
+# Нагрузочный тест без сети: диспетчер бота работает против локальной
+# заглушки Bot API (aiohttp) и таблицы в памяти вместо Google Sheets.
+# Синтетические клиенты проходят весь путь заказа: меню -> категория -> блюдо ->
+# добавление в корзину -> оформление -> подтверждение, после чего заказ
+# подтверждает администратор. В конце печатается пропускная способность,
+# задержка обработчиков p50/p95/p99 по шагам и рост памяти.
+# Запуск: python benchmarks/load_test.py --users 500 --concurrency 50 --api-latency 5
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("MENU_PATH", os.path.join(ROOT, "menu.json"))
+WORK_DIR = tempfile.mkdtemp(prefix="load-test-")
+os.environ.setdefault("TOKEN", "123456:LOAD-TEST")
+# Лимиты Telegram в тесте не нужны: меряем сам бот, а не ожидание в очереди
+os.environ.setdefault("SEND_GLOBAL_RATE", "1000000")
+os.environ.setdefault("SEND_CHAT_RATE", "1000000")
+os.environ.setdefault("SEND_CHAT_BURST", "1000000")
+os.environ.setdefault("KITCHEN_BATCH_WINDOW", "1")
+os.environ.setdefault("SHEETS_FLUSH_DELAY", "0.2")
+os.chdir(WORK_DIR)
+
+import logging
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aiogram import types
+from aiogram.client.telegram import TelegramAPIServer
+
+import bot as bot_module
+from sheets import SheetsClient
+
+
+class FakeBotAPI:
+    def __init__(self, latency):
+        self.latency = latency
+        self.message_ids = itertools.count(1)
+        self.requests = defaultdict(int)
+        # Последняя inline-клавиатура в каждом чате и все сообщения администратору
+        self.markups = {}
+        self.admin_messages = []
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.requests[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        fields = await request.post()
+        if not method.startswith(("send", "edit")):
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(fields.get("chat_id", 0))
+        markup = json.loads(fields.get("reply_markup", "null") or "null")
+        text = fields.get("text") or fields.get("caption") or ""
+        if markup and "inline_keyboard" in markup:
+            self.markups[chat_id] = markup
+            if chat_id == bot_module.ADMIN_ID:
+                self.admin_messages.append((text, markup))
+        result = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if method == "sendPhoto":
+            result["photo"] = [{"file_id": f"photo-{result['message_id']}", "file_unique_id": "u",
+                                "width": 1, "height": 1}]
+            result["caption"] = text
+        else:
+            result["text"] = text
+        return web.json_response({"ok": True, "result": result})
+
+    def button(self, chat_id, text=None):
+        for row in self.markups[chat_id]["inline_keyboard"]:
+            for button in row:
+                if text is None or text in button["text"]:
+                    return button["callback_data"]
+        raise KeyError(f"нет кнопки {text!r} в чате {chat_id}")
+
+    # Уведомление администратору идёт через очередь отправки, поэтому его ждём
+    async def admin_button(self, phone, text, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for message_text, markup in reversed(self.admin_messages):
+                if phone in message_text:
+                    for row in markup["inline_keyboard"]:
+                        for button in row:
+                            if text in button["text"]:
+                                return button["callback_data"]
+            await asyncio.sleep(0.01)
+        raise KeyError(f"нет уведомления администратору о заказе {phone}")
+
+
+class FakeWorksheet:
+    def __init__(self):
+        self.rows = [["Имя", "Телефон", "Адрес", "Заказ", "Сумма"]]
+
+    def col_values(self, col):
+        return [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+    def batch_update(self, updates):
+        for update in updates:
+            row = int(re.match(r"A(\d+)", update["range"]).group(1))
+            self.rows[row - 1] = list(update["values"][0])
+
+    def append_rows(self, rows, **kwargs):
+        start = len(self.rows) + 1
+        self.rows += [list(row) for row in rows]
+        return {"updates": {"updatedRange": f"Sheet1!A{start}:E{len(self.rows)}"}}
+
+
+class LoadTest:
+    def __init__(self, api):
+        self.api = api
+        self.update_ids = itertools.count(1)
+        self.latencies = defaultdict(list)
+        self.errors = 0
+
+    def user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": "Клиент", "username": f"user{user_id}"}
+
+    async def feed(self, step, update):
+        started = time.perf_counter()
+        try:
+            await bot_module.dp.feed_update(bot_module.bot, types.Update(**update))
+        except Exception as e:
+            self.errors += 1
+            print(f"Ошибка на шаге {step}: {e}")
+        self.latencies[step].append(time.perf_counter() - started)
+
+    async def message(self, step, user_id, text):
+        update_id = next(self.update_ids)
+        await self.feed(step, {"update_id": update_id, "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+            "text": text,
+        }})
+
+    async def callback(self, step, user_id, data):
+        update_id = next(self.update_ids)
+        await self.feed(step, {"update_id": update_id, "callback_query": {
+            "id": str(update_id),
+            "from": self.user(user_id),
+            "chat_instance": "load-test",
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "load-test",
+            },
+        }})
+
+    async def place_order(self, user_id):
+        api = self.api
+        phone = f"+7999{user_id:07d}"
+        await self.message("menu", user_id, "🍔 Меню")
+        await self.callback("category", user_id, api.button(user_id))
+        await self.callback("item", user_id, api.button(user_id))
+        await self.callback("add_to_cart", user_id, api.button(user_id, "Добавить"))
+        await self.message("cart", user_id, "🛒 Корзина")
+        await self.callback("checkout", user_id, api.button(user_id, "Оформить"))
+        await self.message("name", user_id, "Клиент")
+        await self.message("phone", user_id, phone)
+        await self.message("address", user_id, "ул. Тестовая, 1")
+        await self.callback("confirm_order", user_id, api.button(user_id, "верно"))
+        await self.callback("admin_confirm_order", bot_module.ADMIN_ID,
+                            await api.admin_button(phone, "Подтвердить заказ"))
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1e3
+
+
+async def main(args):
+    logging.disable(logging.INFO)
+    # Заглушки фото меню, чтобы первая отправка шла загрузкой файла, а дальше по file_id
+    for item in bot_module.menu_catalog.items:
+        if item.photo:
+            os.makedirs(os.path.dirname(item.photo) or ".", exist_ok=True)
+            with open(item.photo, "wb") as f:
+                f.write(b"\xff\xd8\xff\xd9")
+
+    api = FakeBotAPI(args.api_latency / 1e3)
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    server = TestServer(app)
+    await server.start_server()
+    bot_module.bot.session.api = TelegramAPIServer.from_base(str(server.make_url("")).rstrip("/"))
+
+    worksheet = FakeWorksheet()
+    tasks = [
+        asyncio.create_task(bot_module.sheets_outbox_worker(
+            bot_module.sheets_outbox, SheetsClient(lambda: worksheet), notify_errors=False)),
+        asyncio.create_task(bot_module.order_store.run()),
+        asyncio.create_task(bot_module.storage.run()),
+    ]
+
+    test = LoadTest(api)
+    # Прогрев: импорт ленивых модулей, кэши рендеров и фото
+    await test.place_order(1)
+    test.latencies.clear()
+    gc.collect()
+    rss_before = current_rss_mb()
+
+    user_ids = iter(range(1000, 1000 + args.users))
+
+    async def client():
+        for user_id in user_ids:
+            await test.place_order(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    rss_after = current_rss_mb()
+
+    bot_module.kitchen_batcher.flush()
+    await bot_module.send_queue.drain()
+    deadline = time.monotonic() + 10
+    while len(worksheet.rows) < args.users + 2 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+
+    for task in tasks:
+        task.cancel()
+    await bot_module.storage.close()
+    await bot_module.order_store.close()
+    await server.close()
+
+    updates = sum(len(values) for values in test.latencies.values())
+    print(f"Клиентов: {args.users}, параллельно: {args.concurrency}, задержка API: {args.api_latency} мс")
+    print(f"Заказов в секунду: {args.users / elapsed:.1f}, обновлений в секунду: {updates / elapsed:.1f} "
+          f"({elapsed:.2f} с, ошибок: {test.errors})")
+    print(f"{'шаг':<22}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    all_latencies = []
+    for step, values in test.latencies.items():
+        values.sort()
+        all_latencies += values
+        print(f"{step:<22}{percentile(values, 0.5):>10.2f}{percentile(values, 0.95):>10.2f}"
+              f"{percentile(values, 0.99):>10.2f}")
+    all_latencies.sort()
+    print(f"{'все обновления':<22}{percentile(all_latencies, 0.5):>10.2f}"
+          f"{percentile(all_latencies, 0.95):>10.2f}{percentile(all_latencies, 0.99):>10.2f}")
+    print(f"Память: {rss_before:.1f} -> {rss_after:.1f} МБ "
+          f"(+{(rss_after - rss_before) * 1024 / args.users:.1f} КБ на заказ)")
+    print(f"Запросов к Bot API: {sum(api.requests.values())}, строк в таблице: {len(worksheet.rows) - 1}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота без сети")
+    parser.add_argument("--users", type=int, default=200, help="число синтетических клиентов")
+    parser.add_argument("--concurrency", type=int, default=20, help="сколько клиентов действуют одновременно")
+    parser.add_argument("--api-latency", type=float, default=0, help="задержка ответа Bot API, мс")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,131 @@
+# Локальная проверка режима webhook: синтетические обновления отправляются
+# POST-запросами на aiohttp-приложение бота, запросы к Bot API подменяются
+# заглушкой. Проверяется секретный токен, пачка с некорректным обновлением
+# (как от главного процесса), скорость ответа Telegram, порядок
+# обработки обновлений одного пользователя и то, что медленный клиент
+# не задерживает остальных.
+# Запуск: python benchmarks/webhook_check.py
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("MENU_PATH", os.path.join(ROOT, "menu.json"))
+os.environ.setdefault("TOKEN", "123456:WEBHOOK-CHECK")
+os.environ["WEBHOOK_SECRET"] = "check-secret"
+os.chdir(tempfile.mkdtemp(prefix="webhook-check-"))
+
+import logging
+
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+from aiogram import types
+from aiogram.client.session.base import BaseSession
+
+import bot as bot_module
+
+USERS = 50
+MESSAGES_PER_USER = 10
+SLOW_USER = 1
+SLOW_DELAY = 1.0
+
+
+class FakeSession(BaseSession):
+    async def make_request(self, bot, method, timeout=None):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id == SLOW_USER:
+            await asyncio.sleep(SLOW_DELAY)
+        if type(method).__name__.startswith("Send"):
+            return types.Message(message_id=1, date=datetime.datetime.now(),
+                                 chat=types.Chat(id=chat_id or 0, type="private"), text="ok")
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+
+def make_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "text": text,
+        },
+    }
+
+
+async def main():
+    logging.disable(logging.INFO)
+    bot_module.bot.session = FakeSession()
+    pool = bot_module.UpdateWorkerPool(bot_module.dp, bot_module.bot)
+
+    handled = defaultdict(list)
+    finished_at = {}
+    feed_update = bot_module.dp.feed_update
+
+    async def recording_feed_update(bot, update):
+        await feed_update(bot, update)
+        user_id = update.message.from_user.id
+        handled[user_id].append(update.update_id)
+        finished_at[user_id] = time.perf_counter()
+
+    pool.dispatcher = type("RecordingDispatcher", (), {"feed_update": staticmethod(recording_feed_update)})()
+    server = TestServer(bot_module.create_webhook_app(pool))
+    await server.start_server()
+    url = str(server.make_url(bot_module.WEBHOOK_PATH))
+    headers = {"X-Telegram-Bot-Api-Secret-Token": "check-secret"}
+
+    async with ClientSession() as session:
+        async with session.post(url, json=make_update(1, 2, "/start"), headers={}) as response:
+            assert response.status == 401, response.status
+        print("Запрос без секретного токена отклонён: 401")
+
+        update_id = 1
+        expected = defaultdict(list)
+        expected[1].append(update_id)
+        batch = [{"update_id": 0, "message": {"text": "без отправителя и чата"}}, make_update(update_id, 1, "/start")]
+        async with session.post(url, json=batch, headers=headers) as response:
+            assert response.status == 200, response.status
+        print("Некорректное обновление в пачке пропущено, остальные приняты")
+
+        ack_times = []
+        started = time.perf_counter()
+        for _ in range(MESSAGES_PER_USER):
+            for user_id in range(1, USERS + 1):
+                update_id += 1
+                expected[user_id].append(update_id)
+                sent = time.perf_counter()
+                async with session.post(url, json=make_update(update_id, user_id, "/start"),
+                                        headers=headers) as response:
+                    assert response.status == 200, response.status
+                ack_times.append(time.perf_counter() - sent)
+
+        await pool.stop()
+        total = time.perf_counter() - started
+    await server.close()
+
+    ack_times.sort()
+    print(f"Обновлений: {update_id}, ответ Telegram p50 {ack_times[len(ack_times) // 2] * 1e3:.2f} мс, "
+          f"p99 {ack_times[int(len(ack_times) * 0.99)] * 1e3:.2f} мс")
+    assert all(handled[user_id] == expected[user_id] for user_id in expected), "нарушен порядок обработки"
+    print("Обновления каждого пользователя обработаны по порядку")
+    others = max(finished_at[user_id] for user_id in finished_at if user_id != SLOW_USER) - started
+    print(f"Медленный клиент: {finished_at[SLOW_USER] - started:.2f} с, остальные закончили за {others:.2f} с "
+          f"(всего {total:.2f} с)")
+    assert others < SLOW_DELAY * MESSAGES_PER_USER, "медленный клиент задержал остальных"
+    await bot_module.storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
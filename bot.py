@@ -1,16 +1,39 @@
 import logging
 import asyncio
 import os
+import sys
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
-from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent, InputMediaPhoto
+from aiogram.filters import Command, CommandObject
+from aiogram.methods import SendMessage, GetUpdates
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from dotenv import load_dotenv
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import re
+from catalog import MenuCatalog, MenuError, Cart, load_menu_file
+from callbacks import CallbackRouter
+from search import MenuSearchIndex
+from idempotency import DedupCache, KeyedLocks
+from history import OrderHistory
+from images import ImagePipeline, available as images_available
+from orders import JournalOrderStore, SqliteOrderStore, ORDER_PENDING, ORDER_CONFIRMED
+from storage import SqliteStorage
+from send_queue import create_send_queue, PRIORITY_KITCHEN, PRIORITY_ADMIN, PRIORITY_INFO
+from metrics import Metrics, HandlerMetricsMiddleware, RequestTimerMiddleware
+from shards import ShardRouter, ShardProcesses
+import hmac
+import importlib
 import json
+import sqlite3
+import time
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Загрузка переменных окружения из файла .env
 load_dotenv()
@@ -18,68 +41,277 @@ TOKEN = os.getenv("TOKEN")
 if not TOKEN:
     raise ValueError("Токен бота не найден в файле .env!")
 
-# Инициализация бота и диспетчера
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# Инициализация бота и диспетчера. BOT_API_URL - адрес своего сервера Bot API
+# (по умолчанию api.telegram.org)
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None)
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Несколько процессов бота (BOT_WORKERS > 1): главный процесс принимает обновления
+# и раздаёт их рабочим процессам по ID пользователя (shards.py). Рабочий процесс
+# получает свой номер в BOT_SHARD и принимает обновления на 127.0.0.1:SHARD_BASE_PORT + номер.
+# Заказы тогда хранятся в общей SQLite-базе ORDERS_DB_PATH
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+BOT_SHARD = int(os.getenv("BOT_SHARD")) if os.getenv("BOT_SHARD") else None
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8100"))
+SHARD_SECRET = os.getenv("SHARD_SECRET", "")
 
 # ID администратора и кухни
 ADMIN_ID = 5333876903
 KITCHEN_ID = 5333876903
 
+# Заказы подтверждает администратор, поэтому в многопроцессном режиме историю
+# заказов ведёт и фото меню готовит только процесс, в который попадают его
+# обновления. Остальные процессы только перечитывают готовый манифест фото
+CONFIRMING_PROCESS = BOT_WORKERS == 1 or BOT_SHARD == ADMIN_ID % BOT_WORKERS
+
+# Все исходящие запросы проходят через ограничитель частоты (общий лимит и лимит
+# на чат), а уведомления администратору и кухне - через очередь с приоритетами.
+# Общий лимит Telegram делится поровну между процессами бота. Так же делится
+# лимит чата администратора: о новых заказах ему пишет каждый процесс. Кухне
+# пишет только CONFIRMING_PROCESS, её лимит не делится
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "25"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+send_queue = create_send_queue(
+    bot, SEND_GLOBAL_RATE / BOT_WORKERS, SEND_CHAT_RATE, SEND_CHAT_BURST,
+    chat_limits={ADMIN_ID: (SEND_CHAT_RATE / BOT_WORKERS, max(1, SEND_CHAT_BURST // BOT_WORKERS))},
+)
+
+# Метрики обработчиков и ввода-вывода. В режиме webhook /metrics отдаётся тем же
+# сервером, в режиме polling - отдельным на METRICS_PORT (0 - не запускать).
+# Обработчики дольше SLOW_HANDLER_THRESHOLD секунд пишутся в лог со стеком
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+SLOW_HANDLER_THRESHOLD = float(os.getenv("SLOW_HANDLER_THRESHOLD", "1.0"))
+bot_metrics = Metrics()
+bot.session.middleware(RequestTimerMiddleware(bot_metrics))
+
+# Состояния оформления заказа и корзины хранятся в SQLite и переживают перезапуск.
+# Брошенные сессии и корзины удаляются по истечении срока хранения
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "bot_state.db")
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(24 * 3600)))
+CART_TTL = int(os.getenv("CART_TTL", str(7 * 24 * 3600)))
+STATE_HOT_SIZE = int(os.getenv("STATE_HOT_SIZE", "10000"))
+storage = SqliteStorage(STATE_DB_PATH, ttl=SESSION_TTL, hot_size=STATE_HOT_SIZE)
+user_carts = storage.table("carts", ttl=CART_TTL)
+dp = Dispatcher(storage=storage)
+
+# Маршрутизация callback-запросов. Коды операций:
+# cp - страница категорий, c - категория, ip - страница товаров, bc - к категориям,
+# cv - фото всех блюд категории, i - карточка товара, a - добавить в корзину,
+# co - оформить заказ, cc - очистить корзину,
+# ok/no - клиент подтвердил/отменил заказ, mo - страница "Мои заказы",
+# rl/ro - повторить последний/выбранный заказ,
+# ac/au - подтверждение заказа админом (обычное/срочное), ae - редактирование, ct - связаться с клиентом,
+# en/eph/ead/eca - изменить ФИО/телефон/адрес/состав, ce - сохранить изменения.
+# Операции с заказом получают его номер
+# Повторные нажатия кнопок, меняющих состояние заказа (помечены once=True),
+# в течение CALLBACK_DEDUP_TTL секунд не обрабатываются, а изменения одного
+# заказа выполняются под замком order_locks
+CALLBACK_DEDUP_TTL = float(os.getenv("CALLBACK_DEDUP_TTL", "30"))
+callback_router = CallbackRouter(dedup=DedupCache(CALLBACK_DEDUP_TTL))
+cb = callback_router.pack
+order_locks = KeyedLocks()
+
+# Все кнопки обрабатывает один route_callback, поэтому в метриках
+# нажатие записывается под именем обработчика своей операции
+def handler_metric_name(event, data):
+    if isinstance(event, types.CallbackQuery):
+        parsed = callback_router.unpack(event.data)
+        if parsed:
+            return callback_router.handlers[parsed[0]].__name__
+
+handler_metrics_middleware = HandlerMetricsMiddleware(bot_metrics, SLOW_HANDLER_THRESHOLD, handler_metric_name)
+dp.message.middleware(handler_metrics_middleware)
+dp.callback_query.middleware(handler_metrics_middleware)
+dp.inline_query.middleware(handler_metrics_middleware)
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+
 # Главное меню
 menu_keyboard = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="🍔 Меню"), KeyboardButton(text="🛒 Корзина")],
+        [KeyboardButton(text="📦 Мои заказы")],
         [KeyboardButton(text="📞 Контакты"), KeyboardButton(text="ℹ️ О нас")]
     ],
     resize_keyboard=True
 )
 
-# Меню с товарами
-menu_items = {
-    "Суши": {
-        "Суши с лососем": {"price": 600, "description": "Свежий лосось, рис, нори.", "photo": "images/sushi_salmon.jpg"},
-        "Суши с тунцом": {"price": 650, "description": "Нежный тунец с остринкой.", "photo": "images/sushi_tuna.jpg"}
-    },
-    "Бургеры": {
-        "Бургер с говядиной": {"price": 350, "description": "Сочная говядина, овощи, соус.", "photo": "images/beef_burger.jpg"},
-        "Бургер с курицей": {"price": 320, "description": "Хрустящая курица и майонез.", "photo": "images/chicken_burger.jpg"},
-        "Фирменные картофельные дольки": {"price": 250, "description": "Золотистые дольки со специями.", "photo": "images/potato_wedges.jpg"}
-    },
-    "Пицца": {
-        "Пицца Маргарита": {"price": 450, "description": "Томаты, моцарелла, базилик.", "photo": "images/margherita.jpg"},
-        "Пицца Пепперони": {"price": 500, "description": "Острая пепперони и сыр.", "photo": "images/pepperoni.jpg"}
-    },
-    "Холодные блюда": {
-        "Греческий салат": {"price": 350, "description": "Оливки, фета, огурцы.", "photo": "images/greek_salad.jpg"},
-        "Цезарь с курицей": {"price": 400, "description": "Курица, сухарики, пармезан.", "photo": "images/caesar.jpg"}
-    },
-    "Напитки": {
-        "Напиток Coca-Cola 0.5л": {"price": 150, "description": "Освежающая кола.", "photo": "images/coca_cola.jpg"}
-    }
-}
+# Меню с товарами загружается из файла MENU_PATH (JSON или YAML) и перечитывается
+# без перезапуска: раз в MENU_RELOAD_INTERVAL секунд проверяется, изменился ли файл
+MENU_PATH = os.getenv("MENU_PATH", "menu.json")
+MENU_RELOAD_INTERVAL = float(os.getenv("MENU_RELOAD_INTERVAL", "5"))
+menu_categories, menu_digest = load_menu_file(MENU_PATH)
+menu_catalog = MenuCatalog(menu_categories)
+menu_search = MenuSearchIndex(menu_catalog)
 
 # Константы и структуры данных
 ITEMS_PER_PAGE = 3
-user_carts = {}
 
-# Функции для работы с заказами в JSON
-def load_orders():
+# Кэш file_id фотографий меню: после первой загрузки Telegram возвращает file_id,
+# и дальше фото отправляется по нему без повторной загрузки файла.
+# Запись действительна, пока у файла не изменились время модификации и размер.
+# file_id привязан к боту, поэтому при смене токена кэш сбрасывается
+PHOTO_CACHE_PATH = os.getenv("PHOTO_CACHE_PATH", "photo_cache.json")
+PHOTO_PREWARM_CHAT_ID = os.getenv("PHOTO_PREWARM_CHAT_ID")
+
+class PhotoCache:
+    def __init__(self, path, bot_id):
+        self.path = path
+        self.bot_id = bot_id
+        self.photos = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("bot_id") == bot_id:
+                self.photos = data.get("photos", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    @staticmethod
+    def signature(photo_path):
+        stat = os.stat(photo_path)
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    # Возвращает file_id или FSInputFile, если файл ещё не загружался или изменился
+    def get(self, photo_path):
+        entry = self.photos.get(photo_path)
+        if entry and entry["signature"] == self.signature(photo_path):
+            return entry["file_id"]
+        return FSInputFile(photo_path)
+
+    def remember(self, photo_path, message):
+        if not message.photo:
+            return
+        self.photos[photo_path] = {
+            "signature": self.signature(photo_path),
+            "file_id": message.photo[-1].file_id,
+        }
+        self.save()
+
+    def forget(self, photo_path):
+        if self.photos.pop(photo_path, None):
+            self.save()
+
+    # Временный файл свой у каждого процесса бота
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"bot_id": self.bot_id, "photos": self.photos}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+photo_cache = PhotoCache(PHOTO_CACHE_PATH, bot.id)
+
+# Сжатые варианты фото меню (images.py): card - для карточки товара, preview -
+# для альбома категории. Готовятся при запуске и после перезагрузки меню;
+# пока вариант не готов, отправляется исходный файл
+IMAGES_CACHE_DIR = os.getenv("IMAGES_CACHE_DIR", "images_cache")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "0"))
+image_pipeline = ImagePipeline(IMAGES_CACHE_DIR, workers=IMAGE_WORKERS).load()
+
+async def build_menu_images():
+    if not images_available():
+        print("Pillow не установлен, фото меню отправляются без сжатия")
+        return
+    photos = sorted({item.photo for item in menu_catalog.items if item.photo})
+    with bot_metrics.io_timer("images"):
+        result = await asyncio.to_thread(image_pipeline.build, photos)
+    for path in result["obsolete"]:
+        photo_cache.forget(path)
+    if result["encoded"] or result["missing"] or result["failed"]:
+        print(f"Фото меню: сжато {result['encoded']}, без изменений {result['skipped']}, "
+              f"не найдено {len(result['missing'])}, ошибок {len(result['failed'])} "
+              f"за {result['seconds']:.1f} с")
+
+# Варианты фото, подготовленные процессом CONFIRMING_PROCESS
+async def image_manifest_watcher():
+    while True:
+        await asyncio.to_thread(image_pipeline.refresh)
+        await asyncio.sleep(MENU_RELOAD_INTERVAL)
+
+async def send_menu_photo(chat_id, photo_path, **kwargs):
+    photo = photo_cache.get(photo_path)
     try:
-        with open("orders.json", "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
-def save_orders(orders_dict):
-    with open("orders.json", "w") as f:
-        json.dump(orders_dict, f)
-
-orders = load_orders()
+        message = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+    except TelegramBadRequest:
+        if isinstance(photo, FSInputFile):
+            raise
+        # file_id больше не принимается - загружаем файл заново
+        photo_cache.forget(photo_path)
+        photo = FSInputFile(photo_path)
+        message = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+    if isinstance(photo, FSInputFile):
+        photo_cache.remember(photo_path, message)
+    return message
+
+# Альбом из 2-10 фото одним запросом. photos - [(путь, подпись)]
+async def send_menu_media_group(chat_id, photos):
+    media = [photo_cache.get(photo_path) for photo_path, _ in photos]
+    try:
+        messages = await bot.send_media_group(chat_id=chat_id, media=[
+            InputMediaPhoto(media=photo, caption=caption) for photo, (_, caption) in zip(media, photos)])
+    except TelegramBadRequest:
+        if all(isinstance(photo, FSInputFile) for photo in media):
+            raise
+        # Какой-то file_id больше не принимается - загружаем все файлы заново
+        for photo_path, _ in photos:
+            photo_cache.forget(photo_path)
+        media = [FSInputFile(photo_path) for photo_path, _ in photos]
+        messages = await bot.send_media_group(chat_id=chat_id, media=[
+            InputMediaPhoto(media=photo, caption=caption) for photo, (_, caption) in zip(media, photos)])
+    for (photo_path, _), photo, message in zip(photos, media, messages):
+        if isinstance(photo, FSInputFile):
+            photo_cache.remember(photo_path, message)
+    return messages
+
+# Предварительная загрузка фото меню в служебный чат, чтобы первый клиент
+# тоже получил фото по file_id. Запускается после подготовки вариантов
+async def prewarm_photo_cache(chat_id):
+    await build_menu_images()
+    for item in menu_catalog.items:
+        if not item.photo:
+            continue
+        for name in image_pipeline.variants:
+            photo_path = image_pipeline.variant(item.photo, name)
+            try:
+                if not isinstance(photo_cache.get(photo_path), FSInputFile):
+                    continue
+                message = await send_menu_photo(chat_id, photo_path, disable_notification=True)
+                await bot.delete_message(chat_id, message.message_id)
+            except Exception as e:
+                print(f"Не удалось загрузить фото {photo_path}: {e}")
+
+# Хранилище заказов с постоянными номерами и индексами по пользователю,
+# телефону и статусу (orders.py). Один процесс хранит их в журнале
+# (JournalOrderStore), несколько процессов бота (BOT_WORKERS > 1) - в общей
+# SQLite-базе (SqliteOrderStore)
+ORDERS_JOURNAL_PATH = os.getenv("ORDERS_JOURNAL_PATH", "orders.journal")
+ORDERS_LEGACY_PATH = "orders.json"
+ORDERS_FSYNC_INTERVAL = float(os.getenv("ORDERS_FSYNC_INTERVAL", "0.05"))
+ORDERS_COMPACT_MIN_RECORDS = 1000
+ORDERS_DB_PATH = os.getenv("ORDERS_DB_PATH", "orders.db")
+# Заказов на странице "Мои заказы" и в ответе /orders
+MY_ORDERS_PER_PAGE = 5
+PHONE_ORDERS_LIMIT = 10
+
+if BOT_WORKERS > 1:
+    order_store = SqliteOrderStore(ORDERS_DB_PATH, legacy_path=ORDERS_JOURNAL_PATH, metrics=bot_metrics)
+else:
+    if SqliteOrderStore.stored_orders(ORDERS_DB_PATH):
+        raise SystemExit(f"В {ORDERS_DB_PATH} есть заказы многопроцессного режима: запустите бота "
+                         "с BOT_WORKERS > 1 или перенесите базу, иначе номера заказов начнутся заново")
+    order_store = JournalOrderStore(ORDERS_JOURNAL_PATH, legacy_path=ORDERS_LEGACY_PATH,
+                                    fsync_interval=ORDERS_FSYNC_INTERVAL,
+                                    compact_min_records=ORDERS_COMPACT_MIN_RECORDS, metrics=bot_metrics)
+order_store.load()
+
+# История подтверждённых заказов для отчётов /report (колонки NumPy на диске).
+# Часы и дни в отчётах считаются по времени UTC+HISTORY_UTC_OFFSET
+HISTORY_PATH = os.getenv("HISTORY_PATH", "order_history")
+HISTORY_UTC_OFFSET = float(os.getenv("HISTORY_UTC_OFFSET", "3"))
+order_history = OrderHistory(HISTORY_PATH, HISTORY_UTC_OFFSET).load() if CONFIRMING_PROCESS else None
 
 # Состояния для оформления заказа
 class Order(StatesGroup):
@@ -97,55 +329,195 @@ class EditOrder(StatesGroup):
     edit_cart = State()
     confirm_edit = State()
 
-# Работа с Google Sheets
-def get_google_sheet():
+# Работа с Google Sheets. Клиент таблицы (модуль sheets с gspread) загружается
+# в фоне через SHEETS_WARMUP_DELAY секунд после запуска или при первом заказе
+SHEETS_INDEX_RECONCILE_INTERVAL = int(os.getenv("SHEETS_INDEX_RECONCILE_INTERVAL", "600"))
+SHEETS_WARMUP_DELAY = float(os.getenv("SHEETS_WARMUP_DELAY", "5"))
+
+# Все вызовы gspread блокирующие, поэтому выполняются в отдельном потоке.
+# Поток один: так кэш листа и индекс телефонов не нужно защищать блокировками
+sheets_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheets")
+
+async def run_in_sheets_thread(func, *args):
+    loop = asyncio.get_running_loop()
+    with bot_metrics.io_timer("sheets"):
+        return await loop.run_in_executor(sheets_executor, func, *args)
+
+async def load_sheets_client():
+    loop = asyncio.get_running_loop()
+    sheets = await loop.run_in_executor(sheets_executor, importlib.import_module, "sheets")
+    sheets_client = sheets.SheetsClient(sheets.get_google_sheet)
+    # Сразу подключаемся к таблице и строим индекс телефонов
     try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name('google_credentials.json', scope)
-        client = gspread.authorize(creds)
-        sheet = client.open('FoodDeliveryCustomers').sheet1
-        return sheet
+        await run_in_sheets_thread(sheets_client.reconcile)
     except Exception as e:
-        print(f"Ошибка при подключении к Google Sheets: {e}")
-        return None
-
-def find_order_in_sheet(phone):
-    sheet = get_google_sheet()
-    if not sheet:
-        return None
-    all_records = sheet.get_all_values()
-    for i, row in enumerate(all_records, start=1):
-        if len(row) > 1 and row[1] == phone:
-            return i
-    return None
-
-async def update_or_add_order_to_sheet(order_data):
-    try:
-        sheet = get_google_sheet()
-        if not sheet:
-            await bot.send_message(ADMIN_ID, "⚠️ Не удалось подключиться к Google Sheets!")
-            return
-        phone = order_data[1]
-        row_index = find_order_in_sheet(phone)
-        if row_index:
-            sheet.update(f"A{row_index}:E{row_index}", [order_data])
-            print(f"Заказ с телефоном {phone} обновлен в Google Sheets!")
+        print(f"Ошибка подключения к Google Sheets: {e}")
+    return sheets_client
+
+# Очередь записи в Google Sheets (outbox): подтверждения пишутся в локальную
+# SQLite-базу, а фоновая задача пачками переносит их в таблицу
+SHEETS_OUTBOX_PATH = os.getenv("SHEETS_OUTBOX_PATH", "sheets_outbox.db")
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "50"))
+SHEETS_FLUSH_DELAY = float(os.getenv("SHEETS_FLUSH_DELAY", "2"))
+SHEETS_RETRY_MIN_DELAY = 5
+SHEETS_RETRY_MAX_DELAY = 300
+
+class SheetsOutbox:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, phone TEXT NOT NULL, row TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        self.wakeup = asyncio.Event()
+        if len(self):
+            self.wakeup.set()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def add(self, row):
+        self.conn.execute("INSERT INTO outbox (phone, row) VALUES (?, ?)",
+                          (row[1], json.dumps(row, ensure_ascii=False)))
+        self.conn.commit()
+        self.wakeup.set()
+
+    def peek(self, limit):
+        cursor = self.conn.execute("SELECT id, row FROM outbox ORDER BY id LIMIT ?", (limit,))
+        return [(entry_id, json.loads(row)) for entry_id, row in cursor]
+
+    def ack(self, ids):
+        self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(entry_id,) for entry_id in ids])
+        self.conn.commit()
+
+async def sheets_outbox_worker(outbox, sheets_client=None, notify_errors=True):
+    retry_delay = SHEETS_RETRY_MIN_DELAY
+    failing = False
+    # Записи других процессов бота не будят wakeup, поэтому очередь проверяется по таймеру
+    poll_interval = SHEETS_FLUSH_DELAY if BOT_WORKERS > 1 else SHEETS_INDEX_RECONCILE_INTERVAL
+    last_reconcile = time.monotonic()
+    if sheets_client is None:
+        try:
+            await asyncio.wait_for(outbox.wakeup.wait(), timeout=SHEETS_WARMUP_DELAY)
+        except asyncio.TimeoutError:
+            pass
+        sheets_client = await load_sheets_client()
+    while True:
+        try:
+            await asyncio.wait_for(outbox.wakeup.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            if len(outbox):
+                outbox.wakeup.set()
+                continue
+            if time.monotonic() - last_reconcile < SHEETS_INDEX_RECONCILE_INTERVAL:
+                continue
+            # Пока заказов нет, сверяем индекс телефонов с таблицей
+            last_reconcile = time.monotonic()
+            try:
+                await run_in_sheets_thread(sheets_client.reconcile)
+            except Exception as e:
+                print(f"Ошибка сверки индекса Google Sheets: {e}")
+            continue
+        # Небольшая задержка, чтобы собрать подтверждения в одну пачку
+        await asyncio.sleep(SHEETS_FLUSH_DELAY)
+        batch = outbox.peek(SHEETS_BATCH_SIZE)
+        if not batch:
+            outbox.wakeup.clear()
+            continue
+
+        try:
+            await run_in_sheets_thread(sheets_client.flush, [row for _, row in batch])
+        except Exception as e:
+            print(f"Ошибка записи в Google Sheets, повтор через {retry_delay} с: {e}")
+            if notify_errors and not failing:
+                send_queue.submit(SendMessage(
+                    chat_id=ADMIN_ID,
+                    text=f"⚠️ Ошибка при работе с Google Sheets: {e}\n"
+                         f"Заказы сохранены и будут отправлены повторно."
+                ), PRIORITY_INFO)
+            failing = True
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, SHEETS_RETRY_MAX_DELAY)
+            continue
+
+        outbox.ack([entry_id for entry_id, _ in batch])
+        failing = False
+        retry_delay = SHEETS_RETRY_MIN_DELAY
+        if len(batch) < SHEETS_BATCH_SIZE and not len(outbox):
+            outbox.wakeup.clear()
+
+sheets_outbox = SheetsOutbox(SHEETS_OUTBOX_PATH)
+
+def update_or_add_order_to_sheet(order_data):
+    with bot_metrics.io_timer("sheets_outbox"):
+        sheets_outbox.add(order_data)
+
+# Корзины хранятся как {"items": [[ID товара, количество], ...], "total": сумма},
+# а в заказе вместе с ними сохраняются готовые строки "Название × количество"
+CART_LINE_RE = re.compile(r"^(.+?)\s*[×xх*]\s*(\d+)$")
+
+def format_cart_lines(cart):
+    return [f"{item.name} × {quantity}" for item, quantity in cart.lines(menu_catalog)]
+
+# Название и количество из готовой строки заказа, без обращения к меню:
+# блюдо могли убрать из меню после оформления заказа
+def split_cart_line(line):
+    match = CART_LINE_RE.match(line.strip())
+    if match:
+        return match.group(1), int(match.group(2))
+    return line.strip(), 1
+
+# Разбор состава заказа из текста: по строке на позицию, "Название" или
+# "Название × 2". Возвращает корзину и строки, которые не удалось распознать
+def parse_cart_lines(lines):
+    cart = Cart()
+    unknown = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        name, quantity = line, 1
+        match = CART_LINE_RE.match(line)
+        if match and not menu_catalog.find(line):
+            name, quantity = match.group(1), int(match.group(2))
+        item = menu_catalog.find(name)
+        if item and quantity > 0:
+            cart.add(item, quantity)
         else:
-            sheet.append_row(order_data)
-            print(f"Новый заказ с телефоном {phone} добавлен в Google Sheets!")
-    except Exception as e:
-        await bot.send_message(ADMIN_ID, f"⚠️ Ошибка при работе с Google Sheets: {e}")
-        print(f"Ошибка: {e}")
-
-# Расчет общей стоимости корзины
-def calculate_total_price(cart):
-    return sum(menu_items[cat][item]["price"] for cat in menu_items for item in cart if item in menu_items[cat])
-
-# Уведомления администратора и кухни
-async def notify_admin(order_data, phone, username):
+            unknown.append(line)
+    return cart, unknown
+
+def load_cart(user_id):
+    data = user_carts.get(user_id)
+    if data is None:
+        return Cart()
+    if isinstance(data, list):
+        # Корзина в старом формате - список названий
+        return parse_cart_lines(data)[0]
+    cart = Cart.from_json(data)
+    # Сумма считалась по ценам другого файла меню. Сравнивается хэш файла,
+    # а не номер версии каталога: номер начинается с 1 при каждом запуске
+    if data.get("menu_digest") != menu_digest:
+        cart.recalculate(menu_catalog)
+    return cart
+
+def save_cart(user_id, cart):
+    user_carts.set(user_id, {**cart.to_json(), "menu_digest": menu_digest})
+
+def order_cart(order_data):
+    if "items" in order_data:
+        return Cart.from_json(order_data["items"])
+    return parse_cart_lines(order_data.get("cart", []))[0]
+
+# Уведомления администратора и кухни. Отправляются простым текстом: имя
+# и адрес клиента со "*" или "_" сломали бы разметку Markdown
+async def notify_admin(order_data, order_id, username):
     try:
         message = (
-            f"📦 *Новый заказ!*\n\n"
+            f"📦 Новый заказ №{order_id}!\n\n"
             f"👤 Имя: {order_data[0]}\n"
             f"📞 Телефон: {order_data[1]}\n"
             f"🏠 Адрес: {order_data[2]}\n"
@@ -154,18 +526,19 @@ async def notify_admin(order_data, phone, username):
             f"👤 Username: @{username}"
         )
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Подтвердить заказ", callback_data=f"confirm_{phone}")],
-            [InlineKeyboardButton(text="✏️ Редактировать заказ", callback_data=f"edit_{phone}")],
-            [InlineKeyboardButton(text="📞 Связаться с клиентом", callback_data=f"contact_{phone}")]
+            [InlineKeyboardButton(text="✅ Подтвердить заказ", callback_data=cb("ac", order_id))],
+            [InlineKeyboardButton(text="🚨 Срочно на кухню", callback_data=cb("au", order_id))],
+            [InlineKeyboardButton(text="✏️ Редактировать заказ", callback_data=cb("ae", order_id))],
+            [InlineKeyboardButton(text="📞 Связаться с клиентом", callback_data=cb("ct", order_id))]
         ])
-        await bot.send_message(ADMIN_ID, message, reply_markup=keyboard, parse_mode="Markdown")
+        send_queue.submit(SendMessage(chat_id=ADMIN_ID, text=message, reply_markup=keyboard), PRIORITY_ADMIN)
     except Exception as e:
         print(f"Ошибка уведомления администратора: {e}")
 
-async def notify_kitchen(order_data, username):
+async def notify_kitchen(order_data, order_id, username):
     try:
         message = (
-            f"🔥 *Заказ на кухню!*\n\n"
+            f"🔥 Заказ №{order_id} на кухню!\n\n"
             f"👤 Имя: {order_data[0]}\n"
             f"📞 Телефон: {order_data[1]}\n"
             f"🏠 Адрес: {order_data[2]}\n"
@@ -173,189 +546,548 @@ async def notify_kitchen(order_data, username):
             f"💰 Сумма: {order_data[4]}₽\n\n"
             f"👤 Username: @{username}"
         )
-        await bot.send_message(KITCHEN_ID, message, parse_mode="Markdown")
+        send_queue.submit(SendMessage(chat_id=KITCHEN_ID, text=message), PRIORITY_KITCHEN)
     except Exception as e:
         print(f"Ошибка уведомления кухни: {e}")
 
+# Сводные тикеты для кухни: подтверждённые заказы копятся KITCHEN_BATCH_WINDOW
+# секунд и уходят одним сообщением с общим количеством каждого блюда.
+# Срочные заказы отправляются сразу, при остановке бота окно сбрасывается
+KITCHEN_BATCH_WINDOW = float(os.getenv("KITCHEN_BATCH_WINDOW", "30"))
+KITCHEN_MESSAGE_LIMIT = 4000
+
+class KitchenBatcher:
+    def __init__(self, window):
+        self.window = window
+        self.orders = []
+        self.timer = None
+
+    async def add(self, order_data, urgent=False):
+        if urgent or self.window <= 0:
+            await notify_kitchen([
+                order_data["name"],
+                order_data["phone"],
+                order_data["address"],
+                "\n".join(order_data["cart"]),
+                order_data["total_price"]
+            ], order_data["id"], order_data.get("username", ""))
+            return
+        self.orders.append(order_data)
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.orders = self.orders, []
+        if not batch:
+            return
+        try:
+            for message in self.digest_messages(batch):
+                send_queue.submit(SendMessage(chat_id=KITCHEN_ID, text=message), PRIORITY_KITCHEN)
+        except Exception as e:
+            print(f"Ошибка уведомления кухни: {e}")
+
+    @staticmethod
+    def digest_messages(batch):
+        totals = {}
+        for order_data in batch:
+            for name, quantity in map(split_cart_line, order_data["cart"]):
+                totals[name] = totals.get(name, 0) + quantity
+
+        header = (
+            f"🔥 Заказы на кухню: {len(batch)}\n\n"
+            "🍳 Всего приготовить:\n" + "\n".join(f"{name} × {quantity}" for name, quantity in totals.items()) +
+            "\n\n📋 По заказам:"
+        )
+        order_lines = [
+            f"{number}. №{order_data['id']} {order_data['name']}, {order_data['phone']}, {order_data['address']}\n"
+            f"    {', '.join(order_data['cart'])} — {order_data['total_price']}₽"
+            for number, order_data in enumerate(batch, start=1)
+        ]
+
+        # Сводка без разметки: имена и адреса клиентов могут содержать * и _,
+        # из-за которых Telegram отклонил бы всё сообщение.
+        # Длинную сводку делим на несколько сообщений по лимиту Telegram
+        messages = []
+        current = header
+        for line in order_lines:
+            if len(current) + len(line) + 1 > KITCHEN_MESSAGE_LIMIT:
+                messages.append(current)
+                current = "📋 По заказам (продолжение):"
+            current += "\n" + line
+        messages.append(current)
+        return messages
+
+kitchen_batcher = KitchenBatcher(KITCHEN_BATCH_WINDOW)
+
+# Все нажатия на inline-кнопки проходят через один обработчик
+@dp.callback_query()
+async def route_callback(callback: types.CallbackQuery, state: FSMContext):
+    if not await callback_router.dispatch(callback, state):
+        await callback.answer("Кнопка устарела, откройте меню заново.", show_alert=True)
+
 # Обработчики команд и сообщений
 @dp.message(Command("start"))
 async def start(message: types.Message):
     await message.answer("Добро пожаловать в сервис доставки еды! 🛵🍔", reply_markup=menu_keyboard)
 
+# Метрики для администратора
+def metrics_gauges():
+    gauges = {f"send_queue_{name}": value for name, value in send_queue.stats().items()}
+    gauges["orders_pending"] = order_store.count(ORDER_PENDING)
+    gauges["sheets_outbox_pending"] = len(sheets_outbox)
+    return gauges
+
+@dp.message(Command("stats"))
+async def stats(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    queue = send_queue.stats()
+    text = (
+        f"{bot_metrics.summary()}\n\n"
+        f"📦 Заказов ждут подтверждения: {order_store.count(ORDER_PENDING)}\n"
+        f"📊 В очереди Google Sheets: {len(sheets_outbox)}\n"
+        f"📨 Очередь отправки: {queue['pending']}, доставлено {queue.get('delivered', 0)}, "
+        f"ошибок {queue.get('failed', 0)}"
+    )
+    await message.answer(text)
+
+# Заказы клиента по телефону: /orders +7 999 123-45-67
+@dp.message(Command("orders"))
+async def phone_orders(message: types.Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID:
+        return
+    phone = (command.args or "").strip()
+    if not phone:
+        await message.answer("Укажите телефон: /orders +79991234567")
+        return
+    orders = order_store.phone_orders(phone, PHONE_ORDERS_LIMIT)
+    if not orders:
+        await message.answer(f"📦 Заказов с телефоном {phone} нет.")
+        return
+    await message.answer(f"📦 Последние заказы с телефоном {phone}:\n\n" +
+                         "\n\n".join(f"{format_order_summary(order_data)}\n"
+                                      f"👤 {order_data['name']}, 🏠 {order_data['address']}"
+                                      for order_data in orders))
+
+# Отчёт о продажах: /report - за 7 дней, /report 30 - за 30 дней, /report все - за всё время
+REPORT_DEFAULT_DAYS = 7
+
+@dp.message(Command("report"))
+async def report(message: types.Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID:
+        return
+    argument = (command.args or "").strip().lower()
+    if argument in ("все", "всё", "all"):
+        days, title = None, "за всё время"
+    elif argument.isdigit() and int(argument) > 0:
+        days, title = int(argument), f"за {argument} дн."
+    else:
+        days, title = REPORT_DEFAULT_DAYS, f"за {REPORT_DEFAULT_DAYS} дн."
+
+    result = order_history.report(days)
+    if not result or not result["orders"]:
+        await message.answer(f"📈 Подтверждённых заказов {title} нет.")
+        return
+
+    lines = [
+        f"📈 Отчёт {title}",
+        f"💰 Выручка: {result['revenue']:.0f}₽",
+        f"📦 Заказов: {result['orders']}",
+        f"🧾 Средний чек: {result['average_check']:.0f}₽",
+        f"🍽 Позиций в заказе: {result['average_items']:.1f}",
+        "",
+        "🏆 Популярные блюда:",
+    ]
+    for number, (item_id, quantity, revenue) in enumerate(result["top_items"], start=1):
+        item = menu_catalog.get(item_id)
+        lines.append(f"{number}. {item.name if item else f'Товар #{item_id}'} — {quantity} шт., {revenue:.0f}₽")
+
+    hourly = result["hourly"]
+    busy_hours = [hour for hour, count in enumerate(hourly) if count]
+    peak = max(hourly)
+    lines += ["", "🕒 Заказы по часам:"]
+    for hour in range(busy_hours[0], busy_hours[-1] + 1):
+        bar = "█" * round(hourly[hour] * 10 / peak)
+        lines.append(f"{hour:02d}:00 {bar} {hourly[hour]}")
+    await message.answer("\n".join(lines))
+
 @dp.message(lambda message: message.text == "🍔 Меню")
 async def show_menu_categories(message: types.Message, state: FSMContext):
     await state.set_state(None)
-    categories = list(menu_items.keys())
     await show_categories_page(message, state, 0)
 
-# Пагинация категорий
-async def show_categories_page(message: types.Message, state: FSMContext, page: int):
-    categories = list(menu_items.keys())
-    start_index = page * ITEMS_PER_PAGE
-    end_index = min((page + 1) * ITEMS_PER_PAGE, len(categories))
-    current_categories = categories[start_index:end_index]
-
-    keyboard = InlineKeyboardMarkup(row_width=1, inline_keyboard=[
-        [InlineKeyboardButton(text=category, callback_data=f"category_{category}")]
+# Готовые клавиатуры и подписи меню. Они зависят только от страницы, категории
+# и версии этой категории (или списка категорий), поэтому собираются один раз
+# и берутся из LRU-кэша; после перезагрузки меню пересобираются только экраны
+# изменённых категорий. Закэшированные объекты общие для всех пользователей -
+# изменять их нельзя
+MENU_RENDER_CACHE_SIZE = int(os.getenv("MENU_RENDER_CACHE_SIZE", "512"))
+
+@lru_cache(maxsize=MENU_RENDER_CACHE_SIZE)
+def render_categories_page(page, categories_version):
+    current_categories, has_next = menu_catalog.categories_page(page, ITEMS_PER_PAGE)
+
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=category, callback_data=cb("c", menu_catalog.category_ids[category]))]
         for category in current_categories
     ])
 
     navigation_buttons = []
     if page > 0:
         navigation_buttons.append(
-            InlineKeyboardButton(text="⬅️ Назад", callback_data=f"categories_page_{page - 1}"))
-    if end_index < len(categories):
+            InlineKeyboardButton(text="⬅️ Назад", callback_data=cb("cp", page - 1)))
+    if has_next:
         navigation_buttons.append(
-            InlineKeyboardButton(text="➡️ Далее", callback_data=f"categories_page_{page + 1}"))
+            InlineKeyboardButton(text="➡️ Далее", callback_data=cb("cp", page + 1)))
     if navigation_buttons:
         keyboard.inline_keyboard.append(navigation_buttons)
 
-    await message.answer("Выберите категорию:", reply_markup=keyboard)
-
-@dp.callback_query(lambda callback: callback.data.startswith("categories_page_"))
-async def navigate_categories(callback: types.CallbackQuery, state: FSMContext):
-    page = int(callback.data[16:])
-    await show_categories_page(callback.message, state, page)
-    await callback.answer()
-
-# Пагинация товаров в категории
-@dp.callback_query(lambda callback: callback.data.startswith("category_"))
-async def show_menu_items(callback: types.CallbackQuery, state: FSMContext):
-    category = callback.data[9:]
-    await state.set_state(None)
-    await show_items_page(callback.message, state, category, 0)
+    return "Выберите категорию:", keyboard
 
-async def show_items_page(message: types.Message, state: FSMContext, category: str, page: int):
-    items = list(menu_items[category].items())
-    start_index = page * ITEMS_PER_PAGE
-    end_index = min((page + 1) * ITEMS_PER_PAGE, len(items))
-    current_items = items[start_index:end_index]
+@lru_cache(maxsize=MENU_RENDER_CACHE_SIZE)
+def render_items_page(category_id, page, category_version):
+    category = menu_catalog.category(category_id)
+    current_items, has_next = menu_catalog.items_page(category, page, ITEMS_PER_PAGE)
 
-    keyboard = InlineKeyboardMarkup(row_width=1, inline_keyboard=[
-        [InlineKeyboardButton(text=item, callback_data=f"item_{item}")]
-        for item, _ in current_items
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=item.name, callback_data=cb("i", item.id))]
+        for item in current_items
     ])
 
     navigation_buttons = []
     if page > 0:
         navigation_buttons.append(
-            InlineKeyboardButton(text="⬅️ Назад", callback_data=f"items_page_{category}_{page - 1}"))
-    if end_index < len(items):
+            InlineKeyboardButton(text="⬅️ Назад", callback_data=cb("ip", category_id, page - 1)))
+    if has_next:
         navigation_buttons.append(
-            InlineKeyboardButton(text="➡️ Далее", callback_data=f"items_page_{category}_{page + 1}"))
-    keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅️ К категориям", callback_data="back_to_categories")])
+            InlineKeyboardButton(text="➡️ Далее", callback_data=cb("ip", category_id, page + 1)))
+    if any(item.photo for item in menu_catalog.category_items[category]):
+        keyboard.inline_keyboard.append(
+            [InlineKeyboardButton(text="🖼 Фото всех блюд", callback_data=cb("cv", category_id))])
+    keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅️ К категориям", callback_data=cb("bc"))])
     if navigation_buttons:
         keyboard.inline_keyboard.append(navigation_buttons)
 
-    if isinstance(message, types.CallbackQuery):
-        await message.message.edit_text(f"*{category}:*", parse_mode="Markdown", reply_markup=keyboard)
-    else:
-        await message.answer(f"*{category}:*", parse_mode="Markdown", reply_markup=keyboard)
-
-@dp.callback_query(lambda callback: callback.data.startswith("items_page_"))
-async def navigate_items(callback: types.CallbackQuery, state: FSMContext):
-    data = callback.data[11:].split("_")
-    category = data[0]
-    page = int(data[-1])
-    await show_items_page(callback.message, state, category, page)
+    return f"*{category}:*", keyboard
+
+@lru_cache(maxsize=MENU_RENDER_CACHE_SIZE)
+def render_item_card(item_id, category_version):
+    item = menu_catalog.get(item_id)
+    caption = (
+        f"*{item.name}*\n\n"
+        f"📝 {item.description}\n"
+        f"💰 Цена: {item.price}₽"
+    )
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="➕ Добавить в корзину", callback_data=cb("a", item.id))],
+        [InlineKeyboardButton(text="⬅️ Назад к меню",
+                              callback_data=cb("c", menu_catalog.category_ids[item.category]))]
+    ])
+    return caption, keyboard
+
+# Перезагрузка меню: новый каталог собирается рядом со старым (неизменённые
+# категории берутся из него) и подменяет его одним присваиванием
+def reload_menu():
+    global menu_catalog, menu_search, menu_digest
+    categories, digest = load_menu_file(MENU_PATH)
+    if digest == menu_digest:
+        return False
+    previous = menu_catalog
+    catalog = MenuCatalog(categories, previous.version + 1, previous=previous)
+    changed = catalog.changed_categories(previous)
+
+    # file_id фото, которые пропали из изменённых категорий, больше не нужны
+    photos = {item.photo for item in catalog.items}
+    for category_id in changed:
+        category = previous.category(category_id)
+        for item in previous.category_items.get(category, ()):
+            if item.photo and item.photo not in photos:
+                photo_cache.forget(item.photo)
+                for name in image_pipeline.variants:
+                    photo_cache.forget(image_pipeline.variant(item.photo, name))
+
+    menu_catalog = catalog
+    menu_search = MenuSearchIndex(catalog)
+    menu_digest = digest
+    search_menu.cache_clear()
+    print(f"Меню обновлено до версии {catalog.version}, изменено категорий: {len(changed)}")
+    return True
+
+def menu_file_stat():
+    try:
+        stat = os.stat(MENU_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+async def menu_watcher():
+    last_stat = menu_file_stat()
+    while True:
+        await asyncio.sleep(MENU_RELOAD_INTERVAL)
+        stat = menu_file_stat()
+        if stat == last_stat:
+            continue
+        last_stat = stat
+        try:
+            reloaded = reload_menu()
+        except (OSError, MenuError) as e:
+            # Ошибочный файл не ломает бота: остаётся предыдущая версия меню
+            print(f"Ошибка загрузки меню, оставлена версия {menu_catalog.version}: {e}")
+            continue
+        if reloaded and CONFIRMING_PROCESS:
+            await build_menu_images()
+
+# Показ экрана меню. При навигации по кнопкам текущее сообщение редактируется
+# на месте; новое отправляется, только если редактировать нечего (фото-карточка,
+# недоступное или слишком старое сообщение). Если экран не изменился,
+# запрос в Telegram не отправляется
+async def show_menu_screen(target, text, keyboard, parse_mode=None):
+    if not isinstance(target, types.CallbackQuery):
+        await target.answer(text, parse_mode=parse_mode, reply_markup=keyboard)
+        return
+
+    message = target.message
+    if isinstance(message, types.Message) and message.text is not None:
+        # Telegram возвращает текст уже без Markdown-разметки
+        plain_text = text.replace("*", "") if parse_mode == "Markdown" else text
+        # Модели входящего сообщения привязаны к боту, поэтому сравниваем содержимое
+        if (message.text == plain_text and message.reply_markup is not None
+                and message.reply_markup.model_dump() == keyboard.model_dump()):
+            return
+        try:
+            await message.edit_text(text, parse_mode=parse_mode, reply_markup=keyboard)
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return
+    await bot.send_message(target.from_user.id, text, parse_mode=parse_mode, reply_markup=keyboard)
+
+# Пагинация категорий
+async def show_categories_page(message, state: FSMContext, page: int):
+    text, keyboard = render_categories_page(page, menu_catalog.categories_version)
+    await show_menu_screen(message, text, keyboard)
+
+@callback_router.route("cp", int)
+async def navigate_categories(callback: types.CallbackQuery, state: FSMContext, page: int):
+    await show_categories_page(callback, state, page)
+    await callback.answer()
+
+# Пагинация товаров в категории
+@callback_router.route("c", int)
+async def show_menu_items(callback: types.CallbackQuery, state: FSMContext, category_id: int):
+    if menu_catalog.category(category_id) is None:
+        await callback.answer("Ошибка: Категория не найдена!", show_alert=True)
+        return
+    await state.set_state(None)
+    await show_items_page(callback, state, category_id, 0)
+    await callback.answer()
+
+async def show_items_page(message, state: FSMContext, category_id: int, page: int):
+    text, keyboard = render_items_page(category_id, page, menu_catalog.category_versions[category_id])
+    await show_menu_screen(message, text, keyboard, parse_mode="Markdown")
+
+@callback_router.route("ip", int, int)
+async def navigate_items(callback: types.CallbackQuery, state: FSMContext, category_id: int, page: int):
+    if menu_catalog.category(category_id) is None:
+        await callback.answer("Ошибка: Категория не найдена!", show_alert=True)
+        return
+    await show_items_page(callback, state, category_id, page)
     await callback.answer()
 
-@dp.callback_query(lambda callback: callback.data == "back_to_categories")
+# Фото всех блюд категории альбомами (до MEDIA_GROUP_LIMIT фото в одном запросе)
+# вместо отдельной карточки на каждое блюдо; после альбома - снова список блюд
+MEDIA_GROUP_LIMIT = 10
+
+@callback_router.route("cv", int)
+async def show_category_photos(callback: types.CallbackQuery, state: FSMContext, category_id: int):
+    category = menu_catalog.category(category_id)
+    if category is None:
+        await callback.answer("Ошибка: Категория не найдена!", show_alert=True)
+        return
+    photos = [(image_pipeline.variant(item.photo, "preview"), f"{item.name} — {item.price}₽")
+              for item in menu_catalog.category_items[category] if item.photo]
+    photos = [(photo_path, caption) for photo_path, caption in photos if os.path.exists(photo_path)]
+    if not photos:
+        await callback.answer("Ошибка: Фото блюд не найдены!", show_alert=True)
+        return
+    await callback.answer()
+
+    for start in range(0, len(photos), MEDIA_GROUP_LIMIT):
+        group = photos[start:start + MEDIA_GROUP_LIMIT]
+        # В альбоме должно быть хотя бы два фото
+        if len(group) == 1:
+            await send_menu_photo(callback.from_user.id, group[0][0], caption=group[0][1])
+        else:
+            await send_menu_media_group(callback.from_user.id, group)
+    await show_items_page(callback.message, state, category_id, 0)
+
+@callback_router.route("bc")
 async def back_to_categories(callback: types.CallbackQuery, state: FSMContext):
-    await show_menu_categories(callback.message, state)
+    await state.set_state(None)
+    await show_categories_page(callback, state, 0)
     await callback.answer()
 
 # Карточка товара
-@dp.callback_query(lambda callback: callback.data.startswith("item_"))
-async def show_item_card(callback: types.CallbackQuery):
-    item_name = callback.data[5:]
-    category = next((cat for cat, items in menu_items.items() if item_name in items), None)
-    if not category:
+@callback_router.route("i", int)
+async def show_item_card(callback: types.CallbackQuery, state: FSMContext, item_id: int):
+    item = menu_catalog.get(item_id)
+    if not item:
         await callback.answer("Ошибка: Товар не найден!", show_alert=True)
         return
 
-    item = menu_items[category][item_name]
-    caption = (
-        f"*{item_name}*\n\n"
-        f"📝 {item['description']}\n"
-        f"💰 Цена: {item['price']}₽"
-    )
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➕ Добавить в корзину", callback_data=f"add_{item_name}")],
-        [InlineKeyboardButton(text="⬅️ Назад к меню", callback_data=f"category_{category}")]
-    ])
-
+    caption, keyboard = render_item_card(item.id, menu_catalog.category_version(item.category))
     try:
-        await bot.send_photo(
-            chat_id=callback.from_user.id,
-            photo=FSInputFile(item["photo"]),
-            caption=caption,
-            parse_mode="Markdown",
-            reply_markup=keyboard
-        )
+        # Фото у блюда необязательно - без него карточка отправляется текстом
+        if item.photo:
+            await send_menu_photo(
+                callback.from_user.id,
+                image_pipeline.variant(item.photo, "card"),
+                caption=caption,
+                parse_mode="Markdown",
+                reply_markup=keyboard
+            )
+        else:
+            await callback.message.answer(caption, parse_mode="Markdown", reply_markup=keyboard)
     except FileNotFoundError:
         await callback.answer("Ошибка: Фото товара не найдено!", show_alert=True)
+        return
     except Exception as e:
         await callback.answer(f"Ошибка: {str(e)}", show_alert=True)
+        return
 
     await callback.answer()
 
 # Добавление в корзину
-@dp.callback_query(lambda callback: callback.data.startswith("add_"))
-async def add_to_cart(callback: types.CallbackQuery):
+@callback_router.route("a", int)
+async def add_to_cart(callback: types.CallbackQuery, state: FSMContext, item_id: int):
     user_id = callback.from_user.id
-    item_name = callback.data[4:]
-    category = next((cat for cat, items in menu_items.items() if item_name in items), None)
-    if not category:
+    item = menu_catalog.get(item_id)
+    if not item:
         await callback.answer("Ошибка: Товар не найден!", show_alert=True)
         return
 
-    if user_id not in user_carts:
-        user_carts[user_id] = []
-    user_carts[user_id].append(item_name)
-    await callback.answer(f"{item_name} добавлен в корзину! ✅", show_alert=False)
+    cart = load_cart(user_id)
+    quantity = cart.add(item)
+    save_cart(user_id, cart)
+    await callback.answer(f"{item.name} добавлен в корзину! ✅ (в корзине: {quantity})", show_alert=False)
+
+# Поиск по меню в inline-режиме: @бот пицца в любом чате. Индекс menu_search
+# пересобирается при перезагрузке меню, найденные ID товаров кэшируются
+# по запросу и версии меню. Режим включается у @BotFather (/setinline)
+MENU_SEARCH_CACHE_SIZE = int(os.getenv("MENU_SEARCH_CACHE_SIZE", "2048"))
+INLINE_RESULTS_PER_PAGE = 20
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "60"))
+
+@lru_cache(maxsize=MENU_SEARCH_CACHE_SIZE)
+def search_menu(query, version):
+    return menu_search.search(query)
+
+@lru_cache(maxsize=MENU_RENDER_CACHE_SIZE)
+def render_inline_result(item_id, category_version):
+    item = menu_catalog.get(item_id)
+    caption, _ = render_item_card(item_id, category_version)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="➕ Добавить в корзину", callback_data=cb("a", item.id))],
+        [InlineKeyboardButton(text="🔍 Найти ещё", switch_inline_query_current_chat="")]
+    ])
+    return InlineQueryResultArticle(
+        id=str(item.id),
+        title=item.name,
+        description=f"{item.price}₽ · {item.description}",
+        input_message_content=InputTextMessageContent(message_text=caption, parse_mode="Markdown"),
+        reply_markup=keyboard
+    )
+
+@dp.inline_query()
+async def inline_search(inline_query: types.InlineQuery):
+    catalog = menu_catalog
+    found = search_menu(" ".join(inline_query.query.split())[:64].lower(), catalog.version)
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    page = found[offset:offset + INLINE_RESULTS_PER_PAGE]
+    results = [render_inline_result(item_id, catalog.category_version(catalog.get(item_id).category))
+               for item_id in page]
+    next_offset = str(offset + len(page)) if offset + len(page) < len(found) else ""
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
 
 # Просмотр корзины
+def render_cart(cart):
+    rows = [
+        [InlineKeyboardButton(text="➖", callback_data=cb("cd", item.id)),
+         InlineKeyboardButton(text=f"{item.name} × {quantity}", callback_data=cb("i", item.id)),
+         InlineKeyboardButton(text="➕", callback_data=cb("ci", item.id))]
+        for item, quantity in cart.lines(menu_catalog)
+    ]
+    rows.append([InlineKeyboardButton(text="✅ Оформить заказ", callback_data=cb("co"))])
+    rows.append([InlineKeyboardButton(text="❌ Очистить корзину", callback_data=cb("cc"))])
+
+    cart_summary = "\n".join(format_cart_lines(cart))
+    text = f"🛒 *Ваша корзина:*\n{cart_summary}\n\n💰 *Общая сумма:* {cart.total}₽"
+    return text, InlineKeyboardMarkup(inline_keyboard=rows)
+
 @dp.message(lambda message: message.text == "🛒 Корзина")
 async def view_cart(message: types.Message):
     user_id = message.from_user.id
-    cart = user_carts.get(user_id, [])
+    cart = load_cart(user_id)
 
     if not cart:
         await message.answer("🛒 Ваша корзина пуста.", reply_markup=menu_keyboard)
         return
 
-    cart_summary = "\n".join(cart)
-    total_price = calculate_total_price(cart)
+    text, keyboard = render_cart(cart)
+    await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Оформить заказ", callback_data="checkout")],
-        [InlineKeyboardButton(text="❌ Очистить корзину", callback_data="clear_cart")]
-    ])
+# Изменение количества кнопками ➕/➖ прямо в сообщении с корзиной
+async def change_cart_quantity(callback: types.CallbackQuery, item_id: int, delta: int):
+    user_id = callback.from_user.id
+    item = menu_catalog.get(item_id)
+    cart = load_cart(user_id)
+    if not item or item_id not in cart.items:
+        await callback.answer("Ошибка: Товар не найден в корзине!", show_alert=True)
+        return
+
+    cart.add(item, delta)
+    if cart:
+        save_cart(user_id, cart)
+        text, keyboard = render_cart(cart)
+        await show_menu_screen(callback, text, keyboard, parse_mode="Markdown")
+    else:
+        user_carts.delete(user_id)
+        await callback.message.edit_text("🛒 Ваша корзина пуста.")
+    await callback.answer()
 
-    await message.answer(f"🛒 *Ваша корзина:*\n{cart_summary}\n\n💰 *Общая сумма:* {total_price}₽",
-                         parse_mode="Markdown", reply_markup=keyboard)
+@callback_router.route("ci", int)
+async def increase_cart_item(callback: types.CallbackQuery, state: FSMContext, item_id: int):
+    await change_cart_quantity(callback, item_id, 1)
+
+@callback_router.route("cd", int)
+async def decrease_cart_item(callback: types.CallbackQuery, state: FSMContext, item_id: int):
+    await change_cart_quantity(callback, item_id, -1)
 
 # Очистка корзины
-@dp.callback_query(lambda callback: callback.data == "clear_cart")
-async def clear_cart(callback: types.CallbackQuery):
+@callback_router.route("cc")
+async def clear_cart(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
-    user_carts[user_id] = []
+    user_carts.delete(user_id)
     await callback.answer("🛒 Корзина очищена!", show_alert=True)
-    await callback.message.edit_text("🛒 Ваша корзина пуста.", reply_markup=menu_keyboard)
+    await callback.message.edit_text("🛒 Ваша корзина пуста.")
 
 # Оформление заказа
-@dp.callback_query(lambda callback: callback.data == "checkout")
+@callback_router.route("co", once=True)
 async def checkout(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     username = callback.from_user.username
-    cart = user_carts.get(user_id, [])
+    cart = load_cart(user_id)
+    cart.recalculate(menu_catalog)
 
     if not cart:
         await callback.answer("🛒 Ваша корзина пуста!", show_alert=True)
         return
 
-    await state.update_data(cart=cart, total_price=calculate_total_price(cart), username=username)
+    await state.update_data(cart=format_cart_lines(cart), items=cart.to_json(),
+                            total_price=cart.total, username=username)
     await state.set_state(Order.waiting_for_name)
     await callback.message.answer("Пожалуйста, введите ваше ФИО:")
 
@@ -391,172 +1123,301 @@ async def process_address(message: types.Message, state: FSMContext):
     )
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Да, всё верно", callback_data="confirm_order")],
-        [InlineKeyboardButton(text="❌ Нет, изменить данные", callback_data="cancel_order")]
+        [InlineKeyboardButton(text="✅ Да, всё верно", callback_data=cb("ok"))],
+        [InlineKeyboardButton(text="❌ Нет, изменить данные", callback_data=cb("no"))]
     ])
 
     await message.answer(confirm_message, parse_mode="Markdown", reply_markup=keyboard)
 
 # Подтверждение заказа клиентом
-@dp.callback_query(lambda callback: callback.data == "confirm_order")
+@callback_router.route("ok", once=True)
 async def confirm_order(callback: types.CallbackQuery, state: FSMContext):
-    user_data = await state.get_data()
+    user_id = callback.from_user.id
+    async with order_locks(user_id):
+        user_data = await state.get_data()
+        # Заказ уже оформлен предыдущим нажатием
+        if "phone" not in user_data:
+            await callback.answer("Заказ уже оформлен.")
+            return
 
-    order_data = {
-        "name": user_data["name"],
-        "phone": user_data["phone"],
-        "address": user_data["address"],
-        "cart": user_data["cart"],
-        "total_price": user_data["total_price"],
-        "username": user_data.get("username", "")
-    }
-
-    orders[user_data["phone"]] = order_data
-    save_orders(orders)
-
-    await notify_admin([
-        order_data["name"],
-        order_data["phone"],
-        order_data["address"],
-        "\n".join(order_data["cart"]),
-        order_data["total_price"]
-    ], order_data["phone"], order_data["username"])
+        order_data = {
+            "name": user_data["name"],
+            "phone": user_data["phone"],
+            "address": user_data["address"],
+            "cart": user_data["cart"],
+            "items": user_data["items"],
+            "total_price": user_data["total_price"],
+            "username": user_data.get("username", ""),
+            "user_id": user_id
+        }
 
-    user_id = callback.from_user.id
-    user_carts.pop(user_id, [])
-    await callback.message.answer("✅ Заказ оформлен! Ожидайте подтверждения администратора. 🚀", reply_markup=menu_keyboard)
-    await state.clear()
+        order_data = order_store.create(order_data)
+
+        await notify_admin([
+            order_data["name"],
+            order_data["phone"],
+            order_data["address"],
+            "\n".join(order_data["cart"]),
+            order_data["total_price"]
+        ], order_data["id"], order_data["username"])
+
+        user_carts.delete(user_id)
+        await callback.message.answer(f"✅ Заказ №{order_data['id']} оформлен! Ожидайте подтверждения администратора. 🚀",
+                                      reply_markup=menu_keyboard)
+        await state.clear()
+
+# Замок изменений заказа по его номеру (замки оформления заказа - по ID пользователя)
+def order_lock_key(order_id):
+    return f"order:{order_id}"
 
 # Отмена заказа клиентом
-@dp.callback_query(lambda callback: callback.data == "cancel_order")
+@callback_router.route("no", once=True)
 async def cancel_order(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.answer("Заказ отменён. Вы можете начать заново.", reply_markup=menu_keyboard)
 
+# История заказов клиента: "📦 Мои заказы" - страницы по MY_ORDERS_PER_PAGE
+# заказов, новые первыми. Заказы пользователя берутся из индекса хранилища,
+# а не перебором всех заказов
+ORDER_STATUS_TITLES = {ORDER_PENDING: "⏳ ждёт подтверждения", ORDER_CONFIRMED: "✅ подтверждён"}
+
+def format_order_time(created):
+    return time.strftime("%d.%m.%Y %H:%M", time.gmtime(created + HISTORY_UTC_OFFSET * 3600))
+
+def format_order_summary(order_data):
+    return (
+        f"№{order_data['id']} от {format_order_time(order_data['created'])} — "
+        f"{ORDER_STATUS_TITLES.get(order_data['status'], order_data['status'])}\n"
+        f"{', '.join(order_data['cart'])} — {order_data['total_price']}₽"
+    )
+
+def render_my_orders(user_id, page):
+    total = order_store.count_user_orders(user_id)
+    if not total:
+        return "📦 У вас пока нет заказов.", None
+    pages = (total + MY_ORDERS_PER_PAGE - 1) // MY_ORDERS_PER_PAGE
+    page = min(max(page, 0), pages - 1)
+    orders = order_store.user_orders(user_id, page * MY_ORDERS_PER_PAGE, MY_ORDERS_PER_PAGE)
+
+    text = f"📦 Мои заказы ({total}), страница {page + 1} из {pages}:\n\n" + \
+        "\n\n".join(format_order_summary(order_data) for order_data in orders)
+    rows = [[InlineKeyboardButton(text="🔁 Повторить последний заказ", callback_data=cb("rl"))]]
+    rows += [[InlineKeyboardButton(text=f"🔁 Повторить №{order_data['id']}", callback_data=cb("ro", order_data["id"]))]
+             for order_data in orders]
+
+    navigation_buttons = []
+    if page > 0:
+        navigation_buttons.append(
+            InlineKeyboardButton(text="⬅️ Назад", callback_data=cb("mo", page - 1)))
+    if page < pages - 1:
+        navigation_buttons.append(
+            InlineKeyboardButton(text="➡️ Далее", callback_data=cb("mo", page + 1)))
+    if navigation_buttons:
+        rows.append(navigation_buttons)
+    return text, InlineKeyboardMarkup(inline_keyboard=rows)
+
+@dp.message(lambda message: message.text == "📦 Мои заказы")
+async def my_orders(message: types.Message):
+    text, keyboard = render_my_orders(message.from_user.id, 0)
+    await message.answer(text, reply_markup=keyboard or menu_keyboard)
+
+@callback_router.route("mo", int)
+async def navigate_my_orders(callback: types.CallbackQuery, state: FSMContext, page: int):
+    text, keyboard = render_my_orders(callback.from_user.id, page)
+    if keyboard:
+        await show_menu_screen(callback, text, keyboard)
+    await callback.answer()
+
+# Повтор заказа: его состав кладётся в корзину по текущим ценам меню,
+# дальше заказ оформляется как обычно
+async def repeat_order(callback: types.CallbackQuery, order_data):
+    user_id = callback.from_user.id
+    # Повторить можно только свой заказ
+    if order_data is None or order_data.get("user_id") != user_id:
+        await callback.answer("❌ Заказ не найден!", show_alert=True)
+        return
+    previous = order_cart(order_data)
+    cart = Cart(previous.items)
+    cart.recalculate(menu_catalog)
+    if not cart:
+        await callback.answer("😔 Блюд из этого заказа больше нет в меню.", show_alert=True)
+        return
+
+    save_cart(user_id, cart)
+    text, keyboard = render_cart(cart)
+    if len(cart.items) < len(previous.items):
+        text += "\n\n⚠️ Некоторых блюд из заказа больше нет в меню."
+    await callback.message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
+    await callback.answer()
+
+@callback_router.route("rl")
+async def repeat_last_order(callback: types.CallbackQuery, state: FSMContext):
+    orders = order_store.user_orders(callback.from_user.id, 0, 1)
+    await repeat_order(callback, orders[0] if orders else None)
+
+@callback_router.route("ro", int)
+async def repeat_selected_order(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    await repeat_order(callback, order_store.get(order_id))
+
 # Связь с клиентом
-@dp.callback_query(lambda callback: callback.data.startswith("contact_"))
-async def contact_client(callback: types.CallbackQuery):
-    phone = callback.data.split("_")[1]
-    await callback.answer(f"Позвоните клиенту по номеру: {phone}", show_alert=True)
+@callback_router.route("ct", int)
+async def contact_client(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    order_data = order_store.get(order_id)
+    if order_data is None:
+        await callback.answer("❌ Заказ не найден!", show_alert=True)
+        return
+    await callback.answer(f"Позвоните клиенту по номеру: {order_data['phone']}", show_alert=True)
 
-# Редактирование заказа администратором
-async def show_edit_options(message: types.Message, phone: str):
+# Редактирование заказа администратором. Номер редактируемого заказа хранится
+# в состоянии FSM администратора вместе с изменёнными полями
+async def show_edit_options(message: types.Message, order_id: int):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="👤 ФИО", callback_data=f"edit_name_{phone}")],
-        [InlineKeyboardButton(text="📞 Телефон", callback_data=f"edit_phone_{phone}")],
-        [InlineKeyboardButton(text="🏠 Адрес", callback_data=f"edit_address_{phone}")],
-        [InlineKeyboardButton(text="🛒 Состав заказа", callback_data=f"edit_cart_{phone}")],
-        [InlineKeyboardButton(text="✅ Подтвердить изменения", callback_data=f"confirm_edit_{phone}")]
+        [InlineKeyboardButton(text="👤 ФИО", callback_data=cb("en", order_id))],
+        [InlineKeyboardButton(text="📞 Телефон", callback_data=cb("eph", order_id))],
+        [InlineKeyboardButton(text="🏠 Адрес", callback_data=cb("ead", order_id))],
+        [InlineKeyboardButton(text="🛒 Состав заказа", callback_data=cb("eca", order_id))],
+        [InlineKeyboardButton(text="✅ Подтвердить изменения", callback_data=cb("ce", order_id))]
     ])
-    await message.answer("Выберите, что хотите отредактировать:", reply_markup=keyboard)
+    await message.answer(f"Заказ №{order_id}. Выберите, что хотите отредактировать:", reply_markup=keyboard)
 
-@dp.callback_query(lambda callback: callback.data.startswith("edit_") and "name" not in callback.data and "phone" not in callback.data and "address" not in callback.data and "cart" not in callback.data and "confirm" not in callback.data)
-async def start_edit_order(callback: types.CallbackQuery, state: FSMContext):
-    phone = callback.data.split("_")[1]
-    await state.update_data(phone=phone)
-    await show_edit_options(callback.message, phone)
+@callback_router.route("ae", int)
+async def start_edit_order(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    await state.set_data({"order_id": order_id})
+    await show_edit_options(callback.message, order_id)
     await callback.answer()
 
-@dp.callback_query(lambda callback: callback.data.startswith("edit_name_"))
-async def edit_name(callback: types.CallbackQuery, state: FSMContext):
+@callback_router.route("en", int)
+async def edit_name(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    await state.update_data(order_id=order_id)
     await state.set_state(EditOrder.edit_name)
     await callback.message.answer("Введите новое ФИО:")
 
-@dp.callback_query(lambda callback: callback.data.startswith("edit_phone_"))
-async def edit_phone(callback: types.CallbackQuery, state: FSMContext):
+@callback_router.route("eph", int)
+async def edit_phone(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    await state.update_data(order_id=order_id)
     await state.set_state(EditOrder.edit_phone)
     await callback.message.answer("Введите новый номер телефона:")
 
-@dp.callback_query(lambda callback: callback.data.startswith("edit_address_"))
-async def edit_address(callback: types.CallbackQuery, state: FSMContext):
+@callback_router.route("ead", int)
+async def edit_address(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    await state.update_data(order_id=order_id)
     await state.set_state(EditOrder.edit_address)
     await callback.message.answer("Введите новый адрес:")
 
-@dp.callback_query(lambda callback: callback.data.startswith("edit_cart_"))
-async def edit_cart(callback: types.CallbackQuery, state: FSMContext):
+@callback_router.route("eca", int)
+async def edit_cart(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    await state.update_data(order_id=order_id)
     await state.set_state(EditOrder.edit_cart)
-    await callback.message.answer("Введите новый состав заказа (каждый пункт с новой строки):")
+    await callback.message.answer(
+        "Введите новый состав заказа (каждый пункт с новой строки, например «Пицца Маргарита × 2»):")
 
 @dp.message(EditOrder.edit_name)
 async def process_edit_name(message: types.Message, state: FSMContext):
     await state.update_data(name=message.text)
     user_data = await state.get_data()
-    await show_edit_options(message, user_data["phone"])
+    await show_edit_options(message, user_data["order_id"])
 
 @dp.message(EditOrder.edit_phone)
 async def process_edit_phone(message: types.Message, state: FSMContext):
     await state.update_data(phone=message.text)
     user_data = await state.get_data()
-    await show_edit_options(message, user_data["phone"])
+    await show_edit_options(message, user_data["order_id"])
 
 @dp.message(EditOrder.edit_address)
 async def process_edit_address(message: types.Message, state: FSMContext):
     await state.update_data(address=message.text)
     user_data = await state.get_data()
-    await show_edit_options(message, user_data["phone"])
+    await show_edit_options(message, user_data["order_id"])
 
 @dp.message(EditOrder.edit_cart)
 async def process_edit_cart(message: types.Message, state: FSMContext):
-    cart = message.text.split("\n")
-    await state.update_data(cart=cart)
-    user_data = await state.get_data()
-    await show_edit_options(message, user_data["phone"])
-
-@dp.callback_query(lambda callback: callback.data.startswith("confirm_edit_"))
-async def confirm_edit(callback: types.CallbackQuery, state: FSMContext):
+    cart, unknown = parse_cart_lines(message.text.split("\n"))
+    if unknown or not cart:
+        await message.answer("Не удалось распознать позиции:\n" + "\n".join(unknown) +
+                             "\n\nВведите состав заказа ещё раз:")
+        return
+    await state.update_data(cart=format_cart_lines(cart), items=cart.to_json())
     user_data = await state.get_data()
-    phone = user_data["phone"]
-    order_data = orders.get(phone, {})
-    order_data.update({
-        "name": user_data.get("name", order_data.get("name", "")),
-        "phone": user_data.get("phone", order_data.get("phone", "")),
-        "address": user_data.get("address", order_data.get("address", "")),
-        "cart": user_data.get("cart", order_data.get("cart", [])),
-        "total_price": calculate_total_price(user_data.get("cart", order_data.get("cart", []))),
-    })
-    orders[phone] = order_data
-    save_orders(orders)
-    await notify_admin([
-        order_data["name"],
-        order_data["phone"],
-        order_data["address"],
-        "\n".join(order_data["cart"]),
-        order_data["total_price"]
-    ], order_data["phone"], order_data.get("username", ""))
-    await callback.message.answer("✅ Заказ отредактирован!", reply_markup=menu_keyboard)
-    await state.clear()
-
-# Подтверждение заказа администратором
-@dp.callback_query(lambda callback: callback.data.startswith("confirm_"))
-async def admin_confirm_order(callback: types.CallbackQuery):
-    phone = callback.data.split("_")[1]
-
-    if phone in orders:
-        order_data = orders[phone]
-        username = order_data.get("username", "")
-
-        await notify_kitchen([
+    await show_edit_options(message, user_data["order_id"])
+
+@callback_router.route("ce", int, once=True)
+async def confirm_edit(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    async with order_locks(order_lock_key(order_id)):
+        user_data = await state.get_data()
+        # Изменения уже сохранены предыдущим нажатием
+        if user_data.get("order_id") != order_id:
+            await callback.answer("Изменения уже сохранены.")
+            return
+        order_data = order_store.get(order_id)
+        # Подтверждённый заказ уже на кухне - менять его поздно
+        if order_data is None or order_data["status"] != ORDER_PENDING:
+            await state.clear()
+            await callback.answer("❌ Заказ не найден или уже подтверждён!", show_alert=True)
+            return
+        cart = order_cart(user_data if "items" in user_data else order_data)
+        cart.recalculate(menu_catalog)
+        order_data.update({
+            "name": user_data.get("name", order_data["name"]),
+            "phone": user_data.get("phone", order_data["phone"]),
+            "address": user_data.get("address", order_data["address"]),
+            "cart": format_cart_lines(cart),
+            "items": cart.to_json(),
+            "total_price": cart.total,
+        })
+        order_store.put(order_data)
+        await notify_admin([
             order_data["name"],
             order_data["phone"],
             order_data["address"],
             "\n".join(order_data["cart"]),
             order_data["total_price"]
-        ], username)
+        ], order_id, order_data.get("username", ""))
+        await callback.message.answer("✅ Заказ отредактирован!", reply_markup=menu_keyboard)
+        await state.clear()
 
-        await update_or_add_order_to_sheet([
-            order_data["name"],
-            order_data["phone"],
-            order_data["address"],
-            "\n".join(order_data["cart"]),
-            str(order_data["total_price"])
-        ])
+# Подтверждение заказа администратором
+@callback_router.route("ac", int, once=True)
+async def admin_confirm_order(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    await confirm_order_by_admin(callback, order_id, urgent=False)
+
+@callback_router.route("au", int, once=True)
+async def admin_confirm_urgent_order(callback: types.CallbackQuery, state: FSMContext, order_id: int):
+    await confirm_order_by_admin(callback, order_id, urgent=True)
+
+async def confirm_order_by_admin(callback: types.CallbackQuery, order_id: int, urgent: bool):
+    async with order_locks(order_lock_key(order_id)):
+        # Заказ помечается подтверждённым до отправки на кухню: повторное нажатие
+        # в другом процессе бота его уже не получит
+        order_data = order_store.claim(order_id)
+        if order_data is None:
+            await callback.answer("❌ Заказ не найден или уже подтверждён!", show_alert=True)
+            return
 
-        del orders[phone]
-        save_orders(orders)
+        try:
+            await kitchen_batcher.add(order_data, urgent=urgent)
+        except Exception:
+            # Заказ не дошёл до кухни - возвращаем его, чтобы подтвердить ещё раз
+            order_store.release(order_id)
+            raise
+
+        # Тикет уже у кухни: ошибки таблицы и истории только пишутся в лог,
+        # иначе повторное подтверждение отправило бы на кухню второй тикет
+        try:
+            update_or_add_order_to_sheet([
+                order_data["name"],
+                order_data["phone"],
+                order_data["address"],
+                "\n".join(order_data["cart"]),
+                str(order_data["total_price"])
+            ])
+        except Exception as e:
+            print(f"Ошибка записи заказа №{order_id} в очередь Google Sheets: {e}")
+        try:
+            order_history.append(order_data["total_price"], order_cart(order_data).priced_lines(menu_catalog))
+        except Exception as e:
+            print(f"Ошибка записи заказа №{order_id} в историю: {e}")
 
         await callback.answer("✅ Заказ подтверждён и отправлен на кухню!", show_alert=True)
-    else:
-        await callback.answer("❌ Заказ не найден!", show_alert=True)
 
 # Дополнительные команды
 @dp.message(lambda message: message.text == "📞 Контакты")
@@ -568,9 +1429,274 @@ async def about_us(message: types.Message):
     await message.answer("🍔 Мы — лучшая доставка еды в городе! 🚀\nГотовим только из свежих продуктов!",
                          reply_markup=menu_keyboard)
 
+# Режим webhook: Telegram присылает обновления на aiohttp-сервер, сервер сразу
+# отвечает 200, а обработка идёт в ограниченном пуле. У каждого пользователя своя
+# очередь: его обновления обрабатываются по порядку, а медленная обработка
+# у одного клиента не задерживает остальных
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+
+def update_user_id(update):
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat else 0
+
+class UpdateWorkerPool:
+    def __init__(self, dispatcher, bot, workers=WEBHOOK_WORKERS, max_pending=WEBHOOK_MAX_PENDING):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        # Сколько обновлений обрабатывается одновременно
+        self.workers = asyncio.Semaphore(workers)
+        # Сколько обновлений может быть принято, но ещё не обработано
+        self.capacity = asyncio.Semaphore(max_pending)
+        self.queues = {}
+        self.tasks = set()
+        # Telegram повторяет доставку, если не дождался ответа на webhook
+        self.delivered = DedupCache(ttl=300)
+
+    # Ждёт только если принятых необработанных обновлений слишком много
+    async def submit(self, update):
+        if self.delivered.seen(update.update_id):
+            return
+        await self.capacity.acquire()
+        user_id = update_user_id(update)
+        queue = self.queues.get(user_id)
+        if queue is not None:
+            queue.append(update)
+            return
+        self.queues[user_id] = deque([update])
+        task = asyncio.create_task(self.drain(user_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # Обновления одного пользователя обрабатываются строго по очереди
+    async def drain(self, user_id):
+        queue = self.queues[user_id]
+        try:
+            while queue:
+                update = queue[0]
+                async with self.workers:
+                    try:
+                        await self.dispatcher.feed_update(self.bot, update)
+                    except Exception:
+                        logging.exception("Ошибка обработки обновления %s", update.update_id)
+                    finally:
+                        self.capacity.release()
+                queue.popleft()
+        finally:
+            del self.queues[user_id]
+
+    async def stop(self):
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+async def handle_metrics(request):
+    return web.Response(text=bot_metrics.render_prometheus(metrics_gauges()),
+                        content_type="text/plain", charset="utf-8")
+
+# Telegram присылает по одному обновлению, главный процесс в многопроцессном
+# режиме - списком
+# Секрет сравнивается за постоянное время, как в webhook-обработчике aiogram.
+# Без секрета любой, кто знает адрес, мог бы присылать поддельные обновления
+def valid_secret(request, secret):
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    return bool(secret) and hmac.compare_digest(token.encode(), secret.encode())
+
+def create_webhook_app(pool, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH):
+    async def handle_update(request):
+        if not valid_secret(request, secret):
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        # Пачка от главного процесса разбирается по одному обновлению:
+        # ошибочное обновление пропускается, а не отбрасывает всю пачку
+        for data in payload if isinstance(payload, list) else [payload]:
+            try:
+                update = types.Update.model_validate(data, context={"bot": pool.bot})
+            except ValueError as e:
+                logging.error("Пропущено некорректное обновление %s: %s",
+                              data.get("update_id") if isinstance(data, dict) else None, e)
+                continue
+            await pool.submit(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get(METRICS_PATH, handle_metrics)
+    return app
+
+async def start_web_app(app, host, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+# Проверяется до запуска сервера, чтобы не принимать обновления без проверки секрета
+def check_webhook_settings():
+    if not WEBHOOK_URL:
+        raise ValueError("Для режима webhook нужен WEBHOOK_URL в файле .env!")
+    if not WEBHOOK_SECRET:
+        raise ValueError("Для режима webhook нужен WEBHOOK_SECRET в файле .env!")
+
+async def set_webhook():
+    check_webhook_settings()
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logging.info("Webhook запущен на %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+# host, port, secret - адрес и секрет приёма обновлений; для рабочего процесса
+# в многопроцессном режиме это локальный адрес, а webhook в Telegram не ставится
+async def run_webhook(host=WEBHOOK_HOST, port=WEBHOOK_PORT, secret=WEBHOOK_SECRET, register=True):
+    if register:
+        check_webhook_settings()
+    pool = UpdateWorkerPool(dp, bot)
+    runner = await start_web_app(create_webhook_app(pool, secret), host, port)
+    await dp.emit_startup(bot=bot)
+    if register:
+        await set_webhook()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await pool.stop()
+        await dp.emit_shutdown(bot=bot)
+
+async def run_polling():
+    runner = None
+    if METRICS_PORT:
+        app = web.Application()
+        app.router.add_get(METRICS_PATH, handle_metrics)
+        runner = await start_web_app(app, WEBHOOK_HOST, METRICS_PORT)
+    try:
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        if runner:
+            await runner.cleanup()
+
+# Главный процесс многопроцессного режима: принимает обновления от Telegram
+# (webhook или long polling), запускает рабочие процессы и раздаёт им обновления.
+# Сам обновления не обрабатывает. Метрики рабочего процесса отдаются на его
+# локальном адресе: http://127.0.0.1:SHARD_BASE_PORT + номер/metrics
+POLLING_TIMEOUT = 30
+
+def handle_front_metrics(router):
+    async def handle(request):
+        gauges = {"front_pending": router.pending()}
+        gauges.update({f"front_forwarded_{shard}": count for shard, count in router.forwarded.items()})
+        return web.Response(text=bot_metrics.render_prometheus(gauges), content_type="text/plain", charset="utf-8")
+    return handle
+
+async def run_front(webhook):
+    if webhook:
+        check_webhook_settings()
+    secret = SHARD_SECRET or os.urandom(16).hex()
+    router = ShardRouter(
+        [f"http://127.0.0.1:{SHARD_BASE_PORT + shard}{WEBHOOK_PATH}" for shard in range(BOT_WORKERS)],
+        secret=secret, max_pending=WEBHOOK_MAX_PENDING,
+    )
+    processes = ShardProcesses(os.path.abspath(__file__), BOT_WORKERS,
+                               env={"SHARD_SECRET": secret, "BOT_WORKERS": str(BOT_WORKERS)})
+    await processes.start()
+    await router.start()
+    logging.info("Запущено рабочих процессов: %s", BOT_WORKERS)
+
+    runner = None
+    try:
+        if webhook:
+            async def handle_update(request):
+                if not valid_secret(request, WEBHOOK_SECRET):
+                    return web.Response(status=401)
+                try:
+                    data = await request.json()
+                except ValueError:
+                    return web.Response(status=400)
+                await router.submit(data)
+                return web.Response()
+
+            app = web.Application()
+            app.router.add_post(WEBHOOK_PATH, handle_update)
+            app.router.add_get(METRICS_PATH, handle_front_metrics(router))
+            runner = await start_web_app(app, WEBHOOK_HOST, WEBHOOK_PORT)
+            await set_webhook()
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook()
+            allowed_updates = dp.resolve_used_update_types()
+            offset = None
+            while True:
+                try:
+                    updates = await bot(GetUpdates(offset=offset, timeout=POLLING_TIMEOUT,
+                                                   allowed_updates=allowed_updates),
+                                        request_timeout=POLLING_TIMEOUT + 10)
+                except Exception as e:
+                    print(f"Ошибка получения обновлений: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    await router.submit(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                    offset = update.update_id + 1
+    finally:
+        if runner:
+            await runner.cleanup()
+        await router.stop()
+        await processes.stop()
+
 # Запуск бота
 async def main():
-    await dp.start_polling(bot)
+    webhook = BOT_MODE == "webhook" or "--webhook" in sys.argv
+    if BOT_WORKERS > 1 and BOT_SHARD is None:
+        await run_front(webhook)
+        return
+
+    # В многопроцессном режиме очередь Google Sheets разбирает только процесс 0
+    sheets_task = asyncio.create_task(sheets_outbox_worker(sheets_outbox)) if not BOT_SHARD else None
+    orders_task = asyncio.create_task(order_store.run())
+    storage_task = asyncio.create_task(storage.run())
+    menu_task = asyncio.create_task(menu_watcher())
+    history_task = asyncio.create_task(order_history.run()) if order_history else None
+    if not CONFIRMING_PROCESS:
+        images_task = asyncio.create_task(image_manifest_watcher())
+    elif PHOTO_PREWARM_CHAT_ID:
+        images_task = asyncio.create_task(prewarm_photo_cache(int(PHOTO_PREWARM_CHAT_ID)))
+    else:
+        images_task = asyncio.create_task(build_menu_images())
+    try:
+        if BOT_SHARD is not None:
+            await run_webhook("127.0.0.1", SHARD_BASE_PORT + BOT_SHARD, SHARD_SECRET, register=False)
+        elif webhook:
+            await run_webhook()
+        else:
+            await run_polling()
+    finally:
+        kitchen_batcher.flush()
+        await send_queue.drain()
+        if sheets_task:
+            sheets_task.cancel()
+        orders_task.cancel()
+        storage_task.cancel()
+        menu_task.cancel()
+        if history_task:
+            history_task.cancel()
+        images_task.cancel()
+        await storage.close()
+        await order_store.close()
+        if order_history:
+            await order_history.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,94 @@
+# Компактный формат callback_data и маршрутизация нажатий на кнопки.
+# Данные кнопки - короткий код операции и аргументы через ":", например
+# "i:12" (карточка товара 12) или "ip:3:1" (страница 1 категории 3).
+# Обработчик находится одним поиском в словаре по коду операции,
+# а не перебором фильтров startswith.
+# С кэшем dedup повторная доставка того же callback-запроса не обрабатывается,
+# а у операций с once=True - и повторное нажатие той же кнопки того же сообщения,
+# пока первое нажатие ещё обрабатывается
+
+CALLBACK_DATA_LIMIT = 64
+SEPARATOR = ":"
+
+
+class CallbackRouter:
+    def __init__(self, dedup=None, duplicate_text="⏳ Уже обрабатывается"):
+        self.handlers = {}
+        self.fields = {}
+        self.once = set()
+        self.dedup = dedup
+        self.duplicate_text = duplicate_text
+
+    # Регистрация обработчика: fields - типы аргументов (int или str).
+    # Строковым может быть только последний аргумент, в нём допускается ":".
+    # once=True - переход состояния, который должен выполниться один раз
+    def route(self, op, *fields, once=False):
+        if op in self.handlers:
+            raise ValueError(f"Код операции {op!r} уже занят")
+        if str in fields[:-1]:
+            raise ValueError("Строковым может быть только последний аргумент")
+
+        def decorator(handler):
+            self.handlers[op] = handler
+            self.fields[op] = fields
+            if once:
+                self.once.add(op)
+            return handler
+        return decorator
+
+    def pack(self, op, *args):
+        fields = self.fields[op]
+        if len(args) != len(fields):
+            raise ValueError(f"Операция {op!r} ожидает {len(fields)} аргументов, передано {len(args)}")
+        data = SEPARATOR.join([op, *(str(arg) for arg in args)])
+        if len(data.encode("utf-8")) > CALLBACK_DATA_LIMIT:
+            raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data!r}")
+        return data
+
+    def unpack(self, data):
+        if not data:
+            return None
+        op, _, rest = data.partition(SEPARATOR)
+        fields = self.fields.get(op)
+        if fields is None:
+            return None
+        if not fields:
+            return (op, ()) if not rest else None
+        parts = rest.split(SEPARATOR, len(fields) - 1)
+        if len(parts) != len(fields):
+            return None
+        try:
+            return op, tuple(field(part) for field, part in zip(fields, parts))
+        except ValueError:
+            return None
+
+    # Возвращает False, если данные кнопки не распознаны
+    async def dispatch(self, callback, *extra):
+        parsed = self.unpack(callback.data)
+        if parsed is None:
+            return False
+        op, args = parsed
+        key = self.dedup_key(callback, op)
+        if key is not None and self.dedup.seen(key):
+            await callback.answer(self.duplicate_text)
+            return True
+        try:
+            await self.handlers[op](callback, *extra, *args)
+        except Exception:
+            # Неудачная попытка не должна блокировать повторное нажатие
+            if key is not None:
+                self.dedup.forget(key)
+            raise
+        if key is not None and key != callback.id:
+            # Дальше повторное нажатие отклоняют замки и проверки состояния
+            # в обработчике, а в кэше остаётся только сам callback-запрос
+            self.dedup.forget(key)
+            self.dedup.seen(callback.id)
+        return True
+
+    def dedup_key(self, callback, op):
+        if self.dedup is None:
+            return None
+        if op in self.once and callback.message:
+            return callback.message.chat.id, callback.message.message_id, callback.data
+        return callback.id
@@ -0,0 +1,288 @@
+import hashlib
+import json
+from types import MappingProxyType
+
+# Скомпилированный каталог меню. Товары и категории имеют постоянные целые ID
+# из файла меню, цены и категории товаров лежат в обратном индексе, поэтому
+# поиск товара, подсчёт суммы корзины и пагинация не перебирают всё меню.
+# Каталог не меняется: при перезагрузке меню собирается новый, а неизменённые
+# категории переносятся из предыдущего вместе со своими версиями
+
+class MenuError(ValueError):
+    pass
+
+
+class MenuItem:
+    __slots__ = ("id", "name", "category", "price", "description", "photo")
+
+    def __init__(self, item_id, name, category, price, description, photo):
+        object.__setattr__(self, "id", item_id)
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "category", category)
+        object.__setattr__(self, "price", price)
+        object.__setattr__(self, "description", description)
+        object.__setattr__(self, "photo", photo)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MenuItem нельзя изменять")
+
+    def __repr__(self):
+        return f"MenuItem({self.id}, {self.name!r}, {self.price})"
+
+
+class MenuCatalog:
+    __slots__ = ("items", "by_id", "by_name", "categories", "category_ids", "category_names",
+                 "category_items", "category_versions", "category_sources", "categories_version", "version")
+
+    # categories - список {"id", "name", "items": [{"id", "name", "price", ...}]},
+    # уже проверенный parse_menu. С previous собираются только изменённые категории.
+    # Версия категории - номер версии каталога, в которой она последний раз менялась
+    def __init__(self, categories, version=1, previous=None):
+        category_items = {}
+        category_versions = {}
+        category_sources = {}
+        changed = []
+        for category in categories:
+            category_id, name = category["id"], category["name"]
+            source = json.dumps(category, sort_keys=True, ensure_ascii=False)
+            if previous is not None and previous.category_sources.get(category_id) == source:
+                category_items[name] = previous.category_items[name]
+                category_versions[category_id] = previous.category_versions[category_id]
+            else:
+                category_items[name] = tuple(
+                    MenuItem(item["id"], item["name"], name, item["price"],
+                             item.get("description", ""), item.get("photo"))
+                    for item in category["items"]
+                )
+                category_versions[category_id] = version
+                changed.append(category_id)
+            category_sources[category_id] = source
+
+        # Индексы товаров: копия прежних, в которой заменены только изменённые категории
+        if previous is not None:
+            by_id = dict(previous.by_id)
+            by_name = dict(previous.by_name)
+            for category_id, name in previous.category_names.items():
+                if category_sources.get(category_id) != previous.category_sources[category_id]:
+                    for item in previous.category_items[name]:
+                        by_id.pop(item.id, None)
+                        by_name.pop(item.name, None)
+        else:
+            by_id = {}
+            by_name = {}
+            changed = list(category_sources)
+        for category in categories:
+            if category["id"] in changed:
+                for item in category_items[category["name"]]:
+                    by_id[item.id] = item
+                    by_name[item.name] = item
+
+        category_names = {category["id"]: category["name"] for category in categories}
+        categories_version = version
+        if previous is not None and list(previous.category_names.items()) == list(category_names.items()):
+            categories_version = previous.categories_version
+
+        object.__setattr__(self, "items", tuple(item for items in category_items.values() for item in items))
+        object.__setattr__(self, "by_id", MappingProxyType(by_id))
+        object.__setattr__(self, "by_name", MappingProxyType(by_name))
+        object.__setattr__(self, "categories", tuple(category_items))
+        object.__setattr__(self, "category_ids", MappingProxyType({name: i for i, name in category_names.items()}))
+        object.__setattr__(self, "category_names", MappingProxyType(category_names))
+        object.__setattr__(self, "category_items", MappingProxyType(category_items))
+        object.__setattr__(self, "category_versions", MappingProxyType(category_versions))
+        object.__setattr__(self, "category_sources", MappingProxyType(category_sources))
+        object.__setattr__(self, "categories_version", categories_version)
+        object.__setattr__(self, "version", version)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MenuCatalog нельзя изменять")
+
+    # Каталог из словаря {категория: {название: {"price", "description", "photo"}}};
+    # ID выдаются по порядку
+    @classmethod
+    def from_dict(cls, menu, version=1):
+        categories = []
+        item_id = 0
+        for category_id, (category, category_menu) in enumerate(menu.items()):
+            items = []
+            for name, info in category_menu.items():
+                items.append({"id": item_id, "name": name, **info})
+                item_id += 1
+            categories.append({"id": category_id, "name": category, "items": items})
+        return cls(categories, version)
+
+    def get(self, item_id):
+        return self.by_id.get(item_id)
+
+    def find(self, name):
+        return self.by_name.get(name)
+
+    def category(self, category_id):
+        return self.category_names.get(category_id)
+
+    def category_version(self, category):
+        return self.category_versions[self.category_ids[category]]
+
+    # ID категорий, которые отличаются от other (изменены, добавлены или удалены)
+    def changed_categories(self, other):
+        return {category_id for category_id in set(self.category_sources) | set(other.category_sources)
+                if self.category_sources.get(category_id) != other.category_sources.get(category_id)}
+
+    # Срез элементов страницы и признак того, что есть следующая страница
+    @staticmethod
+    def page(sequence, page, per_page):
+        start_index = page * per_page
+        end_index = min(start_index + per_page, len(sequence))
+        return sequence[start_index:end_index], end_index < len(sequence)
+
+    def categories_page(self, page, per_page):
+        return self.page(self.categories, page, per_page)
+
+    def items_page(self, category, page, per_page):
+        return self.page(self.category_items[category], page, per_page)
+
+
+# Файл меню (JSON или YAML):
+# {"categories": [{"id": 1, "name": "Суши", "items": [
+#     {"id": 1, "name": "Суши с лососем", "price": 600, "description": "...", "photo": "images/..."}]}]}
+# ID товаров и категорий не должны меняться: на них ссылаются кнопки и корзины
+CATEGORY_FIELDS = {"id": int, "name": str, "items": list}
+ITEM_FIELDS = {"id": int, "name": str, "price": (int, float), "description": str, "photo": (str, type(None))}
+ITEM_REQUIRED = ("id", "name", "price")
+
+
+def check_fields(entry, fields, required, where):
+    if not isinstance(entry, dict):
+        raise MenuError(f"{where}: ожидается объект")
+    unknown = set(entry) - set(fields)
+    if unknown:
+        raise MenuError(f"{where}: неизвестные поля {', '.join(sorted(unknown))}")
+    for field in required:
+        if field not in entry:
+            raise MenuError(f"{where}: нет поля {field}")
+    for field, value in entry.items():
+        if isinstance(value, bool) or not isinstance(value, fields[field]):
+            raise MenuError(f"{where}: неверный тип поля {field}")
+    if isinstance(entry.get("name"), str) and not entry["name"].strip():
+        raise MenuError(f"{where}: пустое название")
+
+
+# Проверка структуры меню; возвращает список категорий для MenuCatalog
+def parse_menu(data):
+    if not isinstance(data, dict) or set(data) != {"categories"} or not isinstance(data["categories"], list):
+        raise MenuError("меню должно быть объектом с единственным полем categories (список)")
+    category_ids = set()
+    category_names = set()
+    item_ids = set()
+    item_names = set()
+    for i, category in enumerate(data["categories"]):
+        where = f"categories[{i}]"
+        check_fields(category, CATEGORY_FIELDS, CATEGORY_FIELDS, where)
+        if category["id"] in category_ids or category["name"] in category_names:
+            raise MenuError(f"{where}: повторяется ID или название категории")
+        category_ids.add(category["id"])
+        category_names.add(category["name"])
+        for j, item in enumerate(category["items"]):
+            item_where = f"{where}.items[{j}]"
+            check_fields(item, ITEM_FIELDS, ITEM_REQUIRED, item_where)
+            if item["price"] < 0:
+                raise MenuError(f"{item_where}: отрицательная цена")
+            if item["id"] in item_ids or item["name"] in item_names:
+                raise MenuError(f"{item_where}: повторяется ID или название товара")
+            item_ids.add(item["id"])
+            item_names.add(item["name"])
+    return data["categories"]
+
+
+# Чтение файла меню: возвращает проверенные категории и хэш содержимого
+def load_menu_file(path):
+    with open(path, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    if path.endswith((".yaml", ".yml")):
+        # PyYAML нужен только для меню в YAML
+        try:
+            import yaml
+        except ImportError as e:
+            raise MenuError("для меню в YAML нужен пакет PyYAML") from e
+        try:
+            data = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise MenuError(f"не удалось разобрать {path}: {e}") from e
+    else:
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise MenuError(f"не удалось разобрать {path}: {e}") from e
+    return parse_menu(data), digest
+
+
+# Корзина: ID товара -> количество и сумма, которая поддерживается
+# при каждом изменении, а не пересчитывается по всей корзине. Цена каждой
+# позиции запоминается, чтобы заказ хранил цены на момент оформления
+class Cart:
+    __slots__ = ("items", "total", "prices")
+
+    def __init__(self, items=None, total=0, prices=None):
+        self.items = dict(items or {})
+        self.total = total
+        self.prices = dict(prices or {})
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def add(self, item, quantity=1):
+        current = self.items.get(item.id, 0)
+        new_quantity = max(current + quantity, 0)
+        if new_quantity:
+            self.items[item.id] = new_quantity
+            self.prices[item.id] = item.price
+        else:
+            self.items.pop(item.id, None)
+            self.prices.pop(item.id, None)
+        self.total += (new_quantity - current) * item.price
+        return new_quantity
+
+    # Пересчёт по актуальным ценам; товары, которых больше нет в меню, удаляются
+    def recalculate(self, catalog):
+        items = {}
+        prices = {}
+        total = 0
+        for item_id, quantity in self.items.items():
+            item = catalog.get(item_id)
+            if item:
+                items[item_id] = quantity
+                prices[item_id] = item.price
+                total += item.price * quantity
+        self.items = items
+        self.prices = prices
+        self.total = total
+
+    def lines(self, catalog):
+        return [(catalog.get(item_id), quantity) for item_id, quantity in self.items.items()
+                if catalog.get(item_id)]
+
+    # (ID, количество, цена) по сохранённым ценам, даже если блюда уже нет в меню.
+    # Цены из меню берутся только для заказов, оформленных до сохранения цен
+    def priced_lines(self, catalog):
+        lines = []
+        for item_id, quantity in self.items.items():
+            price = self.prices.get(item_id)
+            if price is None:
+                item = catalog.get(item_id)
+                if item is None:
+                    continue
+                price = item.price
+            lines.append((item_id, quantity, price))
+        return lines
+
+    def to_json(self):
+        return {"items": [[item_id, quantity, self.prices[item_id]] if item_id in self.prices else [item_id, quantity]
+                          for item_id, quantity in self.items.items()],
+                "total": self.total}
+
+    # Строки старого формата - [ID, количество] без цены
+    @classmethod
+    def from_json(cls, data):
+        return cls({line[0]: line[1] for line in data["items"]}, data["total"],
+                   {line[0]: line[2] for line in data["items"] if len(line) > 2})
@@ -0,0 +1,240 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+
+# История подтверждённых заказов для отчётов. Хранится по колонкам: каждая
+# колонка - отдельный файл, в который новые значения только дописываются
+# (ndarray.tofile), а в памяти - массив NumPy. Отчёты считаются векторно,
+# а суммы по дням, часам и товарам поддерживаются при каждой записи,
+# поэтому отчёт за период не перебирает все заказы
+
+ORDER_COLUMNS = {"ts": np.int64, "total": np.float64, "items": np.int32}
+LINE_COLUMNS = {"order": np.int64, "item_id": np.int64, "quantity": np.int32, "price": np.float64}
+SECONDS_PER_DAY = 86400
+
+
+class Column:
+    __slots__ = ("data", "size")
+
+    def __init__(self, dtype, values=None):
+        values = np.asarray(values if values is not None else [], dtype=dtype)
+        self.data = np.empty(max(1024, len(values) * 2), dtype=dtype)
+        self.data[:len(values)] = values
+        self.size = len(values)
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            data = np.empty(max(end, len(self.data) * 2), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:end] = values
+        self.size = end
+
+    @property
+    def values(self):
+        return self.data[:self.size]
+
+
+# Счётчики, индексированные целым ключом (день, строка товара), растут по мере надобности
+class Rollup:
+    __slots__ = ("data",)
+
+    def __init__(self, width=1):
+        self.data = np.zeros((0, width))
+
+    # values - массив (n, width): к строке index[i] прибавляется values[i]
+    def add(self, index, values):
+        if not len(index):
+            return
+        size = int(index.max()) + 1
+        if size > len(self.data):
+            grown = np.zeros((max(size, len(self.data) * 2), self.data.shape[1]))
+            grown[:len(self.data)] = self.data
+            self.data = grown
+        for column in range(self.data.shape[1]):
+            self.data[:size, column] += np.bincount(index, weights=values[:, column], minlength=size)
+
+
+class OrderHistory:
+    def __init__(self, path, utc_offset_hours=0, flush_interval=1.0):
+        self.path = path
+        self.utc_offset = int(utc_offset_hours * 3600)
+        self.flush_interval = flush_interval
+        self.orders = {}
+        self.lines = {}
+        self.pending = []
+        self.dirty = asyncio.Event()
+        # Суммы по дням: выручка, заказы, позиции; число заказов по часам
+        # (строка день * 24 + час); по товарам - количество и выручка
+        self.daily = Rollup(3)
+        self.hourly = Rollup(1)
+        self.by_item = Rollup(2)
+        self.first_day = None
+        # ID товара в меню может быть любым целым (отрицательным, артикулом),
+        # поэтому суммы по товарам хранятся по плотным номерам строк
+        self.item_rows = {}
+        self.item_ids = []
+
+    def column_path(self, table, name):
+        return os.path.join(self.path, f"{table}.{name}.bin")
+
+    def load(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.upgrade_item_column()
+        orders = {name: self.read_column("orders", name, dtype) for name, dtype in ORDER_COLUMNS.items()}
+        lines = {name: self.read_column("lines", name, dtype) for name, dtype in LINE_COLUMNS.items()}
+        # После сбоя колонки могут оказаться разной длины - отбрасываем недописанный хвост
+        order_count = min(len(values) for values in orders.values())
+        line_count = min(len(values) for values in lines.values())
+        line_count = int(np.searchsorted(lines["order"][:line_count], order_count))
+        self.orders = {name: Column(ORDER_COLUMNS[name]) for name in ORDER_COLUMNS}
+        self.lines = {name: Column(LINE_COLUMNS[name]) for name in LINE_COLUMNS}
+        self.extend({name: values[:order_count] for name, values in orders.items()},
+                    {name: values[:line_count] for name, values in lines.items()})
+        self.pending = []
+        for table, columns, count in (("orders", ORDER_COLUMNS, order_count), ("lines", LINE_COLUMNS, line_count)):
+            for name, dtype in columns.items():
+                path = self.column_path(table, name)
+                if os.path.getsize(path) != count * np.dtype(dtype).itemsize:
+                    os.truncate(path, count * np.dtype(dtype).itemsize)
+        return self
+
+    # Раньше ID товаров хранились в int32 в lines.item.bin
+    def upgrade_item_column(self):
+        old_path = self.column_path("lines", "item")
+        path = self.column_path("lines", "item_id")
+        if os.path.exists(old_path) and not os.path.exists(path):
+            tmp_path = f"{path}.tmp"
+            np.fromfile(old_path, dtype=np.int32).astype(np.int64).tofile(tmp_path)
+            os.replace(tmp_path, path)
+            os.remove(old_path)
+
+    def read_column(self, table, name, dtype):
+        path = self.column_path(table, name)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        return np.fromfile(path, dtype=dtype)
+
+    def __len__(self):
+        return self.orders["ts"].size
+
+    def day(self, timestamps):
+        return (np.asarray(timestamps, dtype=np.int64) + self.utc_offset) // SECONDS_PER_DAY
+
+    # Запись заказа: lines - список (ID товара, количество, цена)
+    def append(self, total, lines, timestamp=None):
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        # Время в истории не убывает, чтобы период можно было найти бинарным поиском
+        if len(self):
+            timestamp = max(timestamp, int(self.orders["ts"].values[-1]))
+        order_index = len(self)
+        self.extend(
+            {"ts": [timestamp], "total": [total], "items": [sum(quantity for _, quantity, _ in lines)]},
+            {"order": [order_index] * len(lines),
+             "item_id": [item_id for item_id, _, _ in lines],
+             "quantity": [quantity for _, quantity, _ in lines],
+             "price": [price for _, _, price in lines]},
+        )
+        self.dirty.set()
+
+    # Номера строк сумм по товарам для массива ID, новые ID получают следующие номера
+    def item_row_index(self, item_ids):
+        unique_ids, inverse = np.unique(item_ids, return_inverse=True)
+        rows = np.empty(len(unique_ids), dtype=np.int64)
+        for position, item_id in enumerate(unique_ids.tolist()):
+            row = self.item_rows.get(item_id)
+            if row is None:
+                row = self.item_rows[item_id] = len(self.item_ids)
+                self.item_ids.append(item_id)
+            rows[position] = row
+        return rows[inverse]
+
+    # Пакетное добавление колонок (при загрузке, в append и в бенчмарке).
+    # Все значения приводятся к типам колонок до изменения истории
+    def extend(self, orders, lines):
+        orders = {name: np.asarray(orders[name], dtype=dtype) for name, dtype in ORDER_COLUMNS.items()}
+        lines = {name: np.asarray(lines[name], dtype=dtype) for name, dtype in LINE_COLUMNS.items()}
+        for name, values in orders.items():
+            self.orders[name].extend(values)
+        for name, values in lines.items():
+            self.lines[name].extend(values)
+        self.pending.append((orders, lines))
+
+        days = self.day(orders["ts"])
+        if not len(days):
+            return
+        if self.first_day is None:
+            self.first_day = int(days.min())
+        day_index = days - self.first_day
+        hours = (orders["ts"] + self.utc_offset) % SECONDS_PER_DAY // 3600
+        self.daily.add(day_index, np.column_stack([orders["total"], np.ones(len(days)), orders["items"]]))
+        self.hourly.add(day_index * 24 + hours, np.ones((len(days), 1)))
+        if len(lines["item_id"]):
+            self.by_item.add(self.item_row_index(lines["item_id"]),
+                             np.column_stack([lines["quantity"], lines["quantity"] * lines["price"]]))
+
+    def write_pending(self, batches):
+        for table, columns, index in (("orders", ORDER_COLUMNS, 0), ("lines", LINE_COLUMNS, 1)):
+            for name in columns:
+                with open(self.column_path(table, name), "ab") as f:
+                    for batch in batches:
+                        batch[index][name].tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    async def flush(self):
+        batches, self.pending = self.pending, []
+        self.dirty.clear()
+        if batches:
+            await asyncio.to_thread(self.write_pending, batches)
+
+    async def run(self):
+        while True:
+            await self.dirty.wait()
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка записи истории заказов: {e}")
+
+    async def close(self):
+        await self.flush()
+
+    # Отчёт за последние days дней (включая сегодняшний) или за всё время (days=None)
+    def report(self, days=None, now=None, top=5):
+        if not len(self):
+            return None
+        today = int(self.day([now if now is not None else time.time()])[0]) - self.first_day
+        start_day = 0 if days is None else max(today - days + 1, 0)
+        daily = self.daily.data[start_day:today + 1]
+        revenue, order_count, item_count = daily.sum(axis=0)
+        hourly = self.hourly.data[start_day * 24:(today + 1) * 24, 0]
+        hourly = np.bincount(np.arange(len(hourly)) % 24, weights=hourly, minlength=24)
+
+        if start_day == 0:
+            quantities, item_revenue = self.by_item.data.T
+            item_ids = self.item_ids
+        else:
+            # Товары за период - по строкам заказов начиная с первого заказа периода
+            start_ts = (start_day + self.first_day) * SECONDS_PER_DAY - self.utc_offset
+            first_order = int(np.searchsorted(self.orders["ts"].values, start_ts))
+            first_line = int(np.searchsorted(self.lines["order"].values, first_order))
+            item_ids, rows = np.unique(self.lines["item_id"].values[first_line:], return_inverse=True)
+            quantity = self.lines["quantity"].values[first_line:]
+            quantities = np.bincount(rows, weights=quantity)
+            item_revenue = np.bincount(rows, weights=quantity * self.lines["price"].values[first_line:])
+        best = np.argsort(quantities, kind="stable")[::-1][:top]
+        top_items = [(int(item_ids[i]), int(quantities[i]), float(item_revenue[i])) for i in best if quantities[i] > 0]
+
+        return {
+            "revenue": float(revenue),
+            "orders": int(order_count),
+            "items": int(item_count),
+            "average_check": float(revenue / order_count) if order_count else 0.0,
+            "average_items": float(item_count / order_count) if order_count else 0.0,
+            "top_items": top_items,
+            "hourly": [int(count) for count in hourly],
+        }
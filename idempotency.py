@@ -0,0 +1,62 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+# Защита от повторной обработки: двойные нажатия на кнопки и повторная
+# доставка обновлений. DedupCache помнит ключи (ID callback-запроса, сообщения
+# или обновления) в течение ttl секунд, KeyedLocks не даёт двум обработчикам
+# одновременно менять один и тот же заказ
+
+
+class DedupCache:
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.expires = OrderedDict()
+
+    # True, если ключ уже встречался за последние ttl секунд; иначе запоминает его
+    def seen(self, key):
+        now = time.monotonic()
+        while self.expires:
+            oldest, expires_at = next(iter(self.expires.items()))
+            if expires_at > now and len(self.expires) < self.max_size:
+                break
+            del self.expires[oldest]
+        if key in self.expires:
+            return True
+        self.expires[key] = now + self.ttl
+        return False
+
+    # Забыть ключ, если обработка не удалась и повтор должен пройти
+    def forget(self, key):
+        self.expires.pop(key, None)
+
+    def __len__(self):
+        return len(self.expires)
+
+
+class KeyedLocks:
+    def __init__(self):
+        self.locks = {}
+        self.waiters = {}
+
+    # async with order_locks(user_id) или order_locks(order_lock_key(order_id)): ... -
+    # замок создаётся на время использования
+    @asynccontextmanager
+    async def __call__(self, key):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        self.waiters[key] = self.waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.waiters[key] -= 1
+            if not self.waiters[key]:
+                del self.waiters[key]
+                del self.locks[key]
+
+    def __len__(self):
+        return len(self.locks)
@@ -0,0 +1,228 @@
+import argparse
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Подготовка фото меню: из исходных файлов в images/ один раз делаются сжатые
+# JPEG нужных Telegram размеров (card - карточка товара, preview - фото в альбоме
+# категории). Варианты лежат в IMAGES_CACHE_DIR под именем из хэша содержимого
+# исходника и настроек сжатия, поэтому неизменённые файлы не пережимаются,
+# а изменённый файл получает новое имя (и новый file_id в PhotoCache).
+# Сжатие идёт в пуле потоков: Pillow отпускает GIL при декодировании,
+# масштабировании и кодировании, а процессы пришлось бы порождать из бота
+# с его потоками и соединениями. Pillow импортируется только при сжатии,
+# чтобы не замедлять запуск бота. Без Pillow бот отправляет исходные файлы
+# Запуск без бота: python images.py [--menu menu.json] [--output images_cache]
+
+# Telegram всё равно уменьшает фото до 1280 пикселей по большей стороне
+VARIANTS = {"card": 1280, "preview": 640}
+JPEG_QUALITY = 82
+MANIFEST_NAME = "manifest.json"
+EXIF_ORIENTATION = 0x0112
+
+
+def available():
+    return importlib.util.find_spec("PIL") is not None
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def flatten(image):
+    from PIL import Image
+    if image.mode in ("RGBA", "LA", "P"):
+        # Прозрачный фон JPEG не поддерживает - заливаем белым
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+
+# Выполняется в потоке пула. targets - [(размер, путь варианта)], возвращает
+# {путь варианта: байт}. Варианты считаются от большего к меньшему: каждый
+# следующий уменьшается из предыдущего, а не из исходника
+def encode_variants(source_path, targets, quality):
+    from PIL import Image, ImageOps
+    with open(source_path, "rb") as f:
+        source = f.read()
+    with Image.open(io.BytesIO(source)) as original:
+        source_format = original.format
+        rotated = original.getexif().get(EXIF_ORIENTATION, 1) != 1
+        image = flatten(ImageOps.exif_transpose(original))
+    written = {}
+    for size, output_path in sorted(targets, reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+        data = buffer.getvalue()
+        # Небольшой исходный JPEG пережатие только увеличит - берём как есть
+        if (source_format == "JPEG" and not rotated and len(source) <= len(data)
+                and max(image.size) == max(original.size)):
+            data = source
+        write_atomic(output_path, data)
+        written[output_path] = len(data)
+    return written
+
+
+class ImagePipeline:
+    def __init__(self, output_dir, variants=None, quality=JPEG_QUALITY, workers=0):
+        self.output_dir = output_dir
+        self.variants = variants or VARIANTS
+        self.quality = quality
+        self.workers = workers or os.cpu_count() or 1
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        # исходный путь -> {"signature", "hash", "bytes", "variants": {вариант: {"path", "bytes"}}}
+        self.manifest = {}
+        self.manifest_signature = None
+
+    def load(self):
+        for name in self.variants:
+            os.makedirs(os.path.join(self.output_dir, name), exist_ok=True)
+        try:
+            self.manifest_signature = file_signature(self.manifest_path)
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+        return self
+
+    # Перечитывает манифест, если варианты подготовил другой процесс
+    def refresh(self):
+        try:
+            signature = file_signature(self.manifest_path)
+        except FileNotFoundError:
+            return False
+        if signature == self.manifest_signature:
+            return False
+        self.load()
+        return True
+
+    # Путь варианта для отправки; пока вариант не готов - исходный файл
+    def variant(self, source_path, name):
+        entry = self.manifest.get(source_path)
+        if entry and name in entry["variants"]:
+            return entry["variants"][name]["path"]
+        return source_path
+
+    def variant_path(self, digest, name):
+        size = self.variants[name]
+        return os.path.join(self.output_dir, name, f"{digest[:20]}-{size}-q{self.quality}.jpg")
+
+    # Готовит варианты для списка исходных файлов. Возвращает статистику и
+    # пути вариантов, которые заменены новыми (их file_id больше не нужны)
+    def build(self, source_paths):
+        started = time.perf_counter()
+        result = {"encoded": 0, "skipped": 0, "missing": [], "obsolete": [], "failed": []}
+        jobs = {}
+        for source_path in source_paths:
+            entry = self.manifest.get(source_path)
+            try:
+                signature = file_signature(source_path)
+                if entry and entry["signature"] == signature and self.ready(entry):
+                    result["skipped"] += 1
+                    continue
+                digest = file_hash(source_path)
+            except FileNotFoundError:
+                result["missing"].append(source_path)
+                continue
+            paths = {name: self.variant_path(digest, name) for name in self.variants}
+            # Варианты с тем же содержимым уже есть (файл только "тронули" или
+            # их сделал другой процесс бота) - пережимать нечего
+            targets = [(self.variants[name], path) for name, path in paths.items() if not os.path.exists(path)]
+            new_entry = {"signature": signature, "hash": digest, "bytes": int(signature.split(":")[1]),
+                         "variants": {name: {"path": path, "bytes": 0} for name, path in paths.items()}}
+            jobs[source_path] = (new_entry, targets)
+
+        to_encode = [(source_path, targets) for source_path, (_, targets) in jobs.items() if targets]
+        written = {}
+        if to_encode and not available():
+            result["failed"] = [source_path for source_path, _ in to_encode]
+            to_encode = []
+        if len(to_encode) == 1 or (to_encode and self.workers == 1):
+            for source_path, targets in to_encode:
+                written[source_path] = self.encode(source_path, targets, result)
+        elif to_encode:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(to_encode))) as executor:
+                futures = {source_path: executor.submit(encode_variants, source_path, targets, self.quality)
+                           for source_path, targets in to_encode}
+                for source_path, future in futures.items():
+                    try:
+                        written[source_path] = future.result()
+                    except Exception as e:
+                        print(f"Ошибка обработки фото {source_path}: {e}")
+                        result["failed"].append(source_path)
+
+        for source_path, (new_entry, targets) in jobs.items():
+            if source_path in result["failed"]:
+                continue
+            sizes = written.get(source_path, {})
+            for variant in new_entry["variants"].values():
+                variant["bytes"] = sizes.get(variant["path"]) or os.path.getsize(variant["path"])
+            entry = self.manifest.get(source_path)
+            if entry:
+                result["obsolete"] += [variant["path"] for name, variant in entry["variants"].items()
+                                       if variant["path"] != new_entry["variants"].get(name, {}).get("path")]
+            self.manifest[source_path] = new_entry
+            if targets:
+                result["encoded"] += 1
+            else:
+                result["skipped"] += 1
+        if jobs:
+            write_atomic(self.manifest_path, json.dumps(self.manifest, ensure_ascii=False).encode("utf-8"))
+        result["seconds"] = time.perf_counter() - started
+        return result
+
+    def encode(self, source_path, targets, result):
+        try:
+            return encode_variants(source_path, targets, self.quality)
+        except Exception as e:
+            print(f"Ошибка обработки фото {source_path}: {e}")
+            result["failed"].append(source_path)
+            return {}
+
+    def ready(self, entry):
+        return (set(entry["variants"]) == set(self.variants)
+                and all(variant["path"] == self.variant_path(entry["hash"], name)
+                        and os.path.exists(variant["path"]) for name, variant in entry["variants"].items()))
+
+
+if __name__ == "__main__":
+    from catalog import MenuCatalog, load_menu_file
+
+    parser = argparse.ArgumentParser(description="Подготовка фото меню для Telegram")
+    parser.add_argument("--menu", default=os.getenv("MENU_PATH", "menu.json"), help="файл меню")
+    parser.add_argument("--output", default=os.getenv("IMAGES_CACHE_DIR", "images_cache"), help="каталог вариантов")
+    parser.add_argument("--workers", type=int, default=0, help="потоков сжатия (0 - по числу ядер)")
+    args = parser.parse_args()
+
+    if not available():
+        raise SystemExit("Для подготовки фото нужен пакет Pillow")
+    catalog = MenuCatalog(load_menu_file(args.menu)[0])
+    pipeline = ImagePipeline(args.output, workers=args.workers).load()
+    photos = sorted({item.photo for item in catalog.items if item.photo})
+    result = pipeline.build(photos)
+    print(f"Сжато: {result['encoded']}, без изменений: {result['skipped']}, "
+          f"не найдено: {len(result['missing'])}, ошибок: {len(result['failed'])}, "
+          f"за {result['seconds']:.2f} с")
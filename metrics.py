@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Метрики бота: гистограммы времени обработчиков, число обработчиков в работе
+# и ошибок, время ввода-вывода (Google Sheets, журнал заказов, запросы к Telegram).
+# Отдаются в формате Prometheus и сводкой для команды администратора /stats
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Время ввода-вывода текущего обработчика по видам - для разбора медленных вызовов
+io_breakdown = ContextVar("io_breakdown", default=None)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # Оценка квантиля сверху - граница корзины, в которую он попал
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        seen = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            seen += count
+            yield bound, seen
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.handlers = {}
+        self.io = {}
+        self.in_flight = Counter()
+        self.errors = Counter()
+        self.started = time.time()
+
+    def handler(self, name):
+        histogram = self.handlers.get(name)
+        if histogram is None:
+            histogram = self.handlers[name] = Histogram(self.buckets)
+        return histogram
+
+    def observe_io(self, op, seconds):
+        histogram = self.io.get(op)
+        if histogram is None:
+            histogram = self.io[op] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        breakdown = io_breakdown.get()
+        if breakdown is not None:
+            breakdown[op] += seconds
+
+    # Замер ввода-вывода: with metrics.io_timer("sheets"): ...
+    @contextmanager
+    def io_timer(self, op):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_io(op, time.perf_counter() - started)
+
+    def render_prometheus(self, gauges=None):
+        lines = []
+        self.render_histograms(lines, "bot_handler_duration_seconds", "handler", self.handlers,
+                               "Время работы обработчиков")
+        lines.append("# HELP bot_handler_in_flight Обработчики, работающие сейчас")
+        lines.append("# TYPE bot_handler_in_flight gauge")
+        for name, value in sorted(self.in_flight.items()):
+            lines.append(f'bot_handler_in_flight{{handler="{name}"}} {value}')
+        lines.append("# HELP bot_handler_errors_total Исключения в обработчиках")
+        lines.append("# TYPE bot_handler_errors_total counter")
+        for name, value in sorted(self.errors.items()):
+            lines.append(f'bot_handler_errors_total{{handler="{name}"}} {value}')
+        self.render_histograms(lines, "bot_io_duration_seconds", "op", self.io,
+                               "Время ввода-вывода")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE bot_{name} gauge")
+            lines.append(f"bot_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def render_histograms(lines, metric, label, histograms, help_text):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for name, histogram in sorted(histograms.items()):
+            for bound, count in histogram.cumulative():
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {count}')
+            lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram.sum:.6f}')
+            lines.append(f'{metric}_count{{{label}="{name}"}} {histogram.count}')
+
+    def summary(self, limit=10):
+        lines = [f"⏱ Работает {int(time.time() - self.started) // 60} мин"]
+        busiest = sorted(self.handlers.items(), key=lambda entry: entry[1].sum, reverse=True)[:limit]
+        if busiest:
+            lines.append("\nОбработчики (вызовов, p50/p95/max, мс):")
+        for name, histogram in busiest:
+            line = (f"{name}: {histogram.count}, {histogram.quantile(0.5) * 1e3:.0f}/"
+                    f"{histogram.quantile(0.95) * 1e3:.0f}/{histogram.max * 1e3:.0f}")
+            if self.errors[name]:
+                line += f", ошибок {self.errors[name]}"
+            if self.in_flight[name]:
+                line += f", в работе {self.in_flight[name]}"
+            lines.append(line)
+        if self.io:
+            lines.append("\nВвод-вывод (вызовов, среднее/p95, мс):")
+        for op, histogram in sorted(self.io.items()):
+            lines.append(f"{op}: {histogram.count}, {histogram.sum / histogram.count * 1e3:.1f}/"
+                         f"{histogram.quantile(0.95) * 1e3:.0f}")
+        return "\n".join(lines)
+
+
+# Стек ожидания задачи: цепочка корутин по cr_await до места, где она стоит.
+# Кадры до start_code (диспетчер и внешние middleware) отбрасываются
+def await_stack(task, start_code=None, limit=10):
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        if frame.f_code is start_code:
+            frames = []
+        else:
+            frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return "".join(traceback.StackSummary.extract(frames[-limit:]).format())
+
+
+# Middleware обработчиков: время, число в работе и ошибки по имени обработчика.
+# Если обработчик работает дольше slow_threshold, в лог пишется его стек
+# ожидания в этот момент и разбивка времени по вводу-выводу
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self, metrics, slow_threshold=1.0, name_of=None):
+        self.metrics = metrics
+        self.slow_threshold = slow_threshold
+        self.name_of = name_of
+
+    def handler_name(self, event, data):
+        if self.name_of:
+            name = self.name_of(event, data)
+            if name:
+                return name
+        handler = data.get("handler")
+        return getattr(getattr(handler, "callback", None), "__name__", type(event).__name__)
+
+    async def __call__(self, handler, event, data):
+        name = self.handler_name(event, data)
+        breakdown = Counter()
+        token = io_breakdown.set(breakdown)
+        samples = []
+        timer = None
+        if self.slow_threshold > 0:
+            task = asyncio.current_task()
+            timer = asyncio.get_running_loop().call_later(
+                self.slow_threshold, lambda: samples.append(await_stack(task, HandlerMetricsMiddleware.__call__.__code__)))
+        self.metrics.in_flight[name] += 1
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.errors[name] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.in_flight[name] -= 1
+            self.metrics.handler(name).observe(elapsed)
+            io_breakdown.reset(token)
+            if timer:
+                timer.cancel()
+            if self.slow_threshold > 0 and elapsed >= self.slow_threshold:
+                io_time = ", ".join(f"{op} {seconds:.3f} с" for op, seconds in breakdown.most_common())
+                logging.warning("Медленный обработчик %s: %.3f с (ввод-вывод: %s)%s", name, elapsed,
+                                io_time or "нет",
+                                "\nСтек через %g с:\n%s" % (self.slow_threshold, samples[0]) if samples else "")
+
+
+# Middleware сессии: время каждого запроса к Telegram. Подключается после
+# ограничителя частоты, поэтому ожидание лимитов в замер не входит
+class RequestTimerMiddleware(BaseRequestMiddleware):
+    def __init__(self, metrics, op="telegram"):
+        self.metrics = metrics
+        self.op = op
+
+    async def __call__(self, make_request, bot, method):
+        with self.metrics.io_timer(self.op):
+            return await make_request(bot, method)
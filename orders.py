@@ -0,0 +1,420 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from contextlib import nullcontext
+
+# Хранилище заказов. У каждого заказа постоянный номер (id), статус
+# (ждёт подтверждения или подтверждён) и вторичные индексы по ID пользователя
+# Telegram, нормализованному телефону и статусу, поэтому история клиента,
+# поиск по телефону и подсчёт заказов не перебирают все заказы.
+# Подтверждённые заказы остаются в хранилище - это история для "Мои заказы"
+
+ORDER_PENDING = "pending"
+ORDER_CONFIRMED = "confirmed"
+
+
+# "+7 (999) 123-45-67", "8 999 123 45 67" и "79991234567" - один телефон
+def normalize_phone(phone):
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    return digits
+
+
+# Общий интерфейс хранилищ: JournalOrderStore (один процесс) и SqliteOrderStore
+class OrderStore(ABC):
+    @abstractmethod
+    def load(self):
+        pass
+
+    # Новый заказ: присваивает номер и статус "ждёт подтверждения", возвращает заказ
+    @abstractmethod
+    def create(self, order):
+        pass
+
+    @abstractmethod
+    def get(self, order_id):
+        pass
+
+    # Сохранить изменённый заказ (с тем же id)
+    @abstractmethod
+    def put(self, order):
+        pass
+
+    # Атомарно перевести заказ из "ждёт подтверждения" в "подтверждён" и вернуть его.
+    # Из нескольких одновременных вызовов (в том числе из разных процессов)
+    # заказ получит только один, остальные - None
+    @abstractmethod
+    def claim(self, order_id):
+        pass
+
+    # Вернуть заказ в "ждёт подтверждения", если после claim обработка не удалась
+    @abstractmethod
+    def release(self, order_id):
+        pass
+
+    # Заказы пользователя, новые первыми
+    @abstractmethod
+    def user_orders(self, user_id, offset=0, limit=5):
+        pass
+
+    @abstractmethod
+    def count_user_orders(self, user_id):
+        pass
+
+    @abstractmethod
+    def phone_orders(self, phone, limit=10):
+        pass
+
+    @abstractmethod
+    def count(self, status):
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    async def run(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+# Журнал операций: каждое изменение - одна строка JSON с заказом целиком в конце
+# файла. Строки копятся в памяти и пишутся фоновой задачей с одним fsync на группу.
+# Когда устаревших записей становится слишком много, журнал переписывается снимком.
+# Индексы - отсортированные списки номеров заказов (номера растут, поэтому новый
+# заказ дописывается в конец). Журнал прежнего формата (заказы по телефону)
+# переводится в новый при загрузке
+class JournalOrderStore(OrderStore):
+    def __init__(self, path, legacy_path=None, fsync_interval=0.05, compact_min_records=1000, metrics=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.fsync_interval = fsync_interval
+        self.compact_min_records = compact_min_records
+        self.metrics = metrics
+        self.orders = {}
+        self.by_user = {}
+        self.by_phone = {}
+        self.by_status = {}
+        self.next_id = 1
+        self.pending = []
+        self.records = 0
+        self.dirty = asyncio.Event()
+        self.file = None
+
+    def io_timer(self):
+        return self.metrics.io_timer("orders") if self.metrics else nullcontext()
+
+    def load(self):
+        # Телефон -> номер заказа для записей прежнего формата
+        legacy_keys = {}
+        migrated = False
+        if os.path.exists(self.path):
+            migrated = self.replay(legacy_keys)
+        elif self.legacy_path and os.path.exists(self.legacy_path):
+            with open(self.legacy_path, "r") as f:
+                for phone, order in json.load(f).items():
+                    self.put_legacy(legacy_keys, phone, order)
+        if migrated or not os.path.exists(self.path):
+            self.write_snapshot(self.snapshot_lines())
+        self.file = open(self.path, "a", encoding="utf-8")
+        return self
+
+    # Возвращает True, если в журнале были записи прежнего формата
+    def replay(self, legacy_keys):
+        migrated = False
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Недописанная строка после сбоя - пропускаем
+                    continue
+                self.records += 1
+                if record["op"] == "put" and "id" in record["order"]:
+                    self.index(record["order"])
+                elif record["op"] == "put":
+                    self.put_legacy(legacy_keys, record["key"], record["order"])
+                    migrated = True
+                else:
+                    # Раньше заказ удалялся, когда администратор его подтверждал
+                    order_id = legacy_keys.pop(record["key"], None)
+                    if order_id is not None:
+                        self.index(dict(self.orders[order_id], status=ORDER_CONFIRMED))
+                    migrated = True
+        return migrated
+
+    def put_legacy(self, legacy_keys, phone, order):
+        order_id = legacy_keys.get(phone)
+        if order_id is None:
+            order_id = legacy_keys[phone] = self.next_id
+        self.index(dict(order, id=order_id, user_id=None, status=ORDER_PENDING, created=time.time()))
+
+    def index(self, order):
+        order_id = order["id"]
+        previous = self.orders.get(order_id)
+        if previous is not None:
+            self.unindex(previous)
+        self.orders[order_id] = order
+        if order.get("user_id") is not None:
+            insort(self.by_user.setdefault(order["user_id"], []), order_id)
+        insort(self.by_phone.setdefault(normalize_phone(order.get("phone")), []), order_id)
+        self.by_status.setdefault(order["status"], set()).add(order_id)
+        self.next_id = max(self.next_id, order_id + 1)
+
+    def unindex(self, order):
+        order_id = order["id"]
+        for index, key in ((self.by_user, order.get("user_id")), (self.by_phone, normalize_phone(order.get("phone")))):
+            ids = index.get(key)
+            if ids:
+                position = bisect_left(ids, order_id)
+                if position < len(ids) and ids[position] == order_id:
+                    del ids[position]
+        self.by_status[order["status"]].discard(order_id)
+
+    def create(self, order):
+        order = dict(order, id=self.next_id, status=ORDER_PENDING, created=time.time())
+        self.put(order)
+        return dict(order)
+
+    def get(self, order_id):
+        order = self.orders.get(order_id)
+        return dict(order) if order is not None else None
+
+    def put(self, order):
+        order = dict(order)
+        self.index(order)
+        self.append({"op": "put", "order": order})
+
+    def claim(self, order_id):
+        order = self.orders.get(order_id)
+        if order is None or order["status"] != ORDER_PENDING:
+            return None
+        order = dict(order, status=ORDER_CONFIRMED)
+        self.put(order)
+        return order
+
+    def release(self, order_id):
+        order = self.orders.get(order_id)
+        if order is not None:
+            self.put(dict(order, status=ORDER_PENDING))
+
+    # Срез отсортированного списка номеров: новые первыми
+    def newest(self, ids, offset, limit):
+        end = max(len(ids) - offset, 0)
+        return [dict(self.orders[order_id]) for order_id in reversed(ids[max(end - limit, 0):end])]
+
+    def user_orders(self, user_id, offset=0, limit=5):
+        return self.newest(self.by_user.get(user_id, []), offset, limit)
+
+    def count_user_orders(self, user_id):
+        return len(self.by_user.get(user_id, ()))
+
+    def phone_orders(self, phone, limit=10):
+        return self.newest(self.by_phone.get(normalize_phone(phone), []), 0, limit)
+
+    def count(self, status):
+        return len(self.by_status.get(status, ()))
+
+    def __len__(self):
+        return len(self.orders)
+
+    def append(self, record):
+        self.pending.append(json.dumps(record, ensure_ascii=False) + "\n")
+        self.dirty.set()
+
+    def write_pending(self, lines):
+        self.file.writelines(lines)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def snapshot_lines(self):
+        return [json.dumps({"op": "put", "order": order}, ensure_ascii=False) + "\n"
+                for order in list(self.orders.values())]
+
+    def write_snapshot(self, lines):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.records = len(lines)
+
+    def compact(self):
+        self.file.close()
+        self.write_snapshot(self.snapshot_lines())
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    async def flush(self):
+        lines, self.pending = self.pending, []
+        self.dirty.clear()
+        if lines:
+            with self.io_timer():
+                await asyncio.to_thread(self.write_pending, lines)
+            self.records += len(lines)
+
+    async def run(self):
+        while True:
+            await self.dirty.wait()
+            # Небольшая задержка, чтобы записать несколько изменений одним fsync
+            await asyncio.sleep(self.fsync_interval)
+            try:
+                await self.flush()
+                if self.records > max(self.compact_min_records, 4 * len(self.orders)):
+                    with self.io_timer():
+                        await asyncio.to_thread(self.compact)
+            except Exception as e:
+                print(f"Ошибка записи журнала заказов: {e}")
+
+    async def close(self):
+        await self.flush()
+        self.file.close()
+
+
+# Общая база заказов для нескольких процессов бота. Каждое изменение - отдельная
+# транзакция SQLite в режиме WAL, поэтому запись одного процесса сразу видна
+# остальным; индексы - обычные индексы SQLite. Заказы из журнала однопроцессного
+# режима переносятся при первом запуске
+class SqliteOrderStore(OrderStore):
+    COLUMNS = "id, status, value"
+
+    def __init__(self, path, legacy_path=None, metrics=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.metrics = metrics
+        self.conn = None
+
+    def io_timer(self):
+        return self.metrics.io_timer("orders") if self.metrics else nullcontext()
+
+    def load(self):
+        self.conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # Процессы запускаются одновременно: схему и перенос старых заказов
+        # выполняет тот, кто первым взял блокировку записи
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(orders)")]
+            if "key" in columns:
+                self.conn.execute("ALTER TABLE orders RENAME TO orders_by_phone")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS orders ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, phone TEXT NOT NULL, "
+                "status TEXT NOT NULL, created REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id, id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS orders_phone ON orders (phone, id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS orders_status ON orders (status, id)")
+            # Заказы из журнала сохраняют свои номера: на них ссылаются кнопки
+            # в уже отправленных сообщениях и история клиентов
+            if self.legacy_path and os.path.exists(self.legacy_path):
+                journal = JournalOrderStore(self.legacy_path)
+                journal.replay({})
+                for order in journal.orders.values():
+                    self.insert(order, order.pop("status"))
+                os.replace(self.legacy_path, self.legacy_path + ".imported")
+            if "key" in columns:
+                # Таблица прежнего формата: ожидающие заказы по телефону
+                for phone, value in self.conn.execute("SELECT key, value FROM orders_by_phone").fetchall():
+                    self.insert(dict(json.loads(value), phone=phone, user_id=None))
+                self.conn.execute("DROP TABLE orders_by_phone")
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return self
+
+    # Номер заказа задаётся явно, если он уже есть (перенос из журнала), иначе - новый
+    def insert(self, order, status=ORDER_PENDING):
+        order = dict(order, status=status, created=order.get("created") or time.time())
+        order_id = self.conn.execute(
+            "INSERT INTO orders (id, user_id, phone, status, created, value) VALUES (?, ?, ?, ?, ?, ?) RETURNING id",
+            (order.get("id"), order.get("user_id"), normalize_phone(order.get("phone")), status, order["created"],
+             json.dumps(order, ensure_ascii=False))
+        ).fetchone()[0]
+        order["id"] = order_id
+        return order
+
+    # Сколько заказов лежит в базе path (0, если базы нет). Однопроцессный режим
+    # не должен запускаться поверх неё: журнал начал бы нумерацию заново
+    @staticmethod
+    def stored_orders(path):
+        if not os.path.exists(path):
+            return 0
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=10)
+        try:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orders'").fetchone():
+                return 0
+            return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        finally:
+            conn.close()
+
+    # Статус хранится в отдельной колонке и в JSON может быть устаревшим
+    @staticmethod
+    def row_order(row):
+        order_id, status, value = row
+        return dict(json.loads(value), id=order_id, status=status)
+
+    def create(self, order):
+        with self.io_timer():
+            return self.insert(order)
+
+    def get(self, order_id):
+        row = self.conn.execute(f"SELECT {self.COLUMNS} FROM orders WHERE id = ?", (order_id,)).fetchone()
+        return self.row_order(row) if row else None
+
+    def put(self, order):
+        with self.io_timer():
+            self.conn.execute(
+                "UPDATE orders SET user_id = ?, phone = ?, status = ?, value = ? WHERE id = ?",
+                (order.get("user_id"), normalize_phone(order.get("phone")), order["status"],
+                 json.dumps(order, ensure_ascii=False), order["id"])
+            )
+
+    # UPDATE ... RETURNING выполняется одной транзакцией: заказ получит только один процесс
+    def claim(self, order_id):
+        with self.io_timer():
+            row = self.conn.execute(
+                f"UPDATE orders SET status = ? WHERE id = ? AND status = ? RETURNING {self.COLUMNS}",
+                (ORDER_CONFIRMED, order_id, ORDER_PENDING)
+            ).fetchone()
+        return self.row_order(row) if row else None
+
+    def release(self, order_id):
+        with self.io_timer():
+            self.conn.execute("UPDATE orders SET status = ? WHERE id = ?", (ORDER_PENDING, order_id))
+
+    def user_orders(self, user_id, offset=0, limit=5):
+        cursor = self.conn.execute(
+            f"SELECT {self.COLUMNS} FROM orders WHERE user_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (user_id, limit, offset)
+        )
+        return [self.row_order(row) for row in cursor]
+
+    def count_user_orders(self, user_id):
+        return self.conn.execute("SELECT COUNT(*) FROM orders WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def phone_orders(self, phone, limit=10):
+        cursor = self.conn.execute(
+            f"SELECT {self.COLUMNS} FROM orders WHERE phone = ? ORDER BY id DESC LIMIT ?",
+            (normalize_phone(phone), limit)
+        )
+        return [self.row_order(row) for row in cursor]
+
+    def count(self, status):
+        return self.conn.execute("SELECT COUNT(*) FROM orders WHERE status = ?", (status,)).fetchone()[0]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    async def close(self):
+        self.conn.close()
@@ -0,0 +1,146 @@
+import re
+from bisect import bisect_left
+
+# Поиск по меню для inline-режима (@бот пицца). Индекс строится один раз
+# на версию каталога: словарь слово -> товары, отсортированный список слов
+# для поиска по началу слова и словарь вариантов слов без одной буквы для
+# поиска с опечаткой (одна лишняя, пропущенная, заменённая или переставленная буква).
+# Запрос разбивается на слова, товар должен подходить под каждое из них
+
+WORD = re.compile(r"\w+")
+
+# Вес совпадения: слово в названии важнее слова в описании, точное совпадение
+# важнее совпадения по началу слова, а то - совпадения с опечаткой
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+PREFIX_FACTOR = 0.7
+FUZZY_FACTOR = 0.5
+# Слова короче не ищутся с опечаткой: у коротких слов слишком много соседей
+FUZZY_MIN_LENGTH = 4
+
+
+def normalize(text):
+    return text.lower().replace("ё", "е")
+
+
+def words(text):
+    return WORD.findall(normalize(text))
+
+
+def deletions(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+# Расстояние Дамерау-Левенштейна не больше единицы
+def within_one_edit(a, b):
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    if a[i + 1:] == b[i + 1:]:
+        return True
+    return i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]
+
+
+class MenuSearchIndex:
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.ids = tuple(item.id for item in catalog.items)
+        # слово -> {позиция товара в меню: вес}
+        self.postings = {}
+        for position, item in enumerate(catalog.items):
+            for text, weight in ((item.description, DESCRIPTION_WEIGHT), (item.name, NAME_WEIGHT)):
+                for word in words(text):
+                    entry = self.postings.setdefault(word, {})
+                    entry[position] = max(entry.get(position, 0), weight)
+        self.vocabulary = sorted(self.postings)
+        self.variants = {}
+        for word in self.vocabulary:
+            if len(word) >= FUZZY_MIN_LENGTH:
+                for variant in deletions(word) | {word}:
+                    self.variants.setdefault(variant, []).append(word)
+        self.rankings = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Слова словаря, начинающиеся с prefix
+    def completions(self, prefix):
+        start = bisect_left(self.vocabulary, prefix)
+        end = bisect_left(self.vocabulary, prefix + "\uffff", start)
+        return self.vocabulary[start:end]
+
+    # Слова словаря на расстоянии одной правки от word
+    def corrections(self, word):
+        if len(word) < FUZZY_MIN_LENGTH:
+            return set()
+        candidates = set()
+        for variant in deletions(word) | {word}:
+            candidates.update(self.variants.get(variant, ()))
+        return {candidate for candidate in candidates if candidate != word and within_one_edit(word, candidate)}
+
+    # Слова словаря, подходящие под слово запроса, с множителем веса
+    def candidates(self, word):
+        matches = [(candidate, 1.0 if candidate == word else PREFIX_FACTOR) for candidate in self.completions(word)]
+        matches += [(candidate, FUZZY_FACTOR) for candidate in self.corrections(word)]
+        return matches
+
+    # Оценки товаров (по позиции в меню), подходящих под одно слово запроса
+    def match_word(self, word):
+        matches = self.candidates(word)
+        if not matches:
+            return {}
+        candidate, factor = matches[0]
+        if len(matches) == 1 and factor == 1.0:
+            return self.postings[candidate]
+        scores = {position: weight * factor for position, weight in self.postings[candidate].items()}
+        for candidate, factor in matches[1:]:
+            for position, weight in self.postings[candidate].items():
+                score = weight * factor
+                if score > scores.get(position, 0):
+                    scores[position] = score
+        return scores
+
+    # Сортировка по одному целому ключу: сначала оценка (в сотых), при равной - порядок в меню
+    def rank(self, scores):
+        stride = len(self.ids)
+        keys = sorted([position - round(score * 100) * stride for position, score in scores.items()])
+        ids = self.ids
+        return tuple([ids[key % stride] for key in keys])
+
+    # Товары одного слова словаря по убыванию веса; считаются при первом запросе
+    def word_ranking(self, word):
+        ranking = self.rankings.get(word)
+        if ranking is None:
+            ranking = self.rankings[word] = self.rank(self.postings[word])
+        return ranking
+
+    # ID товаров по убыванию релевантности; пустой запрос - всё меню по порядку
+    def search(self, query):
+        query_words = list(dict.fromkeys(words(query)))
+        if not query_words:
+            return self.ids
+        # Одно слово, которому соответствует одно слово словаря (самый частый случай
+        # при наборе запроса): множитель у всех товаров общий, порядок уже известен
+        if len(query_words) == 1:
+            matches = self.candidates(query_words[0])
+            if len(matches) == 1:
+                return self.word_ranking(matches[0][0])
+        scores = None
+        for word in query_words:
+            word_scores = self.match_word(word)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {position: score + word_scores[position] for position, score in scores.items()
+                          if position in word_scores}
+            if not scores:
+                return ()
+        return self.rank(scores)
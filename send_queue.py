@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+# Ограничение исходящих запросов к Telegram. Все запросы к конкретному чату
+# проходят через общий и per-chat token bucket, а ответ 429 (retry_after)
+# приостанавливает чат и запрос повторяется, а не теряется
+
+PRIORITY_KITCHEN = 0
+PRIORITY_ADMIN = 1
+PRIORITY_INFO = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_KITCHEN: "kitchen",
+    PRIORITY_ADMIN: "admin",
+    PRIORITY_INFO: "info",
+}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    # Через сколько секунд можно будет взять токен
+    def delay(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now):
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+# chat_limits - {ID чата: (частота, запас)} для чатов со своим лимитом
+class RateLimiter:
+    def __init__(self, global_rate=25, chat_rate=1, chat_burst=3, max_chats=10000, chat_limits=None):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_limits = chat_limits or {}
+        self.max_chats = max_chats
+        self.chats = {}
+
+    def bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= self.max_chats:
+                self.prune()
+            rate, burst = self.chat_limits.get(chat_id, (self.chat_rate, self.chat_burst))
+            bucket = self.chats[chat_id] = TokenBucket(rate, burst)
+        return bucket
+
+    # Полные и не заблокированные корзины ничего не помнят - их можно выбросить
+    def prune(self):
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self.chats.items() if bucket.idle(now)]:
+            del self.chats[chat_id]
+
+    def delay(self, chat_id):
+        now = time.monotonic()
+        return max(self.global_bucket.delay(now), self.bucket(chat_id).delay(now))
+
+    async def acquire(self, chat_id):
+        while True:
+            delay = self.delay(chat_id)
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self.global_bucket.take()
+        self.bucket(chat_id).take()
+
+    def retry_after(self, chat_id, seconds):
+        self.bucket(chat_id).block(seconds, time.monotonic())
+
+
+# Middleware сессии бота: через неё проходят все запросы, включая ответы
+# в обработчиках (message.answer, edit_text и т.д.)
+class RateLimitMiddleware(BaseRequestMiddleware):
+    def __init__(self, limiter, metrics, max_retries=5):
+        self.limiter = limiter
+        self.metrics = metrics
+        self.max_retries = max_retries
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.metrics["retry_after"] += 1
+                self.limiter.retry_after(chat_id, e.retry_after)
+                if attempt == self.max_retries:
+                    raise
+                logging.warning("Telegram просит подождать %s с (чат %s)", e.retry_after, chat_id)
+                continue
+            self.metrics["requests"] += 1
+            return result
+
+
+# Очередь уведомлений. У каждого чата своя очередь с приоритетами (тикеты кухни
+# раньше информационных сообщений), сообщения в чат уходят по одному, поэтому
+# ожидание лимита или retry_after в одном чате не задерживает другие
+class OutboundQueue:
+    def __init__(self, bot, metrics, max_retries=3):
+        self.bot = bot
+        self.metrics = metrics
+        self.max_retries = max_retries
+        self.sequence = itertools.count()
+        self.chats = {}
+        self.tasks = set()
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    # Ставит запрос (например, SendMessage) в очередь и сразу возвращает Future
+    # с результатом. Ошибки доставки пишутся в лог, ждать Future не обязательно
+    def submit(self, method, priority=PRIORITY_INFO):
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        item = (priority, next(self.sequence), time.monotonic(), method, future)
+        self.metrics[f"queued_{PRIORITY_NAMES.get(priority, priority)}"] += 1
+
+        chat_id = method.chat_id
+        queue = self.chats.get(chat_id)
+        if queue is not None:
+            heapq.heappush(queue, item)
+            return future
+        self.chats[chat_id] = [item]
+        task = asyncio.create_task(self.drain_chat(chat_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return future
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.chats.values())
+
+    async def drain_chat(self, chat_id):
+        queue = self.chats[chat_id]
+        try:
+            while queue:
+                await self.deliver(heapq.heappop(queue))
+        finally:
+            del self.chats[chat_id]
+
+    async def deliver(self, item):
+        priority, _, enqueued_at, method, future = item
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await self.bot(method)
+                break
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt == self.max_retries:
+                    return self.fail(method, future, e)
+                self.metrics["network_retries"] += 1
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                return self.fail(method, future, e)
+
+        latency = time.monotonic() - enqueued_at
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.metrics["delivered"] += 1
+        if not future.done():
+            future.set_result(result)
+
+    def fail(self, method, future, error):
+        self.metrics["failed"] += 1
+        logging.error("Не удалось отправить %s в чат %s: %s",
+                      type(method).__name__, getattr(method, "chat_id", None), error)
+        if not future.done():
+            future.set_exception(error)
+
+    def stats(self):
+        delivered = self.metrics["delivered"]
+        return {
+            **self.metrics,
+            "pending": len(self),
+            "latency_avg": self.latency_total / delivered if delivered else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+    # Дожидается отправки всего, что уже в очереди
+    async def drain(self, timeout=10):
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=timeout)
+
+
+def create_send_queue(bot, global_rate=25, chat_rate=1, chat_burst=3, chat_limits=None):
+    metrics = Counter()
+    limiter = RateLimiter(global_rate, chat_rate, chat_burst, chat_limits=chat_limits)
+    bot.session.middleware(RateLimitMiddleware(limiter, metrics))
+    return OutboundQueue(bot, metrics)
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+from collections import Counter, deque
+
+import aiohttp
+
+from idempotency import DedupCache
+
+# Многопроцессный режим. Главный процесс принимает обновления (webhook или
+# long polling) и раздаёт их рабочим процессам по ID пользователя: все
+# обновления одного пользователя попадают в один процесс, поэтому его
+# состояние FSM и корзина обрабатываются там же и по порядку. Обновления
+# передаются рабочим процессам пачками по HTTP на локальный адрес - тем же
+# webhook-приложением, которым бот принимает обновления от Telegram
+
+FORWARD_BATCH_SIZE = 100
+FORWARD_RETRY_MIN_DELAY = 0.1
+FORWARD_RETRY_MAX_DELAY = 5
+RESTART_DELAY = 1
+
+
+# ID пользователя из необработанного JSON обновления: главный процесс
+# не разбирает обновления в модели aiogram
+def raw_update_user_id(data):
+    for value in data.values():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if user:
+                return user["id"]
+            chat = value.get("chat")
+            if chat:
+                return chat["id"]
+    return 0
+
+
+class ShardRouter:
+    def __init__(self, urls, secret="", max_pending=1000, batch_size=FORWARD_BATCH_SIZE):
+        self.urls = urls
+        self.secret = secret
+        self.batch_size = batch_size
+        self.queues = [deque() for _ in urls]
+        self.wakeups = [asyncio.Event() for _ in urls]
+        # Сколько обновлений принято, но ещё не передано рабочим процессам
+        self.capacity = asyncio.Semaphore(max_pending)
+        # Telegram повторяет доставку, если не дождался ответа на webhook
+        self.delivered = DedupCache(ttl=300)
+        self.forwarded = Counter()
+        self.session = None
+        self.tasks = []
+
+    def shard_of(self, user_id):
+        return user_id % len(self.urls)
+
+    # Ждёт только если непереданных обновлений слишком много
+    async def submit(self, data):
+        if self.delivered.seen(data.get("update_id")):
+            return
+        await self.capacity.acquire()
+        shard = self.shard_of(raw_update_user_id(data))
+        self.queues[shard].append(data)
+        self.wakeups[shard].set()
+
+    async def start(self):
+        self.session = aiohttp.ClientSession()
+        self.tasks = [asyncio.create_task(self.forward(shard)) for shard in range(len(self.urls))]
+
+    # Очередь процесса отправляется пачками по одной: так обновления
+    # пользователя приходят в рабочий процесс в том порядке, в котором приняты
+    async def forward(self, shard):
+        queue = self.queues[shard]
+        wakeup = self.wakeups[shard]
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.secret} if self.secret else {}
+        retry_delay = FORWARD_RETRY_MIN_DELAY
+        while True:
+            await wakeup.wait()
+            batch = [queue[i] for i in range(min(len(queue), self.batch_size))]
+            try:
+                async with self.session.post(self.urls[shard], json=batch, headers=headers) as response:
+                    if response.status >= 500 or response.status == 401:
+                        raise aiohttp.ClientResponseError(response.request_info, (), status=response.status)
+                    if response.status != 200:
+                        logging.error("Процесс %s отклонил пачку обновлений: HTTP %s", shard, response.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Процесс ещё запускается или перезапускается - повторяем ту же пачку
+                logging.warning("Процесс %s недоступен, повтор через %.1f с: %s", shard, retry_delay, e)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, FORWARD_RETRY_MAX_DELAY)
+                continue
+            retry_delay = FORWARD_RETRY_MIN_DELAY
+            for _ in batch:
+                queue.popleft()
+                self.capacity.release()
+            self.forwarded[shard] += len(batch)
+            if not queue:
+                wakeup.clear()
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues)
+
+    # Дожидается передачи принятых обновлений (не дольше timeout секунд)
+    async def stop(self, timeout=10):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.pending() and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.session.close()
+
+
+# Рабочие процессы: тот же скрипт бота с номером процесса в BOT_SHARD.
+# Упавший процесс перезапускается, обновления для него ждут в очереди ShardRouter
+class ShardProcesses:
+    def __init__(self, script, count, env=None):
+        self.script = script
+        self.count = count
+        self.env = env or {}
+        self.processes = [None] * count
+        self.tasks = []
+        self.stopping = False
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self.supervise(shard)) for shard in range(self.count)]
+
+    async def supervise(self, shard):
+        env = dict(os.environ, **self.env, BOT_SHARD=str(shard))
+        while not self.stopping:
+            # Своя группа процессов: Ctrl+C в терминале получает только главный процесс
+            process = await asyncio.create_subprocess_exec(sys.executable, self.script, env=env,
+                                                           start_new_session=os.name != "nt")
+            self.processes[shard] = process
+            code = await process.wait()
+            if not self.stopping:
+                logging.error("Процесс %s завершился с кодом %s, перезапуск", shard, code)
+                await asyncio.sleep(RESTART_DELAY)
+
+    # SIGINT, чтобы процесс штатно дописал журналы и очереди
+    async def stop(self, timeout=30):
+        self.stopping = True
+        running = [process for process in self.processes if process and process.returncode is None]
+        for process in running:
+            if os.name == "nt":
+                process.terminate()
+            else:
+                process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(process.wait() for process in running)), timeout)
+        except asyncio.TimeoutError:
+            for process in running:
+                if process.returncode is None:
+                    process.kill()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
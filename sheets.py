@@ -0,0 +1,102 @@
+import os
+import time
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+# Подключение к Google Sheets. Модуль импортируется лениво (gspread и oauth2client
+# загружаются долго), поэтому бот начинает принимать обновления, не дожидаясь их
+
+SHEETS_HANDLE_TTL = int(os.getenv("SHEETS_HANDLE_TTL", "1800"))
+SHEETS_PHONE_COLUMN = 2
+
+
+def get_google_sheet():
+    try:
+        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+        creds = ServiceAccountCredentials.from_json_keyfile_name('google_credentials.json', scope)
+        client = gspread.authorize(creds)
+        sheet = client.open('FoodDeliveryCustomers').sheet1
+        return sheet
+    except Exception as e:
+        print(f"Ошибка при подключении к Google Sheets: {e}")
+        return None
+
+
+# Долгоживущее подключение к листу и индекс "телефон -> номер строки".
+# Индекс строится один раз по колонке телефонов, обновляется при записи
+# и периодически сверяется с таблицей на случай ручных правок.
+# open_sheet может возвращать любой объект с интерфейсом gspread.Worksheet
+# (например, фейковый лист в тестах)
+class SheetsClient:
+    def __init__(self, open_sheet, handle_ttl=SHEETS_HANDLE_TTL):
+        self.open_sheet = open_sheet
+        self.handle_ttl = handle_ttl
+        self.sheet = None
+        self.opened_at = 0
+        self.phone_index = None
+
+    def get_sheet(self):
+        if self.sheet is None or time.monotonic() - self.opened_at > self.handle_ttl:
+            self.sheet = self.open_sheet()
+            self.opened_at = time.monotonic()
+        if not self.sheet:
+            raise RuntimeError("не удалось подключиться к Google Sheets")
+        return self.sheet
+
+    def reset(self):
+        self.sheet = None
+        self.phone_index = None
+
+    def reconcile(self):
+        phones = self.get_sheet().col_values(SHEETS_PHONE_COLUMN)
+        index = {}
+        for i, phone in enumerate(phones, start=1):
+            if phone:
+                index.setdefault(phone, i)
+        self.phone_index = index
+
+    # Запись пачки строк: существующие заказы обновляются одним batch_update,
+    # новые добавляются одним append_rows
+    def flush(self, rows):
+        try:
+            sheet = self.get_sheet()
+            if self.phone_index is None:
+                self.reconcile()
+
+            latest = {}
+            for row in rows:
+                latest[row[1]] = row
+
+            updates = []
+            new_rows = []
+            for phone, row in latest.items():
+                row_index = self.phone_index.get(phone)
+                if row_index:
+                    updates.append({"range": f"A{row_index}:E{row_index}", "values": [row]})
+                else:
+                    new_rows.append(row)
+
+            if updates:
+                sheet.batch_update(updates)
+            if new_rows:
+                result = sheet.append_rows(new_rows)
+                self.index_appended_rows(result, new_rows)
+        except Exception:
+            # Подключение или индекс могли устареть: пересоздадим их при повторе
+            self.reset()
+            raise
+        print(f"Google Sheets: обновлено {len(updates)}, добавлено {len(new_rows)} заказов")
+
+    def index_appended_rows(self, result, new_rows):
+        # Номер первой добавленной строки берём из ответа API ("Лист1!A10:E12"),
+        # если его нет - перестроим индекс при следующей записи
+        try:
+            updated_range = result["updates"]["updatedRange"]
+            first_cell = updated_range.split("!")[-1].split(":")[0]
+            start_row = int(first_cell.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+        except (KeyError, TypeError, ValueError):
+            self.phone_index = None
+            return
+        for offset, row in enumerate(new_rows):
+            self.phone_index.setdefault(row[1], start_row + offset)
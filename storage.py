@@ -0,0 +1,176 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+# Постоянное хранилище состояний FSM и корзин в локальной SQLite-базе.
+# Последние использованные записи держатся в памяти (ограниченный LRU-слой),
+# изменения копятся и записываются на диск одной транзакцией раз в
+# flush_interval секунд. Записи, которые не менялись дольше ttl секунд,
+# считаются брошенными и удаляются
+
+
+class PersistentDict:
+    def __init__(self, conn, table, ttl, hot_size):
+        self.conn = conn
+        self.table = table
+        self.ttl = ttl
+        self.hot_size = hot_size
+        # key -> (value, updated); value None - запись удалена, но ещё не сброшена на диск
+        self.hot = OrderedDict()
+        self.dirty = set()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_updated ON {table} (updated)")
+        conn.commit()
+
+    def get(self, key, default=None):
+        key = str(key)
+        entry = self.hot.get(key)
+        if entry is None:
+            row = self.conn.execute(
+                f"SELECT value, updated FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return default
+            entry = (json.loads(row[0]), row[1])
+            self.remember(key, entry)
+        else:
+            self.hot.move_to_end(key)
+
+        value, updated = entry
+        if value is None or time.time() - updated > self.ttl:
+            return default
+        return value
+
+    # Значение, полученное через get, после изменения нужно сохранить через set
+    def set(self, key, value):
+        key = str(key)
+        self.remember(key, (value, time.time()))
+        self.dirty.add(key)
+
+    def delete(self, key):
+        key = str(key)
+        self.remember(key, (None, time.time()))
+        self.dirty.add(key)
+
+    def remember(self, key, entry):
+        self.hot[key] = entry
+        self.hot.move_to_end(key)
+        while len(self.hot) > self.hot_size:
+            old_key, old_entry = self.hot.popitem(last=False)
+            if old_key in self.dirty:
+                # Вытесняемую несохранённую запись пишем сразу
+                self.dirty.discard(old_key)
+                self.write([(old_key, old_entry)])
+
+    def write(self, entries):
+        upserts = [(key, json.dumps(value, ensure_ascii=False), updated)
+                   for key, (value, updated) in entries if value is not None]
+        deletes = [(key,) for key, (value, _) in entries if value is None]
+        with self.conn:
+            if upserts:
+                self.conn.executemany(
+                    f"INSERT INTO {self.table} (key, value, updated) VALUES (?, ?, ?) "
+                    f"ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+                    upserts
+                )
+            if deletes:
+                self.conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", deletes)
+
+    def flush(self):
+        if not self.dirty:
+            return
+        entries = [(key, self.hot[key]) for key in self.dirty if key in self.hot]
+        self.dirty.clear()
+        self.write(entries)
+        # Удалённые записи больше не нужно держать в памяти
+        for key, (value, _) in entries:
+            entry = self.hot.get(key)
+            if value is None and entry is not None and entry[0] is None:
+                del self.hot[key]
+
+    def evict_expired(self):
+        deadline = time.time() - self.ttl
+        for key in [key for key, (_, updated) in self.hot.items() if updated < deadline]:
+            if key not in self.dirty:
+                del self.hot[key]
+        with self.conn:
+            cursor = self.conn.execute(f"DELETE FROM {self.table} WHERE updated < ?", (deadline,))
+        return cursor.rowcount
+
+
+class SqliteStorage(BaseStorage):
+    def __init__(self, path, ttl, hot_size=10000, flush_interval=1.0, sweep_interval=3600):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.hot_size = hot_size
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.sessions = PersistentDict(self.conn, "fsm", ttl, hot_size)
+        self.tables = [self.sessions]
+        self.closed = False
+
+    # Дополнительная таблица в той же базе с общим циклом записи (например, корзины)
+    def table(self, name, ttl, hot_size=None):
+        table = PersistentDict(self.conn, name, ttl, hot_size or self.hot_size)
+        self.tables.append(table)
+        return table
+
+    def save_record(self, key, state, data):
+        if state is None and not data:
+            self.sessions.delete(key)
+        else:
+            self.sessions.set(key, {"state": state, "data": data})
+
+    async def set_state(self, key, state=None):
+        key = self.key_builder.build(key)
+        record = self.sessions.get(key, {})
+        state = state.state if isinstance(state, State) else state
+        self.save_record(key, state, record.get("data", {}))
+
+    async def get_state(self, key):
+        return self.sessions.get(self.key_builder.build(key), {}).get("state")
+
+    async def set_data(self, key, data):
+        key = self.key_builder.build(key)
+        record = self.sessions.get(key, {})
+        self.save_record(key, record.get("state"), dict(data))
+
+    async def get_data(self, key):
+        return dict(self.sessions.get(self.key_builder.build(key), {}).get("data", {}))
+
+    def flush(self):
+        for table in self.tables:
+            table.flush()
+
+    async def run(self):
+        last_sweep = time.monotonic()
+        while not self.closed:
+            await asyncio.sleep(self.flush_interval)
+            if self.closed:
+                break
+            try:
+                self.flush()
+                if time.monotonic() - last_sweep > self.sweep_interval:
+                    last_sweep = time.monotonic()
+                    removed = sum(table.evict_expired() for table in self.tables)
+                    if removed:
+                        print(f"Удалено устаревших сессий и корзин: {removed}")
+            except Exception as e:
+                print(f"Ошибка записи состояний: {e}")
+
+    async def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self.conn.close()